@@ -4,24 +4,38 @@ from collections import defaultdict
 from metric_learning.constants.distance_function import DistanceFunction
 from tqdm import tqdm
 from util.registry.data_loader import DataLoader
+from util.label_index import LabelIndex
+from util.memory_bank import MemoryBank
+from util.weight_table import WeightTable
+from util.weight_table import get_weight_table
 from util.tensor_operations import pairwise_matching_matrix
 from util.tensor_operations import get_n_blocks
-from util.tensor_operations import pairwise_product
 from util.tensor_operations import pairwise_sum
 from util.tensor_operations import compute_pairwise_distances
 from util.tensor_operations import upper_triangular_part
 from util.tensor_operations import stable_sqrt
+from util.tensor_operations import static_indices
 
 import math
 import numpy as np
 import tensorflow as tf
-import random
+
+
+SAMPLE_CHUNK_SIZE = 64
+
+# losses that take their pairs from get_pairwise_distances, which is where
+# the memory bank pairs are added. triplet, margin and lifted mine within a
+# square [batch_size, batch_size] distance matrix (semi-hard negatives,
+# distance weighted sampling, row-wise log-sum-exp) and npair pairs fixed
+# blocks of the batch, so none of them can take the rectangular batch by
+# bank pairs without rewriting their mining
+MEMORY_BANK_LOSSES = ['contrastive', 'l1_contrastive', 'logistic']
 
 
 def get_npair_distances(embeddings, n, distance_function, transpose=False):
-    num_groups = int(embeddings.shape[0]) // 2
-    evens = tf.range(num_groups, dtype=tf.int64) * 2
-    odds = tf.range(num_groups, dtype=tf.int64) * 2 + 1
+    num_groups = tf.shape(embeddings)[0] // 2
+    evens = tf.range(num_groups) * 2
+    odds = tf.range(num_groups) * 2 + 1
     even_embeddings = tf.gather(embeddings, evens)
     odd_embeddings = tf.gather(embeddings, odds)
 
@@ -40,6 +54,24 @@ class GroupedBatchDesign(BatchDesign):
 
     cache = {}
 
+    label_index = None
+
+    memory_bank = None
+
+    def __init__(self, conf, extra_info):
+        super(GroupedBatchDesign, self).__init__(conf, extra_info)
+        if conf['batch_design'].get('memory_bank_size'):
+            if conf['batch_design'].get('npair'):
+                raise Exception('memory_bank_size cannot be combined with npair')
+            if conf['loss']['name'] not in MEMORY_BANK_LOSSES:
+                raise Exception('memory_bank_size is only supported with the {} losses, not {}'.format(
+                    ', '.join(MEMORY_BANK_LOSSES), conf['loss']['name']))
+            if conf['batch_design'].get('negative_class_mining'):
+                # the mined weights depend on the class weights of both
+                # members of a pair within one grouped batch, which a pair
+                # with the bank does not form
+                raise Exception('memory_bank_size cannot be combined with negative_class_mining')
+
     def create_dataset(self, model, image_files, labels, batch_conf,
                        testing=False):
         data_map = defaultdict(int)
@@ -107,37 +139,32 @@ class GroupedBatchDesign(BatchDesign):
                 5
             )
 
-        data = []
-        for _ in range(batch_conf['num_batches'] * batch_conf.get('combine_batches', 1)):
-            elements = self.get_next_batch(image_files, labels, batch_conf)
-            data += elements
+        return self._create_epoch_dataset(image_files, labels, batch_conf, testing)
 
-        return tf.data.Dataset.zip(
-            self._create_datasets_from_elements(data, testing),
-        ), len(data)
-
-    def get_next_batch(self, image_files, labels, batch_conf):
-        data = list(zip(image_files, labels))
-        random.shuffle(data)
+    def get_label_index(self, labels):
+        if self.label_index is None or self.label_index[0] is not labels:
+            self.label_index = (labels, LabelIndex(labels))
+        return self.label_index[1]
 
+    def sample_batches(self, labels, batch_conf, num_batches):
+        label_index = self.get_label_index(labels)
         batch_size = batch_conf['batch_size']
         if batch_conf.get('uniform'):
-            return data[0:batch_size]
+            return label_index.sample_uniform(num_batches, batch_size)
         group_size = batch_conf['group_size']
-        num_groups = batch_size // group_size
-        data_map = defaultdict(list)
-        for image_file, label in data:
-            data_map[label].append(image_file)
-
-        data_map = dict(filter(lambda x: len(x[1]) >= group_size, data_map.items()))
-        sampled_labels = np.random.choice(
-            list(data_map.keys()), size=num_groups, replace=False)
-        grouped_data = []
-        for label in sampled_labels:
-            for _ in range(group_size):
-                image_file = data_map[label].pop()
-                grouped_data.append((image_file, label))
-        return grouped_data
+        return label_index.sample_groups(
+            num_batches, batch_size // group_size, group_size)
+
+    def sample_indices(self, image_files, labels, batch_conf):
+        num_batches = batch_conf['num_batches'] * batch_conf.get('combine_batches', 1)
+        for start in range(0, num_batches, SAMPLE_CHUNK_SIZE):
+            for indices in self.sample_batches(
+                    labels, batch_conf, min(SAMPLE_CHUNK_SIZE, num_batches - start)):
+                yield indices
+
+    def get_next_batch(self, image_files, labels, batch_conf):
+        indices = self.sample_batches(labels, batch_conf, 1)[0]
+        return [(image_files[index], labels[index]) for index in indices]
 
     def get_raw_pairwise_distances(self, batch, model, distance_function, training=True):
         images, labels = batch
@@ -175,64 +202,162 @@ class GroupedBatchDesign(BatchDesign):
                 embeddings, embeddings, distance_function)
             matching_labels_matrix = pairwise_matching_matrix(labels, labels)
             weights = self.get_pairwise_weights(labels, group_size, model.extra_info)
-            return (
+            ret = (
                 upper_triangular_part(pairwise_distances),
                 upper_triangular_part(matching_labels_matrix),
                 upper_triangular_part(1 / weights) ** q_bias,
             )
+            if training and self.uses_memory_bank():
+                ret = self.add_memory_bank_pairs(
+                    ret, embeddings, labels, distance_function, model.extra_info)
+            return ret
+
+    def uses_memory_bank(self):
+        return bool(self.conf['batch_design'].get('memory_bank_size'))
+
+    def get_memory_bank(self, dimension):
+        if self.memory_bank is None:
+            with tf.init_scope():
+                self.memory_bank = MemoryBank(
+                    self.conf['batch_design']['memory_bank_size'], dimension)
+        return self.memory_bank
+
+    def add_memory_bank_pairs(self, pairs, embeddings, labels, distance_function, extra_info):
+        # every embedding of the batch is also paired with the embeddings of
+        # earlier batches in the memory bank, after which the batch replaces
+        # the oldest entries of the bank
+        memory_bank = self.get_memory_bank(embeddings.shape[1].value)
+        bank_embeddings, bank_labels = memory_bank.read()
+        distances = compute_pairwise_distances(embeddings, bank_embeddings, distance_function)
+        matching_labels_matrix = pairwise_matching_matrix(labels, bank_labels)
+        batch_size = labels.shape[0].value or self.conf['batch_design']['batch_size']
+        group_size = self.conf['batch_design']['group_size']
+        table = get_weight_table(
+            extra_info,
+            ('pairwise', id(self.conf), batch_size, group_size),
+            lambda: self.create_weight_table(batch_size, group_size, extra_info))
+        weights = table.weights(labels, bank_labels, matching_labels_matrix)
+        q_bias = self.conf['batch_design'].get('q_bias', 1.0)
+        with tf.control_dependencies([distances, matching_labels_matrix, weights]):
+            memory_bank.enqueue(embeddings, labels)
+        return (
+            tf.concat([pairs[0], tf.reshape(distances, [-1])], axis=0),
+            tf.concat([pairs[1], tf.reshape(matching_labels_matrix, [-1])], axis=0),
+            tf.concat([pairs[2], tf.reshape(1 / weights, [-1]) ** q_bias], axis=0),
+        )
+
+    def has_static_pair_layout(self):
+        # grouped batches consist of batch_size // group_size consecutive
+        # groups with distinct labels; pairs with the memory bank follow no
+        # fixed layout
+        batch_design_conf = self.conf['batch_design']
+        return not batch_design_conf.get('uniform') and not batch_design_conf.get('npair') and \
+            not self.uses_memory_bank()
+
+    def get_pair_segments(self, values, matching_labels_matrix):
+        batch_size = self.conf['batch_design']['batch_size']
+        if not self.has_static_pair_layout() or \
+                values.shape[0].value != batch_size * (batch_size - 1) // 2:
+            return super(GroupedBatchDesign, self).get_pair_segments(
+                values, matching_labels_matrix)
+        segments = static_indices(
+            'upper_triangular_group_segments',
+            batch_size,
+            self.conf['batch_design']['group_size'])
+        return tf.gather(values, segments[0]), tf.gather(values, segments[1])
 
     @staticmethod
-    def get_npair_pairwise_weights(labels, npair, extra_info):
-        batch_size = int(labels.shape[0])
-        group_size = 2
-        num_groups = batch_size // group_size
+    def create_npair_weight_table(npair, extra_info):
         num_labels = extra_info['num_labels']
-        evens = tf.range(num_groups, dtype=tf.int64) * 2
-        even_labels = tf.gather(labels, evens)
         num_average_images_per_label = extra_info['num_images'] / extra_info['num_labels']
-        label_counts = tf.gather(
-            tf.constant(extra_info['label_counts'], dtype=tf.float32),
-            even_labels) / num_average_images_per_label
-        label_counts_multiplied = get_n_blocks(
-            pairwise_product(label_counts, label_counts),
-            npair)
-        positive_label_counts = label_counts[:, None]
-        negative_weights = (npair - 1) / (num_labels - 1) / label_counts_multiplied
-        positive_weights = 1 / positive_label_counts / (positive_label_counts - 1 / num_average_images_per_label)
+        label_counts = np.asarray(extra_info['label_counts'], dtype=np.float64)
+        normalized_label_counts = label_counts / num_average_images_per_label
+        with np.errstate(divide='ignore'):
+            return WeightTable(
+                label_counts,
+                1 / normalized_label_counts / (normalized_label_counts - 1 / num_average_images_per_label),
+                1 / normalized_label_counts,
+                (npair - 1) / (num_labels - 1))
+
+    @staticmethod
+    def get_npair_pairwise_weights(labels, npair, extra_info):
+        table = get_weight_table(
+            extra_info,
+            ('npair', npair),
+            lambda: GroupedBatchDesign.create_npair_weight_table(npair, extra_info))
+        num_groups = tf.shape(labels)[0] // 2
+        even_labels = tf.gather(labels, tf.range(num_groups) * 2)
+        negative_weights = get_n_blocks(
+            table.negative_weights(even_labels, even_labels), npair)
+        positive_weights = table.positive_weights(even_labels)[:, None] * tf.ones_like(negative_weights)
         matching_labels_matrix = get_n_blocks(tf.cast(tf.eye(num_groups), tf.bool), npair)
-        weights = positive_weights * tf.cast(matching_labels_matrix, tf.float32) + negative_weights * tf.cast(~matching_labels_matrix, tf.float32)
-        return weights
+        return tf.where(matching_labels_matrix, positive_weights, negative_weights)
 
     def get_npair_weights(self, labels, npair, extra_info):
-        batch_size = int(labels.shape[0])
         group_size = 2
-        num_groups = batch_size // group_size
-        evens = tf.range(num_groups, dtype=tf.int64) * 2
+        num_groups = tf.shape(labels)[0] // group_size
+        evens = tf.range(num_groups) * 2
         even_labels = tf.gather(labels, evens)
 
         num_labels = extra_info['num_labels']
         log_uniform = npair * math.log(num_labels)
-        weight_sum = float(sum(self.cache['class_weights']))
+        weight_sum = tf.reduce_sum(self.cache['class_weights'])
         label_weights = tf.gather(self.cache['class_weights'], tf.reshape(even_labels, [-1, npair]))
-        log_label_weights = tf.reduce_sum(tf.log(label_weights) - math.log(weight_sum), axis=1)
+        log_label_weights = tf.reduce_sum(tf.log(label_weights) - tf.log(weight_sum), axis=1)
         weights = tf.exp(log_uniform + log_label_weights)
         return tf.reshape(tf.transpose(tf.reshape(tf.tile(weights, [npair]), [-1, 2])), [-1])
 
-    def get_pairwise_weights(self, labels, group_size, extra_info):
-        batch_size = int(labels.shape[0])
+    def create_weight_table(self, batch_size, group_size, extra_info):
         num_groups = batch_size // group_size
         num_images = extra_info['num_images']
-        label_counts = tf.gather(
-            tf.constant(extra_info['label_counts'], dtype=tf.float32),
-            labels)
-        positive_label_counts = label_counts
-        matching_labels_matrix = pairwise_matching_matrix(labels, labels)
-        label_counts_multiplied = pairwise_product(label_counts, label_counts)
         num_labels = extra_info['num_labels']
+        label_counts = np.asarray(extra_info['label_counts'], dtype=np.float64)
+        image_pairs = num_images * (num_images - 1)
+        with np.errstate(divide='ignore'):
+            if self.conf['loss'].get('new_importance_sampling'):
+                return WeightTable(
+                    label_counts,
+                    (group_size - 1) * image_pairs / (
+                        label_counts * (label_counts - 1) * num_labels * (batch_size - 1)
+                    ) * self.conf['loss']['l'] / (num_labels - 1),
+                    1 / label_counts,
+                    (num_groups - 1) * group_size * image_pairs / (
+                        (batch_size - 1) * num_labels * (num_labels - 1)))
+            if self.conf['loss'].get('balanced_pairs') and not self.conf['batch_design'].get('uniform'):
+                return WeightTable(
+                    label_counts,
+                    1.,
+                    1.,
+                    (num_groups - 1) * group_size / self.conf['loss']['l'] / (group_size - 1))
+            if self.conf['loss'].get('balanced_pairs') and self.conf['batch_design'].get('uniform'):
+                return WeightTable(
+                    label_counts,
+                    label_counts * (label_counts - 1) * num_labels / image_pairs,
+                    label_counts,
+                    num_labels * (num_labels - 1) / (image_pairs * self.conf['loss']['l']))
+            return WeightTable(
+                label_counts,
+                (group_size - 1) * image_pairs / (
+                    label_counts * (label_counts - 1) * num_labels * (batch_size - 1)),
+                1 / label_counts,
+                (num_groups - 1) * group_size * image_pairs / (
+                    (batch_size - 1) * num_labels * (num_labels - 1)))
+
+    def get_pairwise_weights(self, labels, group_size, extra_info):
+        batch_size = labels.shape[0].value or self.conf['batch_design']['batch_size']
+        table = get_weight_table(
+            extra_info,
+            ('pairwise', id(self.conf), batch_size, group_size),
+            lambda: self.create_weight_table(batch_size, group_size, extra_info))
+        matching_labels_matrix = pairwise_matching_matrix(labels, labels)
 
         if self.conf['batch_design'].get('negative_class_mining'):
+            num_groups = batch_size // group_size
+            num_images = extra_info['num_images']
+            num_labels = extra_info['num_labels']
+            positive_label_counts = tf.gather(table.label_counts, labels)
             class_weights = tf.gather(self.cache['class_weights'], labels)
-            class_weights = class_weights / sum(class_weights)
+            class_weights = class_weights / tf.reduce_sum(class_weights)
             class_weights_pairwise_sum = pairwise_sum(class_weights, class_weights)
             positive_weights = (group_size - 1) * num_images * (num_images - 1) / (
                     positive_label_counts * (positive_label_counts - 1) * num_labels * (batch_size - 1)) * (self.conf['loss']['l']) / (num_labels - 1) \
@@ -243,31 +368,7 @@ class GroupedBatchDesign(BatchDesign):
                                   + tf.pow(1 - class_weights_pairwise_sum, num_groups))
             weights = positive_weights * tf.cast(matching_labels_matrix, tf.float32) + negative_weights * tf.cast(~matching_labels_matrix, tf.float32)
             return weights
-        if self.conf['loss'].get('new_importance_sampling'):
-            positive_weights = (group_size - 1) * num_images * (num_images - 1) / (
-                    positive_label_counts * (positive_label_counts - 1) * num_labels * (batch_size - 1)) * (self.conf['loss']['l']) / (num_labels - 1)
-            negative_weights = (num_groups - 1) * group_size * num_images * (num_images - 1) / (
-                    (batch_size - 1) * num_labels * (num_labels - 1) * label_counts_multiplied)
-            weights = positive_weights * tf.cast(matching_labels_matrix, tf.float32) + negative_weights * tf.cast(~matching_labels_matrix, tf.float32)
-            return weights
-        if self.conf['loss'].get('balanced_pairs') and not self.conf['batch_design'].get('uniform'):
-            positive_weights = 1.
-            negative_weights = (num_groups - 1) * group_size / self.conf['loss']['l'] / (group_size - 1)
-            weights = positive_weights * tf.cast(matching_labels_matrix, tf.float32) + negative_weights * tf.cast(~matching_labels_matrix, tf.float32)
-            return weights
-        if self.conf['loss'].get('balanced_pairs') and self.conf['batch_design'].get('uniform'):
-            positive_weights =  (positive_label_counts * (positive_label_counts - 1) * num_labels) / \
-                                (num_images * (num_images - 1))
-            negative_weights = (num_labels * (num_labels - 1) * label_counts_multiplied) / \
-                               (num_images * (num_images - 1) * self.conf['loss']['l'])
-            weights = positive_weights * tf.cast(matching_labels_matrix, tf.float32) + negative_weights * tf.cast(~matching_labels_matrix, tf.float32)
-            return weights
-        positive_weights = (group_size - 1) * num_images * (num_images - 1) / (
-                positive_label_counts * (positive_label_counts - 1) * num_labels * (batch_size - 1))
-        negative_weights = (num_groups - 1) * group_size * num_images * (num_images - 1) / (
-                (batch_size - 1) * num_labels * (num_labels - 1) * label_counts_multiplied)
-        weights = positive_weights * tf.cast(matching_labels_matrix, tf.float32) + negative_weights * tf.cast(~matching_labels_matrix, tf.float32)
-        return weights
+        return table.weights(labels, labels, matching_labels_matrix)
 
     def get_npair_distances(self, batch, model, n, distance_function, training=True):
         if self.conf['batch_design']['group_size'] != 2:
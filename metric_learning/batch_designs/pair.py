@@ -52,8 +52,8 @@ class PairBatchDesign(BatchDesign):
     def get_pairwise_distances(self, batch, model, distance_function, training=True):
         images, labels = batch
         embeddings = model(images, training=training)
-        evens = tf.range(images.shape[0] // 2, dtype=tf.int64) * 2
-        odds = tf.range(images.shape[0] // 2, dtype=tf.int64) * 2 + 1
+        evens = tf.range(tf.shape(images, out_type=tf.int64)[0] // 2) * 2
+        odds = tf.range(tf.shape(images, out_type=tf.int64)[0] // 2) * 2 + 1
         even_embeddings = tf.gather(embeddings, evens)
         odd_embeddings = tf.gather(embeddings, odds)
         even_labels = tf.gather(labels, evens)
@@ -77,8 +77,8 @@ class PairBatchDesign(BatchDesign):
         label_counts = tf.gather(
             tf.constant(extra_info['label_counts'], dtype=tf.float32),
             labels)
-        evens = tf.range(labels.shape[0] // 2, dtype=tf.int64) * 2
-        odds = tf.range(labels.shape[0] // 2, dtype=tf.int64) * 2 + 1
+        evens = tf.range(tf.shape(labels, out_type=tf.int64)[0] // 2) * 2
+        odds = tf.range(tf.shape(labels, out_type=tf.int64)[0] // 2) * 2 + 1
         even_labels = tf.gather(labels, evens)
         odd_labels = tf.gather(labels, odds)
         match = tf.equal(even_labels, odd_labels)
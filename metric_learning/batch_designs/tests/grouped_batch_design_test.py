@@ -30,6 +30,29 @@ class GroupedBatchDesignTest(tf.test.TestCase):
             ('a', 3),
         ])
 
+    def testMemoryBankNeedsSupportedLoss(self):
+        conf = {
+            'batch_design': {
+                'name': 'grouped',
+                'group_size': 2,
+                'batch_size': 4,
+                'memory_bank_size': 8,
+            },
+            'loss': {'name': 'margin'},
+        }
+        with self.assertRaises(Exception):
+            BatchDesign.create('grouped', conf, {'data_loader': None})
+        conf['loss']['name'] = 'contrastive'
+        conf['batch_design']['npair'] = 2
+        with self.assertRaises(Exception):
+            BatchDesign.create('grouped', conf, {'data_loader': None})
+        del conf['batch_design']['npair']
+        conf['batch_design']['negative_class_mining'] = True
+        with self.assertRaises(Exception):
+            BatchDesign.create('grouped', conf, {'data_loader': None})
+        del conf['batch_design']['negative_class_mining']
+        self.assertTrue(BatchDesign.create('grouped', conf, {'data_loader': None}).uses_memory_bank())
+
     def testGetNpairDistances(self):
         embeddings = tf.constant([
             [1.],
@@ -1,6 +1,6 @@
 from util.registry.batch_design import BatchDesign
 
-
+import numpy as np
 import tensorflow as tf
 
 
@@ -8,10 +8,10 @@ class VanillaBatchDesign(BatchDesign):
     name = 'vanilla'
 
     def create_dataset(self, model, image_files, labels, batch_conf, testing=False):
-        data = list(zip(image_files, labels))
+        indices = np.arange(len(image_files), dtype=np.int32)
         return tf.data.Dataset.zip(
-            self._create_datasets_from_elements(data, testing),
-        ), len(data)
+            self._create_datasets_from_indices(image_files, labels, indices, testing),
+        ), len(indices)
 
     def get_pairwise_distances(self, batch, model, distance_function, training=True):
         raise NotImplementedError
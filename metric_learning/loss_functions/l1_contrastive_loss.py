@@ -12,19 +12,19 @@ class L1ContrastiveLossFunction(LossFunction):
 
         pairwise_distances, matching_labels_matrix, weights = dataset.get_pairwise_distances(
             batch, model, DistanceFunction.EUCLIDEAN_DISTANCE)
-        positive_distances = tf.boolean_mask(pairwise_distances, matching_labels_matrix)
-        negative_distances = tf.boolean_mask(pairwise_distances, ~matching_labels_matrix)
+        positive_distances, negative_distances = dataset.get_pair_segments(
+            pairwise_distances, matching_labels_matrix)
         if self.conf['loss'].get('importance_sampling') or self.conf['loss'].get('new_importance_sampling') or self.conf['loss'].get('balanced_pairs'):
-            positive_weights = tf.boolean_mask(weights, matching_labels_matrix)
-            negative_weights = tf.boolean_mask(weights, ~matching_labels_matrix)
+            positive_weights, negative_weights = dataset.get_pair_segments(
+                weights, matching_labels_matrix)
             loss_value = (
-                sum(positive_distances * positive_weights) +
-                sum(tf.maximum(0, alpha - negative_distances) * negative_weights)
-            ) / int(pairwise_distances.shape[0])
+                tf.reduce_sum(positive_distances * positive_weights) +
+                tf.reduce_sum(tf.maximum(0, alpha - negative_distances) * negative_weights)
+            ) / tf.cast(tf.shape(pairwise_distances)[0], tf.float32)
         else:
             loss_value = (
-                sum(positive_distances) +
-                sum(tf.maximum(0, alpha - negative_distances))
-            ) / int(pairwise_distances.shape[0])
+                tf.reduce_sum(positive_distances) +
+                tf.reduce_sum(tf.maximum(0, alpha - negative_distances))
+            ) / tf.cast(tf.shape(pairwise_distances)[0], tf.float32)
 
         return loss_value
@@ -27,7 +27,7 @@ class LiftedStructureLoss(LossFunction):
 
         max_elements = tf.maximum(
             row_negative_maximums, tf.transpose(row_negative_maximums))
-        batch_size = int(labels.shape[0])
+        batch_size = tf.shape(labels)[0]
         diff_tiled = tf.tile(diff, [batch_size, 1])
         mask_tiled = tf.tile(mask, [batch_size, 1])
         max_elements_vect = tf.reshape(tf.transpose(max_elements), [-1, 1])
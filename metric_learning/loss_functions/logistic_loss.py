@@ -14,7 +14,7 @@ class LogisticLoss(LossFunction):
             batch, model, DistanceFunction.EUCLIDEAN_DISTANCE_SQUARED)
         eta = loss_conf['alpha'] - pairwise_distance
         signed_eta = tf.multiply(eta, -2 * tf.cast(y, tf.float32) + 1)
-        padded_signed_eta = tf.stack([tf.zeros(signed_eta.shape[0]), signed_eta])
+        padded_signed_eta = tf.stack([tf.zeros_like(signed_eta), signed_eta])
 
         if self.conf['loss'].get('importance_sampling'):
             return tf.reduce_mean(weights * tf.reduce_logsumexp(padded_signed_eta, axis=0))
@@ -5,17 +5,30 @@ import numpy as np
 from metric_learning.constants.distance_function import DistanceFunction
 from util.registry.loss_function import LossFunction
 
-from util.tensor_operations import off_diagonal_part
-from util.tensor_operations import repeat_columns
-
 tfe = tf.contrib.eager
 
 
-def distance_weight(distances, dimension):
-    log_weights = (-(dimension - 2) * tf.log(distances) -
-                   (dimension - 3) / 2 * tf.log((1 - tf.square(distances) / 4)))
-    weights = tf.exp(log_weights - max(log_weights))
-    return weights / sum(weights)
+def log_distance_weight(distances, dimension):
+    # log of the inverse density of pairwise distances between points
+    # uniformly distributed on the unit hypersphere
+    return (-(dimension - 2) * tf.log(distances) -
+            (dimension - 3) / 2 * tf.log((1 - tf.square(distances) / 4)))
+
+
+def sample_negative_distances(distances, negative_mask, dimension, num_samples):
+    log_weights = log_distance_weight(distances, dimension)
+    has_negatives = tf.reduce_any(negative_mask, axis=1)
+    # rows without any negative sample uniformly; their samples are replaced
+    # by the caller
+    logits = tf.where(
+        negative_mask,
+        log_weights,
+        tf.fill(tf.shape(log_weights), -np.inf))
+    logits = tf.where(has_negatives, logits, tf.zeros_like(logits))
+    samples = tf.multinomial(logits, num_samples)
+    # the sampled distances are constants, as they were when they were drawn
+    # with numpy, so only the betas get gradients from the negative terms
+    return tf.stop_gradient(tf.batch_gather(distances, samples)), has_negatives
 
 
 class MarginLoss(LossFunction):
@@ -38,25 +51,20 @@ class MarginLoss(LossFunction):
 
         # distance weighted sampling
         group_size = self.conf['batch_design']['group_size']
-        negative_distance_list = []
-        positive_distance_list = []
-
-        for i in range(int(pairwise_distances.shape[0])):
-            distances = pairwise_distances[i, :]
-            distances = tf.maximum(distances, 0.5)
-            match = matching_labels_matrix[i, :]
-            positive_match = (matching_labels_matrix & ~tf.cast(tf.eye(int(pairwise_distances.shape[0])), tf.bool))[i, :]
-            nonzero_loss_cutoff = (distances < self.conf['loss']['beta'] + self.conf['loss']['alpha'])
-            negatives = tf.boolean_mask(distances, ~match)
-            if int(negatives.shape[0]) > 0:
-                weights = distance_weight(negatives, self.conf['model']['dimension']).numpy()
-                negative_distance_list.append(np.random.choice(negatives, size=group_size - 1, p=weights))
-                positive_distance_list.append(tf.boolean_mask(distances, positive_match))
-            else:
-                negative_distance_list.append(tf.ones(group_size - 1) * 100)
-                positive_distance_list.append(tf.zeros(group_size - 1))
-        negative_distances = tf.stack(negative_distance_list)
-        positive_distances = tf.stack(positive_distance_list)
+        batch_size = tf.shape(pairwise_distances)[0]
+        distances = tf.maximum(pairwise_distances, 0.5)
+        positive_mask = matching_labels_matrix & ~tf.cast(tf.eye(batch_size), tf.bool)
+        negative_distances, has_negatives = sample_negative_distances(
+            distances,
+            ~matching_labels_matrix,
+            self.conf['model']['dimension'],
+            group_size - 1)
+        positive_distances = tf.reshape(
+            tf.boolean_mask(distances, positive_mask), [batch_size, group_size - 1])
+        negative_distances = tf.where(
+            has_negatives, negative_distances, tf.ones_like(negative_distances) * 100)
+        positive_distances = tf.where(
+            has_negatives, positive_distances, tf.zeros_like(positive_distances))
 
         betas = tf.gather(self.extra_variables['beta'], labels)[:, None]
 
@@ -0,0 +1,37 @@
+import tensorflow as tf
+
+from metric_learning.loss_functions.margin_loss import sample_negative_distances
+
+tf.enable_eager_execution()
+
+
+class MarginLossTest(tf.test.TestCase):
+    def testSampleNegativeDistances(self):
+        distances = tf.constant([
+            [0.5, 1.0, 1.5],
+            [1.0, 0.5, 1.2],
+            [1.5, 1.2, 0.5],
+        ])
+        negative_mask = tf.constant([
+            [False, True, False],
+            [True, False, True],
+            [False, False, False],
+        ])
+        samples, has_negatives = sample_negative_distances(
+            distances, negative_mask, 128, 20)
+        self.assertAllEqual(has_negatives, [True, True, False])
+        self.assertAllEqual(samples[0], [1.0] * 20)
+        self.assertTrue(all(x in (1.0, 1.2) for x in samples[1].numpy()))
+
+    def testNoGradientThroughSampledDistances(self):
+        distances = tf.constant([[0.5, 1.0], [1.0, 0.5]])
+        negative_mask = tf.constant([[False, True], [True, False]])
+        with tf.GradientTape() as tape:
+            tape.watch(distances)
+            samples, _ = sample_negative_distances(distances, negative_mask, 128, 2)
+            loss = tf.reduce_sum(samples)
+        self.assertIsNone(tape.gradient(loss, distances))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -1,14 +1,8 @@
 from __future__ import print_function
 
 import os
-import sys
-import copy
-import operator
 
-import tensorflow as tf
 import numpy as np
-from tqdm import tqdm
-from tqdm import trange
 
 from util.registry.metric import Metric
 from util.registry.data_loader import DataLoader
@@ -56,71 +50,101 @@ def _flatten_image_files(pairs):
     return image_files, pair_indices
 
 
-def _make_embedding_pairs(embeddings_list):
-    embedding_pairs = []
-    for embeddings in embeddings_list:
-        for i in range(0, embeddings.shape[0].value, 2):
-            embedding_pairs.append([embeddings[i], embeddings[i+1]])
-    return embedding_pairs
+def _sweep(distances, labels):
+    # accepting the k closest pairs for every k = 0..n at once; only splits
+    # between distinct distances are valid thresholds
+    order = np.argsort(distances, kind='stable')
+    sorted_distances = np.asarray(distances)[order]
+    sorted_labels = np.asarray(labels, dtype=bool)[order]
+    true_accepts = np.concatenate([[0], np.cumsum(sorted_labels)])
+    false_accepts = np.concatenate([[0], np.cumsum(~sorted_labels)])
+    valid = np.concatenate([[True], sorted_distances[1:] > sorted_distances[:-1], [True]])
+    thresholds = np.concatenate([
+        [-np.inf],
+        (sorted_distances[1:] + sorted_distances[:-1]) / 2,
+        [np.inf]])
+    return thresholds[valid], true_accepts[valid], false_accepts[valid]
 
 
-def _calculate_accuracy(distances, labels):
-    data = sorted(zip(distances, labels), key=operator.itemgetter(0))
-    labels = [l for d, l in data]
-    best_accuracy = 0.
-    for k in range(len(data)+1):
-        predicts = [True]*k + [False]*(len(data)-k)
-        corrects = sum(p == l for p, l in zip(predicts, labels))
-        accuracy = corrects / len(data)
-        best_accuracy = max(accuracy, best_accuracy)
-    return best_accuracy
+def best_threshold(distances, labels):
+    thresholds, true_accepts, false_accepts = _sweep(distances, labels)
+    num_negatives = len(labels) - int(np.sum(labels))
+    corrects = true_accepts + (num_negatives - false_accepts)
+    best = int(np.argmax(corrects))
+    return thresholds[best], corrects[best] / len(labels)
+
+
+def accuracy(distances, labels, threshold):
+    return float(np.mean((np.asarray(distances) < threshold) == np.asarray(labels, dtype=bool)))
+
+
+def kfold_accuracies(distances, labels, num_folds):
+    # the threshold of every fold is chosen on the remaining folds
+    distances = np.asarray(distances)
+    labels = np.asarray(labels, dtype=bool)
+    folds = np.array_split(np.arange(len(distances)), num_folds)
+    accuracies = []
+    for fold in folds:
+        train = np.ones(len(distances), dtype=bool)
+        train[fold] = False
+        threshold, _ = best_threshold(distances[train], labels[train])
+        accuracies.append(accuracy(distances[fold], labels[fold], threshold))
+    return accuracies
+
+
+def roc_curve(distances, labels):
+    _, true_accepts, false_accepts = _sweep(distances, labels)
+    num_positives = max(int(np.sum(labels)), 1)
+    num_negatives = max(len(labels) - int(np.sum(labels)), 1)
+    return false_accepts / num_negatives, true_accepts / num_positives
+
+
+def roc_auc(false_accept_rates, true_accept_rates):
+    return float(np.sum(
+        np.diff(false_accept_rates) *
+        (true_accept_rates[1:] + true_accept_rates[:-1]) / 2))
+
+
+def tar_at_far(false_accept_rates, true_accept_rates, far):
+    return float(np.max(true_accept_rates[false_accept_rates <= far]))
 
 
 class LFWAccuracy(Metric):
     name = 'lfw_acc'
 
-    def compute_metric(self, model, ds, num_testcases):
-        Metric.cache.clear()
+    def get_split(self):
+        return 'lfw_pairs'
 
+    def create_test_dataset(self, model, data_files):
         data_loader = DataLoader.create(self.conf['dataset']['name'], self.conf)
         batch_design = BatchDesign.create(
             self.metric_conf['batch_design']['name'],
             self.conf,
             {'data_loader': data_loader})
-
-        pairs, labels, num_groups, num_examples = _make_pairs_dataset(self.conf)
+        pairs, _, _, _ = _make_pairs_dataset(self.conf)
         image_files, pair_indices = _flatten_image_files(pairs)
-
-        test_dataset, num_testcases = batch_design.create_dataset(
+        return batch_design.create_dataset(
             model, image_files, pair_indices,
             self.metric_conf['batch_design'], testing=True)
 
-        embeddings_list, pair_indices_list = self.get_embeddings(
-            model, test_dataset, num_testcases)
-        embedding_pairs = _make_embedding_pairs(embeddings_list)
-
-        distances = []
+    def compute_metric(self, model, ds, num_testcases):
+        # the pairs are always embedded from their own dataset, whatever
+        # dataset the caller passes
+        _, labels, num_groups, _ = _make_pairs_dataset(self.conf)
+        embeddings, _ = self.get_embedding_arrays(model, None, None)
         distance_function = get_distance_function(self.conf['loss']['distance_function'])
-        for i, embedding_pair in enumerate(tqdm(
-            embedding_pairs, desc='lfw:distance', dynamic_ncols=True)):
-            distance = compute_elementwise_distances(
-                tf.reshape(embedding_pair[0], [1, -1]),
-                tf.reshape(embedding_pair[1], [1, -1]),
-                distance_function)
-            distances.append(float(distance))
-
-        accuracies = []
-        num_examples_per_group = num_examples * 2
-        num_total_examples = num_groups * num_examples_per_group
-        for i in trange(0, num_total_examples, num_examples_per_group,
-                        desc='lfw:accuracy', dynamic_ncols=True):
-            accuracy = _calculate_accuracy(distances[i:i+num_examples_per_group],
-                                           labels[i:i+num_examples_per_group])
-            accuracies.append(accuracy)
-
-        Metric.cache.clear()
-
-        return {
+        distances = compute_elementwise_distances(
+            embeddings[0::2], embeddings[1::2], distance_function).numpy()
+        labels = np.array(labels, dtype=bool)
+
+        accuracies = kfold_accuracies(distances, labels, num_groups)
+        false_accept_rates, true_accept_rates = roc_curve(distances, labels)
+        ret = {
             'lfw_acc_avg': float(np.mean(accuracies)),
-            'lfw_acc_std': float(np.std(accuracies))
+            'lfw_acc_std': float(np.std(accuracies)),
+            'lfw_roc_auc': roc_auc(false_accept_rates, true_accept_rates),
         }
+        for far in self.metric_conf.get('far', [0.001, 0.01, 0.1]):
+            ret['lfw_tar@far={}'.format(far)] = tar_at_far(
+                false_accept_rates, true_accept_rates, far)
+        return ret
@@ -1,23 +1,26 @@
 from util.registry.metric import Metric
+from util.clustering import cluster
 
-from collections import defaultdict
+import logging
+import numpy as np
 
-import tensorflow as tf
-
-import sklearn.cluster
 import sklearn.metrics.cluster
 
 
+logger = logging.getLogger(__name__)
+
+
 class NMI(Metric):
     name = 'nmi'
 
     def compute_metric(self, model, ds, num_testcases):
-        embeddings_list, labels_list = self.get_embeddings(
+        # the clustering settings and time are logged rather than returned,
+        # so that only the score reaches the summaries and TrainHistory
+        embeddings, labels = self.get_embedding_arrays(
             model, ds, num_testcases)
-        embeddings = tf.concat(embeddings_list, axis=0)
-        labels = tf.concat(labels_list, axis=0)
-        label_counts = defaultdict(int)
-        for label in labels:
-            label_counts[int(label)] += 1
-        clusters = sklearn.cluster.KMeans(len(label_counts)).fit(embeddings).labels_
+        num_labels = len(np.unique(labels))
+        clusters, settings = cluster(
+            embeddings, num_labels, self.metric_conf.get('clustering'))
+        logger.info('nmi clustering: %s', ', '.join(
+            '{}={}'.format(k, v) for k, v in sorted(settings.items())))
         return sklearn.metrics.cluster.normalized_mutual_info_score(clusters, labels)
@@ -2,9 +2,10 @@ from util.registry.metric import Metric
 
 from collections import defaultdict
 from tqdm import tqdm
-from util.tensor_operations import compute_pairwise_distances
+from util.registry.neighbor_index import NeighborIndex
 from metric_learning.constants.distance_function import get_distance_function
 
+import numpy as np
 import tensorflow as tf
 
 
@@ -15,48 +16,102 @@ def count_singletons(all_labels):
     return len(list(filter(lambda x: x == 1, counts.values())))
 
 
-def compute_recall(embeddings_list, labels_list, k_list, distance_function):
+def count_hits(all_labels, query_ids, top_indices, k_list):
+    query_labels = all_labels[query_ids]
+    top_labels = np.where(
+        top_indices >= 0,
+        all_labels[np.maximum(top_indices, 0)],
+        query_labels.min() - 1 if len(query_labels) else -1)
+    return {
+        k: int(np.sum(np.any(top_labels[:, 0:k] == query_labels[:, None], axis=1)))
+        for k in k_list
+    }
+
+
+def compute_recall(embeddings_list, labels_list, k_list, distance_function,
+                   block_size=None, memory_budget=None, index=None):
+    embeddings = tf.concat(embeddings_list, axis=0)
+    all_labels = np.concatenate(
+        [np.asarray(labels, dtype=np.int64) for labels in labels_list])
+    num_singletons = int(np.sum(
+        np.unique(all_labels, return_counts=True)[1] == 1))
+    if index is None:
+        index = NeighborIndex.create(
+            'exact',
+            {'block_size': block_size, 'memory_budget': memory_budget},
+            {'distance_function': distance_function})
+    index.add(embeddings)
+
     successes = defaultdict(float)
-    total = 0.
-    num_singletons = 0
-    data = list(zip(embeddings_list, labels_list))
+    offset = 0
     batches = tqdm(
-        data, total=len(embeddings_list), desc='recall', dynamic_ncols=True)
-    for i, (embeddings, labels) in enumerate(batches):
-        all_labels = []
-        distance_blocks = []
-        for j, (test_embeddings, test_labels) in enumerate(data):
-            all_labels += list(test_labels.numpy())
-            pairwise_distances = compute_pairwise_distances(
-                embeddings, test_embeddings, distance_function)
-            if i == j:
-                pairwise_distances = pairwise_distances + \
-                         tf.eye(int(pairwise_distances.shape[0])) * 1e6
-            distance_blocks.append(pairwise_distances)
-
-        values, indices = tf.nn.top_k(-tf.concat(distance_blocks, axis=1), max(k_list))
-        top_labels = tf.gather(tf.constant(all_labels, tf.int64), indices)
-        for k in k_list:
-            score = tf.reduce_sum(
-                tf.cast(tf.equal(
-                    tf.transpose(labels[None]),
-                    top_labels[:, 0:k]
-                ), tf.int32), axis=1)
-            successes[k] += int(sum(tf.cast(score >= 1, tf.int32)))
-        total += int(embeddings.shape[0])
-        num_singletons = count_singletons(all_labels)
-    return {k: success / float(total - num_singletons) for k, success in successes.items()}
+        embeddings_list, total=len(embeddings_list), desc='recall', dynamic_ncols=True)
+    for query_embeddings in batches:
+        query_ids = np.arange(offset, offset + int(query_embeddings.shape[0]))
+        top_indices = index.search(
+            query_embeddings, max(k_list), query_ids=query_ids)
+        for k, hits in count_hits(all_labels, query_ids, top_indices, k_list).items():
+            successes[k] += hits
+        offset += len(query_ids)
+    return {k: successes[k] / float(offset - num_singletons) for k in k_list}
+
+
+def compute_recall_loss(embeddings, all_labels, index, k_list, distance_function,
+                        num_queries=1000, seed=0):
+    _, inverse, label_counts = np.unique(
+        all_labels, return_inverse=True, return_counts=True)
+    candidates = np.nonzero(label_counts[inverse] > 1)[0]
+    query_ids = np.sort(np.random.RandomState(seed).choice(
+        candidates, min(num_queries, len(candidates)), replace=False))
+    queries = tf.gather(embeddings, query_ids)
+
+    exact_index = NeighborIndex.create(
+        'exact', {}, {'distance_function': distance_function})
+    exact_index.add(embeddings)
+    exact_hits = count_hits(
+        all_labels, query_ids, exact_index.search(queries, max(k_list), query_ids), k_list)
+    approximate_hits = count_hits(
+        all_labels, query_ids, index.search(queries, max(k_list), query_ids), k_list)
+    return {
+        k: (exact_hits[k] - approximate_hits[k]) / float(max(len(query_ids), 1))
+        for k in k_list
+    }
 
 
 class Recall(Metric):
     name = 'recall'
 
     def compute_metric(self, model, ds, num_testcases):
-        embeddings_list, labels_list = self.get_embeddings(model, ds, num_testcases)
+        # queries run batch_size rows at a time against the gallery blocks of
+        # the index, so a search holds a [batch_size, block_size] distance
+        # matrix; the batches are views of the shared embedding array
+        embeddings, labels = self.get_embedding_arrays(model, ds, num_testcases)
+        batch_size = self.metric_conf['batch_design']['batch_size']
+        starts = range(0, len(labels), batch_size)
+        distance_function = get_distance_function(self.conf['loss']['distance_function'])
+        index_conf = self.metric_conf.get('index', {'name': 'exact'})
+        index = NeighborIndex.create(
+            index_conf['name'],
+            dict(index_conf,
+                 block_size=self.metric_conf.get('block_size'),
+                 memory_budget=self.metric_conf.get('memory_budget')),
+            {'distance_function': distance_function})
 
         ret = compute_recall(
-            embeddings_list,
-            labels_list,
+            [embeddings[i:i + batch_size] for i in starts],
+            [labels[i:i + batch_size] for i in starts],
             self.metric_conf['k'],
-            get_distance_function(self.conf['loss']['distance_function']))
-        return {'recall@{}'.format(k): score for k, score in ret.items()}
+            distance_function,
+            index=index)
+        scores = {'recall@{}'.format(k): score for k, score in ret.items()}
+        if index_conf['name'] != 'exact':
+            recall_loss = compute_recall_loss(
+                embeddings,
+                labels,
+                index,
+                self.metric_conf['k'],
+                distance_function,
+                num_queries=index_conf.get('num_evaluation_queries', 1000))
+            for k, loss in recall_loss.items():
+                scores['recall_loss@{}'.format(k)] = loss
+        return scores
@@ -0,0 +1,45 @@
+import numpy as np
+import tensorflow as tf
+
+from metric_learning.metrics.lfw_acc import best_threshold
+from metric_learning.metrics.lfw_acc import kfold_accuracies
+from metric_learning.metrics.lfw_acc import roc_auc
+from metric_learning.metrics.lfw_acc import roc_curve
+from metric_learning.metrics.lfw_acc import tar_at_far
+
+tf.enable_eager_execution()
+
+
+def brute_force_best_accuracy(distances, labels):
+    candidates = np.concatenate([[-np.inf], np.sort(distances) + 1e-9])
+    return max(np.mean((distances < t) == labels) for t in candidates)
+
+
+class LFWAccuracyTest(tf.test.TestCase):
+    def testBestThresholdMatchesBruteForce(self):
+        random_state = np.random.RandomState(0)
+        for _ in range(20):
+            labels = random_state.rand(50) < 0.5
+            distances = np.round(random_state.rand(50) + labels * -0.3, 1)
+            threshold, accuracy = best_threshold(distances, labels)
+            self.assertAlmostEqual(accuracy, brute_force_best_accuracy(distances, labels))
+            self.assertAlmostEqual(np.mean((distances < threshold) == labels), accuracy)
+
+    def testKfoldAccuracies(self):
+        distances = np.array([0.1, 0.2, 0.8, 0.9] * 3)
+        labels = np.array([True, True, False, False] * 3)
+        self.assertAllClose(kfold_accuracies(distances, labels, 3), [1., 1., 1.])
+
+    def testRoc(self):
+        distances = np.array([0.1, 0.2, 0.3, 0.4])
+        labels = np.array([True, False, True, False])
+        false_accept_rates, true_accept_rates = roc_curve(distances, labels)
+        self.assertAllClose(false_accept_rates, [0., 0., 0.5, 0.5, 1.])
+        self.assertAllClose(true_accept_rates, [0., 0.5, 0.5, 1., 1.])
+        self.assertAlmostEqual(roc_auc(false_accept_rates, true_accept_rates), 0.75)
+        self.assertAlmostEqual(tar_at_far(false_accept_rates, true_accept_rates, 0.), 0.5)
+        self.assertAlmostEqual(tar_at_far(false_accept_rates, true_accept_rates, 0.5), 1.)
+
+
+if __name__ == '__main__':
+    tf.test.main()
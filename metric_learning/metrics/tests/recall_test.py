@@ -67,6 +67,33 @@ class RecallMetricTest(tf.test.TestCase):
             get_distance_function('cosine_similarity'))
         self.assertEqual(ret, {1: 1.0, 2: 1.0, 3: 1.0})
 
+    def testRecallStreamingBlocks(self):
+        embeddings = tf.constant([
+            [1., 0.],
+            [4., 0.],
+            [0., 1.],
+            [1., 2.],
+            [5., 1.],
+        ])
+        labels = tf.constant([1, 1, 2, 2, 1], tf.int64)
+        expected = compute_recall(
+            [embeddings], [labels],
+            [1, 2, 3],
+            get_distance_function('euclidean_distance'))
+        for block_size in [1, 2, 3]:
+            ret = compute_recall(
+                [embeddings[:2], embeddings[2:]], [labels[:2], labels[2:]],
+                [1, 2, 3],
+                get_distance_function('euclidean_distance'),
+                block_size=block_size)
+            self.assertEqual(ret, expected)
+        ret = compute_recall(
+            [embeddings], [labels],
+            [1, 2, 3],
+            get_distance_function('euclidean_distance'),
+            memory_budget=4 * 5)
+        self.assertEqual(ret, expected)
+
     def testRecallWithSingleton(self):
         embeddings = tf.constant([
             [1., 0.],
@@ -1,6 +1,7 @@
 import tensorflow as tf
 
 from util.registry.model import Model
+from util.precision import backbone_scope
 
 
 layers = tf.keras.layers
@@ -17,24 +18,25 @@ class SimpleConvolutionModel(Model):
         max_pool = layers.MaxPooling2D(
             (2, 2), (2, 2), padding='same', data_format=data_format)
 
-        self.model = tf.keras.Sequential(
-            [
-                layers.Conv2D(
-                    32,
-                    3,
-                    padding='same',
-                    data_format=data_format,
-                    activation=tf.nn.relu),
-                max_pool,
-                layers.Conv2D(
-                    64,
-                    3,
-                    padding='same',
-                    data_format=data_format,
-                    activation=tf.nn.relu),
-                max_pool,
-                layers.Flatten(),
-                layers.Dense(128, activation=tf.nn.relu),
-                layers.Dropout(0.4),
-                layers.Dense(conf['k']),
-            ])
+        with backbone_scope(conf):
+            self.model = tf.keras.Sequential(
+                [
+                    layers.Conv2D(
+                        32,
+                        3,
+                        padding='same',
+                        data_format=data_format,
+                        activation=tf.nn.relu),
+                    max_pool,
+                    layers.Conv2D(
+                        64,
+                        3,
+                        padding='same',
+                        data_format=data_format,
+                        activation=tf.nn.relu),
+                    max_pool,
+                    layers.Flatten(),
+                    layers.Dense(128, activation=tf.nn.relu),
+                    layers.Dropout(0.4),
+                    layers.Dense(conf['k']),
+                ])
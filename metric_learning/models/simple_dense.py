@@ -1,6 +1,7 @@
 import tensorflow as tf
 
 from util.registry.model import Model
+from util.precision import backbone_scope
 
 
 class SimpleDenseModel(Model):
@@ -9,9 +10,10 @@ class SimpleDenseModel(Model):
     def __init__(self, conf, extra_info):
         super(SimpleDenseModel, self).__init__(conf, extra_info)
 
-        self.model = tf.keras.models.Sequential([
-            tf.keras.layers.Flatten(),
-            tf.keras.layers.Dense(256, activation=tf.nn.relu),
-            tf.keras.layers.Dropout(0.2),
-            tf.keras.layers.Dense(conf['model']['k'])
-        ])
+        with backbone_scope(conf):
+            self.model = tf.keras.models.Sequential([
+                tf.keras.layers.Flatten(),
+                tf.keras.layers.Dense(256, activation=tf.nn.relu),
+                tf.keras.layers.Dropout(0.2),
+                tf.keras.layers.Dense(conf['model']['k'])
+            ])
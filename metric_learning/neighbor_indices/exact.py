@@ -0,0 +1,78 @@
+from util.registry.neighbor_index import NeighborIndex
+
+from util.tensor_operations import compute_elementwise_distances
+from util.tensor_operations import compute_pairwise_distances
+
+import numpy as np
+import tensorflow as tf
+
+
+DEFAULT_BLOCK_SIZE = 4096
+
+
+def get_block_size(num_queries, block_size=None, memory_budget=None):
+    if block_size is None:
+        block_size = DEFAULT_BLOCK_SIZE
+    if memory_budget is not None:
+        # one float32 distance per (query, gallery) pair in a block
+        block_size = min(block_size, max(1, int(memory_budget) // (4 * max(num_queries, 1))))
+    return block_size
+
+
+def streaming_top_k(queries, query_ids, gallery, k, distance_function,
+                    block_size):
+    num_gallery = int(gallery.shape[0])
+    top_values = None
+    top_indices = None
+    for start in range(0, num_gallery, block_size):
+        end = min(start + block_size, num_gallery)
+        pairwise_distances = compute_pairwise_distances(
+            queries, gallery[start:end], distance_function)
+        if query_ids is not None:
+            gallery_indices = tf.range(start, end, dtype=tf.int64)
+            self_matches = tf.equal(query_ids[:, None], gallery_indices[None])
+            pairwise_distances = pairwise_distances + \
+                tf.cast(self_matches, tf.float32) * 1e6
+        values, indices = tf.nn.top_k(
+            -pairwise_distances, min(k, end - start))
+        indices = tf.cast(indices, tf.int64) + start
+        if top_values is not None:
+            values = tf.concat([top_values, values], axis=1)
+            indices = tf.concat([top_indices, indices], axis=1)
+            values, positions = tf.nn.top_k(values, min(k, int(values.shape[1])))
+            indices = tf.batch_gather(indices, positions)
+        top_values = values
+        top_indices = indices
+    return -top_values, top_indices
+
+
+class ExactNeighborIndex(NeighborIndex):
+    name = 'exact'
+
+    embeddings = None
+
+    def add(self, embeddings):
+        self.embeddings = tf.convert_to_tensor(embeddings, dtype=tf.float32)
+
+    def search(self, queries, k, query_ids=None):
+        queries = tf.convert_to_tensor(queries, dtype=tf.float32)
+        if query_ids is not None:
+            query_ids = tf.constant(query_ids, dtype=tf.int64)
+        block_size = get_block_size(
+            int(queries.shape[0]),
+            self.conf.get('block_size'),
+            self.conf.get('memory_budget'))
+        _, top_indices = streaming_top_k(
+            queries, query_ids, self.embeddings, k, self.distance_function,
+            block_size)
+        return top_indices.numpy()
+
+    def pair_distances(self, first, second):
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        first, second = np.broadcast_arrays(first, second)
+        distances = compute_elementwise_distances(
+            tf.gather(self.embeddings, first.reshape(-1)),
+            tf.gather(self.embeddings, second.reshape(-1)),
+            self.distance_function)
+        return distances.numpy().reshape(first.shape)
@@ -0,0 +1,148 @@
+from util.registry.neighbor_index import NeighborIndex
+
+from metric_learning.constants.distance_function import DistanceFunction
+from util.clustering import assign
+from util.clustering import kmeans
+from util.clustering import squared_distances
+
+import numpy as np
+
+
+class IVFPQNeighborIndex(NeighborIndex):
+    name = 'ivfpq'
+
+    def __init__(self, conf, extra_info):
+        super(IVFPQNeighborIndex, self).__init__(conf, extra_info)
+        self.num_lists = conf.get('num_lists', 1024)
+        self.num_subquantizers = conf.get('num_subquantizers', 8)
+        self.num_centroids = conf.get('num_centroids', 256)
+        self.nprobe = conf.get('nprobe', 8)
+        self.train_size = conf.get('train_size', 100000)
+        self.num_iterations = conf.get('num_iterations', 20)
+        self.random_state = np.random.RandomState(conf.get('seed', 0))
+        self.inner_product = self.distance_function == DistanceFunction.DOT_PRODUCT
+        self.coarse_centroids = None
+        self.codebooks = None
+
+    def _prepare(self, data):
+        data = np.asarray(data, dtype=np.float32)
+        if self.distance_function == DistanceFunction.COSINE_SIMILARITY:
+            data = data / np.maximum(np.linalg.norm(data, axis=1, keepdims=True), 1e-12)
+        return data
+
+    def _split(self, data):
+        return data.reshape(data.shape[0], self.num_subquantizers, -1)
+
+    def train(self, data):
+        dimension = data.shape[1]
+        if dimension % self.num_subquantizers != 0:
+            raise Exception(
+                'num_subquantizers does not divide the dimension: m={}, d={}'.format(
+                    self.num_subquantizers, dimension))
+        if data.shape[0] > self.train_size:
+            data = data[self.random_state.choice(data.shape[0], self.train_size, replace=False)]
+        self.coarse_centroids = kmeans(
+            data, self.num_lists, self.num_iterations, self.random_state)
+        residuals = self._split(data - self.coarse_centroids[assign(data, self.coarse_centroids)])
+        self.codebooks = np.stack([
+            kmeans(residuals[:, m], self.num_centroids, self.num_iterations, self.random_state)
+            for m in range(self.num_subquantizers)
+        ])
+
+    def add(self, embeddings):
+        # replaces the indexed embeddings, as the exact index does; the
+        # codebooks are trained on the first embeddings added and reused
+        # after that. Only the codes of the embeddings are kept
+        data = self._prepare(embeddings)
+        if self.coarse_centroids is None:
+            self.train(data)
+        lists = assign(data, self.coarse_centroids)
+        residuals = self._split(data - self.coarse_centroids[lists])
+        codes = np.stack([
+            assign(residuals[:, m], self.codebooks[m])
+            for m in range(self.num_subquantizers)
+        ], axis=1).astype(np.uint8 if self.codebooks.shape[1] <= 256 else np.uint16)
+
+        order = np.argsort(lists, kind='stable')
+        self.list_ids = order
+        self.list_codes = codes[order]
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(lists, minlength=len(self.coarse_centroids)))])
+        self.codes = codes
+        self.lists = lists
+
+    def reconstruct(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        codes = self.codes[ids]
+        residuals = self.codebooks[np.arange(self.num_subquantizers)[None], codes]
+        return self.coarse_centroids[self.lists[ids]] + residuals.reshape(len(ids), -1)
+
+    def _lookup_tables(self, queries, list_id):
+        split_queries = self._split(queries)
+        if self.inner_product:
+            tables = -np.einsum('nmd,mkd->nmk', split_queries, self.codebooks)
+            return tables, -np.dot(queries, self.coarse_centroids[list_id])
+        residuals = self._split(queries - self.coarse_centroids[list_id])
+        tables = np.maximum(
+            np.sum(np.square(residuals), axis=2)[:, :, None] +
+            np.sum(np.square(self.codebooks), axis=2)[None] -
+            2 * np.einsum('nmd,mkd->nmk', residuals, self.codebooks),
+            0.)
+        return tables, np.zeros(queries.shape[0], dtype=np.float32)
+
+    def search(self, queries, k, query_ids=None):
+        queries = self._prepare(queries)
+        num_queries = queries.shape[0]
+        nprobe = min(self.nprobe, len(self.coarse_centroids))
+        if self.inner_product:
+            coarse_distances = -np.dot(queries, self.coarse_centroids.T)
+        else:
+            coarse_distances = squared_distances(queries, self.coarse_centroids)
+        probes = np.argpartition(coarse_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        best_distances = np.full((num_queries, k), np.inf, dtype=np.float32)
+        best_ids = np.full((num_queries, k), -1, dtype=np.int64)
+        query_order = np.argsort(probes.reshape(-1), kind='stable')
+        probed_lists = probes.reshape(-1)[query_order]
+        boundaries = np.concatenate(
+            [[0], np.cumsum(np.bincount(probed_lists, minlength=len(self.coarse_centroids)))])
+        for list_id in range(len(self.coarse_centroids)):
+            start, end = self.list_offsets[list_id], self.list_offsets[list_id + 1]
+            rows = query_order[boundaries[list_id]:boundaries[list_id + 1]] // nprobe
+            if start == end or len(rows) == 0:
+                continue
+            tables, bias = self._lookup_tables(queries[rows], list_id)
+            codes = self.list_codes[start:end]
+            distances = bias[:, None] + np.sum(
+                tables[:, np.arange(self.num_subquantizers)[:, None], codes.T], axis=1)
+            ids = np.broadcast_to(self.list_ids[start:end], distances.shape)
+            if query_ids is not None:
+                distances = np.where(
+                    ids == np.asarray(query_ids)[rows][:, None], np.inf, distances)
+            candidates = np.concatenate([best_distances[rows], distances], axis=1)
+            candidate_ids = np.concatenate([best_ids[rows], ids], axis=1)
+            top = np.argpartition(candidates, k - 1, axis=1)[:, :k]
+            best_distances[rows] = np.take_along_axis(candidates, top, axis=1)
+            best_ids[rows] = np.take_along_axis(candidate_ids, top, axis=1)
+        order = np.argsort(best_distances, axis=1, kind='stable')
+        best_ids = np.take_along_axis(best_ids, order, axis=1)
+        best_distances = np.take_along_axis(best_distances, order, axis=1)
+        return np.where(np.isinf(best_distances), -1, best_ids)
+
+    def pair_distances(self, first, second):
+        # both members of a pair are reconstructed from their codes
+        first = np.asarray(first, dtype=np.int64)
+        second = np.asarray(second, dtype=np.int64)
+        first, second = np.broadcast_arrays(first, second)
+        queries = self.reconstruct(first.reshape(-1))
+        targets = self.reconstruct(second.reshape(-1))
+        if self.distance_function == DistanceFunction.EUCLIDEAN_DISTANCE_SQUARED:
+            distances = np.sum(np.square(queries - targets), axis=1)
+        elif self.distance_function == DistanceFunction.EUCLIDEAN_DISTANCE:
+            distances = np.sqrt(np.maximum(np.sum(np.square(queries - targets), axis=1), 1e-12))
+        elif self.distance_function == DistanceFunction.COSINE_SIMILARITY:
+            distances = -np.sum(queries * targets, axis=1) / np.maximum(
+                np.linalg.norm(queries, axis=1) * np.linalg.norm(targets, axis=1), 1e-12)
+        else:
+            distances = -np.sum(queries * targets, axis=1)
+        return distances.reshape(first.shape)
@@ -0,0 +1,100 @@
+import numpy as np
+import tensorflow as tf
+
+from metric_learning.constants.distance_function import DistanceFunction
+from util.registry.neighbor_index import NeighborIndex
+
+tf.enable_eager_execution()
+
+
+class IVFPQNeighborIndexTest(tf.test.TestCase):
+    def testSearchMatchesExactWithFullProbe(self):
+        random_state = np.random.RandomState(0)
+        embeddings = random_state.randn(200, 8).astype(np.float32)
+        conf = {
+            'name': 'ivfpq',
+            'num_lists': 4,
+            'nprobe': 4,
+            'num_subquantizers': 8,
+            'num_centroids': 200,
+        }
+        extra_info = {'distance_function': DistanceFunction.EUCLIDEAN_DISTANCE}
+        index = NeighborIndex.create('ivfpq', conf, extra_info)
+        index.add(embeddings)
+        exact_index = NeighborIndex.create('exact', {}, extra_info)
+        exact_index.add(embeddings)
+
+        query_ids = np.arange(10)
+        self.assertAllEqual(
+            index.search(embeddings[query_ids], 3, query_ids),
+            exact_index.search(embeddings[query_ids], 3, query_ids))
+
+    def testSearchExcludesQuery(self):
+        embeddings = np.array([
+            [0., 0.],
+            [0., 1.],
+            [0., 3.],
+            [0., 7.],
+        ], dtype=np.float32)
+        conf = {
+            'name': 'ivfpq',
+            'num_lists': 2,
+            'nprobe': 2,
+            'num_subquantizers': 2,
+            'num_centroids': 4,
+        }
+        index = NeighborIndex.create(
+            'ivfpq', conf, {'distance_function': DistanceFunction.EUCLIDEAN_DISTANCE})
+        index.add(embeddings)
+        self.assertAllEqual(
+            index.search(embeddings[0:2], 2, np.array([0, 1])),
+            [[1, 2], [0, 2]])
+
+    def testPairDistancesFromCodes(self):
+        embeddings = np.array([
+            [0., 0.],
+            [0., 1.],
+            [0., 3.],
+            [0., 7.],
+        ], dtype=np.float32)
+        conf = {
+            'name': 'ivfpq',
+            'num_lists': 2,
+            'nprobe': 2,
+            'num_subquantizers': 2,
+            'num_centroids': 4,
+        }
+        extra_info = {'distance_function': DistanceFunction.EUCLIDEAN_DISTANCE}
+        index = NeighborIndex.create('ivfpq', conf, extra_info)
+        index.add(embeddings)
+        exact_index = NeighborIndex.create('exact', {}, extra_info)
+        exact_index.add(embeddings)
+        # as many centroids as embeddings reconstruct every embedding
+        self.assertAllClose(
+            index.pair_distances([0, 1, 2], [3, 2, 0]),
+            exact_index.pair_distances([0, 1, 2], [3, 2, 0]),
+            atol=1e-3)
+        self.assertFalse(hasattr(index, 'data'))
+
+    def testCodebooksAreTrainedOnce(self):
+        random_state = np.random.RandomState(0)
+        conf = {
+            'name': 'ivfpq',
+            'num_lists': 2,
+            'nprobe': 2,
+            'num_subquantizers': 2,
+            'num_centroids': 4,
+        }
+        index = NeighborIndex.create(
+            'ivfpq', conf, {'distance_function': DistanceFunction.EUCLIDEAN_DISTANCE})
+        index.add(random_state.randn(20, 4).astype(np.float32))
+        codebooks = index.codebooks
+        embeddings = random_state.randn(10, 4).astype(np.float32)
+        index.add(embeddings)
+        self.assertIs(index.codebooks, codebooks)
+        # the second add replaces the indexed embeddings
+        self.assertEqual(len(index.codes), 10)
+
+
+if __name__ == '__main__':
+    tf.test.main()
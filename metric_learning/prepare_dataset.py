@@ -2,6 +2,9 @@ import tensorflow as tf
 
 from util.registry.data_loader import DataLoader
 from util.config import CONFIG
+from util.config import render_jinja_config
+from util.dataset import load_images_from_directory
+from util.image_shards import write_image_shards
 
 import argparse
 import random
@@ -15,11 +18,32 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Download dataset for training/testing models')
     parser.add_argument('--dataset', help='Name of the dataset')
+    parser.add_argument('--stage',
+                        help='files: download and split the dataset, '
+                             'shards: write pre-decoded image shards',
+                        choices=['files', 'shards'],
+                        default='files')
+    parser.add_argument('--width', help='image width of the shards', type=int)
+    parser.add_argument('--height', help='image height of the shards', type=int)
+    parser.add_argument('--channel', help='image channel of the shards', type=int)
 
     args = parser.parse_args()
 
     directory = os.path.join(CONFIG['dataset']['experiment_dir'], args.dataset)
 
+    if args.stage == 'shards':
+        image_args = {k: v for k, v in vars(args).items()
+                      if k in ['width', 'height', 'channel'] and v is not None}
+        conf = {
+            'dataset': {'name': args.dataset},
+            'image': render_jinja_config('image', **image_args),
+        }
+        data_loader = DataLoader.create(args.dataset, conf)
+        image_files, _ = load_images_from_directory(directory)
+        print('Wrote shards to {}'.format(
+            write_image_shards(conf, data_loader, image_files)))
+        exit(0)
+
     data_loader: DataLoader = DataLoader.create(args.dataset)
     data_loader.prepare_files()
 
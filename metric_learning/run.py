@@ -5,11 +5,10 @@ import copy
 
 from metric_learning.example_configurations import configs
 from util.config import generate_configs_from_experiment
+from util.devices import session_config
 from util.train import train
 
 if __name__ == '__main__':
-    tf.enable_eager_execution()
-
     parser = argparse.ArgumentParser(description='Train using a specified config')
     parser.add_argument('--config', help='config to run')
     parser.add_argument('--experiment', help='experiment to run')
@@ -21,16 +20,19 @@ if __name__ == '__main__':
                         help='cross validation split number to use as validation data',
                         default=None,
                         type=int)
+    parser.add_argument('--job_id',
+                        help='id that stays the same when the job is restarted, '
+                             'enables resuming from its checkpoints')
     args = parser.parse_args()
 
     if args.experiment:
         experiments = generate_configs_from_experiment(args.experiment)
         conf = copy.deepcopy(experiments[args.experiment_index])
-        if args.split is not None:
-            conf['dataset']['cross_validation_split'] = args.split
-        train(conf, args.experiment_name)
     else:
         conf = copy.deepcopy(configs[args.config])
-        if args.split is not None:
-            conf['dataset']['cross_validation_split'] = args.split
-        train(conf, args.experiment_name)
+    if args.split is not None:
+        conf['dataset']['cross_validation_split'] = args.split
+    # virtual cpu devices for the configured devices can only be created
+    # when eager execution is enabled
+    tf.enable_eager_execution(config=session_config(conf))
+    train(conf, args.experiment_name, args.job_id)
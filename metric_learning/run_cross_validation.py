@@ -0,0 +1,132 @@
+import tensorflow as tf
+
+import argparse
+import copy
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+
+from metric_learning.example_configurations import configs
+from util.config import CONFIG
+from util.config import generate_configs_from_experiment
+from util.dataset import FILE_INDEX_ENV
+from util.dataset import load_images_from_directory
+from util.dataset import write_file_index
+from util.devices import session_config
+from util.image_shards import ImageShards
+from util.image_shards import write_image_shards
+from util.registry.data_loader import DataLoader
+from util.train import train
+
+
+def run_fold(conf, experiment_name, gpus=None):
+    # every fold runs in a fresh process, so eager execution can be set up
+    # for its own configuration. With gpus, a queue of free GPUs, the fold
+    # only sees the GPU it takes from the queue and returns it when done
+    gpu = gpus.get() if gpus is not None else None
+    try:
+        if gpu is not None:
+            os.environ['CUDA_VISIBLE_DEVICES'] = gpu
+        tf.enable_eager_execution(config=session_config(conf))
+        return train(conf, experiment_name)
+    finally:
+        if gpu is not None:
+            gpus.put(gpu)
+
+
+def dataset_directories(dataset_name, splits):
+    directory = os.path.join(CONFIG['dataset']['experiment_dir'], dataset_name)
+    return [os.path.join(directory, 'train'), os.path.join(directory, 'test')] + [
+        os.path.join(directory, 'train', str(split)) for split in splits
+    ]
+
+
+def prepare_image_shards(confs):
+    # the decoded images are written once, before any worker starts, and
+    # the workers then memory-map the same files
+    if not CONFIG['dataset'].getboolean('use_image_shards', False):
+        return
+    eager_enabled = False
+    for conf in confs:
+        if ImageShards.load(conf) is not None:
+            continue
+        if not eager_enabled:
+            tf.enable_eager_execution()
+            eager_enabled = True
+        directory = os.path.join(CONFIG['dataset']['experiment_dir'], conf['dataset']['name'])
+        image_files, _ = load_images_from_directory(directory)
+        data_loader = DataLoader.create(conf['dataset']['name'], conf)
+        print('Wrote shards to {}'.format(
+            write_image_shards(conf, data_loader, image_files)))
+
+
+def summarize(results):
+    for (conf_index, split), metrics in sorted(results.items()):
+        print('config #{} split {}: {}'.format(
+            conf_index, split, {k: float(v) for k, v in metrics.items()}))
+    for conf_index in sorted(set(x for x, _ in results)):
+        folds = [metrics for (x, _), metrics in results.items() if x == conf_index]
+        for metric in sorted(folds[0]):
+            scores = [float(x[metric]) for x in folds if metric in x]
+            print('config #{} {}: {:.4f} +- {:.4f} over {} folds'.format(
+                conf_index, metric, np.mean(scores), np.std(scores), len(scores)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Train every cross validation fold of a config or experiment')
+    parser.add_argument('--config', help='config to run')
+    parser.add_argument('--experiment', help='experiment to run')
+    parser.add_argument('--experiment_name', help='name of the experiment for logging')
+    parser.add_argument('--splits',
+                        help='comma separated cross validation splits, all of them by default')
+    parser.add_argument('--workers',
+                        help='number of folds to train at the same time',
+                        default=1,
+                        type=int)
+    parser.add_argument('--gpus',
+                        help='comma separated GPUs, each used by one fold at a time; '
+                             'list a GPU more than once to share it')
+    args = parser.parse_args()
+
+    if args.experiment:
+        confs = generate_configs_from_experiment(args.experiment)
+    else:
+        confs = [configs[args.config]]
+    if args.splits:
+        splits = [int(x) for x in args.splits.split(',')]
+    else:
+        splits = list(range(CONFIG['dataset'].getint('cross_validation_splits')))
+
+    context = multiprocessing.get_context('spawn')
+    manager = context.Manager()
+    gpus = None
+    if args.gpus:
+        gpus = manager.Queue()
+        for gpu in args.gpus.split(','):
+            gpus.put(gpu)
+
+    jobs = []
+    keys = []
+    for conf_index, conf in enumerate(confs):
+        for split in splits:
+            fold_conf = copy.deepcopy(conf)
+            fold_conf['dataset']['cross_validation_split'] = split
+            jobs.append((fold_conf, args.experiment_name, gpus))
+            keys.append((conf_index, split))
+
+    prepare_image_shards(confs)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # the workers inherit the index through the environment and read
+        # the directory listings from it instead of walking the tree again
+        directories = []
+        for dataset_name in sorted(set(conf['dataset']['name'] for conf in confs)):
+            directories += dataset_directories(dataset_name, splits)
+        os.environ[FILE_INDEX_ENV] = write_file_index(
+            directories, os.path.join(temp_dir, 'file_index.json'))
+
+        with context.Pool(args.workers, maxtasksperchild=1) as pool:
+            results = pool.starmap(run_fold, jobs, chunksize=1)
+    summarize(dict(zip(keys, results)))
@@ -1,25 +1,90 @@
 import tensorflow as tf
 
-import boto3
+import argparse
 import json
+import multiprocessing
 import os
 import sys
 import time
 
+from util.devices import session_config
+from util.job_queue import Heartbeat
+from util.job_queue import get_queue
+from util.job_queue import heartbeat_interval
+from util.job_queue import num_unfinished
+from util.job_queue import visibility_timeout
 from util.train import train
 
-conn_sqs = boto3.resource('sqs')
+QUEUE_NAME = 'experiment-configs'
 
-if __name__ == '__main__':
-    tf.enable_eager_execution()
-    queue = conn_sqs.get_queue_by_name(QueueName='experiment-configs')
+EMPTY_QUEUE_EXIT_CODE = 3
+
+
+def consume_one(local, gpu):
+    # trains at most one experiment; the message is deleted only after the
+    # training finished, so the job is received again if this process dies
+    if gpu is not None:
+        os.environ['CUDA_VISIBLE_DEVICES'] = gpu
+    queue = get_queue(QUEUE_NAME, local)
     messages = queue.receive_messages(
         MaxNumberOfMessages=1,
         MessageAttributeNames=['experiment_name'],
-        WaitTimeSeconds=0)
-
+        WaitTimeSeconds=0,
+        VisibilityTimeout=visibility_timeout())
+    if not messages:
+        sys.exit(EMPTY_QUEUE_EXIT_CODE)
     for message in messages:
         conf = json.loads(message.body)
         experiment_name = message.message_attributes.get('experiment_name').get('StringValue')
+        tf.enable_eager_execution(config=session_config(conf))
+        with Heartbeat(message, visibility_timeout(), heartbeat_interval()):
+            train(conf, experiment_name, message.message_id)
         message.delete()
-        train(conf, experiment_name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train experiments from the job queue')
+    parser.add_argument('--local', action='store_true',
+                        help='use the local job queue instead of SQS')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of experiments to train at the same time')
+    parser.add_argument('--gpus',
+                        help='comma separated GPUs, assigned to the workers in turn')
+    parser.add_argument('--poll', type=int, default=0,
+                        help='seconds to wait before polling an empty queue again, '
+                             'by default exits once the queue is empty and no job is leased')
+    args = parser.parse_args()
+
+    # every job runs in a fresh process, so eager execution can be set up for
+    # its own configuration and a crash only loses that job
+    gpus = args.gpus.split(',') if args.gpus else [None]
+    queue = get_queue(QUEUE_NAME, args.local)
+    context = multiprocessing.get_context('spawn')
+    workers = [None] * args.workers
+    queue_empty = False
+    while True:
+        for slot, process in enumerate(workers):
+            if process is not None and not process.is_alive():
+                if process.exitcode == EMPTY_QUEUE_EXIT_CODE:
+                    queue_empty = True
+                elif process.exitcode != 0:
+                    print('worker {} exited with {}, its job will be retried'.format(
+                        slot, process.exitcode))
+                workers[slot] = None
+        if queue_empty and args.poll:
+            time.sleep(args.poll)
+            queue_empty = False
+        elif queue_empty and all(process is None for process in workers) and num_unfinished(queue) > 0:
+            # jobs of crashed consumers are still leased; they are retried
+            # once their visibility timeout runs out
+            time.sleep(heartbeat_interval())
+            queue_empty = False
+        if not queue_empty:
+            for slot, process in enumerate(workers):
+                if process is None:
+                    workers[slot] = context.Process(
+                        target=consume_one, args=(args.local, gpus[slot % len(gpus)]))
+                    workers[slot].start()
+        if all(process is None for process in workers):
+            break
+        time.sleep(1)
@@ -0,0 +1,59 @@
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from metric_learning.constants.distance_function import DistanceFunction
+from util.tensor_operations import broadcast_pairwise_distances
+from util.tensor_operations import compute_pairwise_distances
+
+
+def benchmark(function, first, second, distance_function, repeats, backward):
+    def run():
+        with tf.GradientTape() as tape:
+            tape.watch(first)
+            distances = function(first, second, distance_function)
+            loss_value = tf.reduce_sum(distances)
+        if backward:
+            return tape.gradient(loss_value, first).numpy()
+        return distances.numpy()
+
+    run()
+    start = time.time()
+    for _ in range(repeats):
+        run()
+    return (time.time() - start) / repeats
+
+
+if __name__ == '__main__':
+    tf.enable_eager_execution()
+    parser = argparse.ArgumentParser(description='Benchmark pairwise distance kernels')
+    parser.add_argument('--sizes', default='128x128,1024x1024,1024x4096',
+                        help='comma separated NxM shapes')
+    parser.add_argument('--dimension', type=int, default=128)
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--backward', action='store_true',
+                        help='include the gradient with respect to the first argument')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+    for size in args.sizes.split(','):
+        n, m = [int(x) for x in size.split('x')]
+        first = tf.constant(random_state.randn(n, args.dimension), dtype=tf.float32)
+        second = tf.constant(random_state.randn(m, args.dimension), dtype=tf.float32)
+        for distance_function in DistanceFunction:
+            broadcast_seconds = benchmark(
+                broadcast_pairwise_distances, first, second, distance_function,
+                args.repeats, args.backward)
+            gram_seconds = benchmark(
+                compute_pairwise_distances, first, second, distance_function,
+                args.repeats, args.backward)
+            print('{:>10} {:<28} broadcast {:8.2f}ms ({:8.1f}MB)  gram {:8.2f}ms ({:6.1f}MB)  {:5.1f}x'.format(
+                size,
+                distance_function.name,
+                broadcast_seconds * 1000,
+                n * m * args.dimension * 4 / 2 ** 20,
+                gram_seconds * 1000,
+                n * m * 4 / 2 ** 20,
+                broadcast_seconds / gram_seconds))
@@ -1,19 +1,19 @@
 import argparse
-import boto3
 import json
 
 from metric_learning.example_configurations import configs
 from util.config import generate_configs_from_experiment
-
-conn_sqs = boto3.resource('sqs')
+from util.job_queue import get_queue
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Train using a specified config')
     parser.add_argument('--config', help='config to run')
     parser.add_argument('--experiment', help='experiment to run')
+    parser.add_argument('--local', action='store_true',
+                        help='use the local job queue instead of SQS')
     args = parser.parse_args()
 
-    queue = conn_sqs.get_queue_by_name(QueueName='experiment-configs')
+    queue = get_queue('experiment-configs', args.local)
 
     if args.experiment:
         experiments = generate_configs_from_experiment(args.experiment)
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import random
+import re
+
+import numpy as np
+import tensorflow as tf
+
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from util.config import CONFIG
+from util.uploader import get_uploader
+
+tfe = tf.contrib.eager
+
+
+# a checkpoint is the tensorflow checkpoint ckpt-<step>.index and
+# ckpt-<step>.data-* of its variables and the metadata ckpt-<step>.json,
+# which is written last and marks the checkpoint as complete
+CHECKPOINT_PATTERN = re.compile(r'^ckpt-(\d+)\.json$')
+
+
+def _get(option, fallback):
+    if not CONFIG.has_section('checkpoint'):
+        return fallback
+    return CONFIG['checkpoint'].get(option, fallback)
+
+
+def is_enabled():
+    if not CONFIG.has_section('checkpoint'):
+        return False
+    return CONFIG['checkpoint'].getboolean('enabled', False)
+
+
+def checkpoint_directory(conf, experiment_name, job_id):
+    # run names carry a timestamp, so a restarted run finds the checkpoints
+    # of the run it replaces through a hash of its configuration and of the
+    # id of its job, which stays the same when the job is received again;
+    # concurrent runs of one configuration have different job ids
+    key = json.dumps([experiment_name or '', job_id, conf], sort_keys=True)
+    return os.path.join(
+        _get('dir', os.path.join(CONFIG['tensorboard']['local_dir'], 'checkpoints')),
+        hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+
+def get_rng_state():
+    # the batch designs sample with python's random and numpy's global
+    # generator; op level randomness of tensorflow is not captured. The
+    # state is made of lists so that it can be stored as json
+    version, internal_state, gauss_next = random.getstate()
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        'random': [version, list(internal_state), gauss_next],
+        'numpy': [name, keys.tolist(), position, has_gauss, cached_gaussian],
+    }
+
+
+def set_rng_state(state):
+    version, internal_state, gauss_next = state['random']
+    random.setstate((
+        int(version),
+        tuple(int(x) for x in internal_state),
+        None if gauss_next is None else float(gauss_next)))
+    name, keys, position, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((
+        name,
+        np.asarray(keys, dtype=np.uint32),
+        int(position),
+        int(has_gauss),
+        float(cached_gaussian)))
+
+
+def _to_json(value):
+    # metrics and train statistics are Decimals for DynamoDB; they are read
+    # back as Decimals through parse_float
+    return float(value)
+
+
+class CheckpointManager(object):
+    # keeps the last keep checkpoints of a run in directory. save() copies
+    # the values on the calling thread and writes them on a background
+    # thread, so training continues while the files are written; a
+    # checkpoint only counts once its metadata is written, so a run that is
+    # killed mid-write resumes from the previous one. With upload_prefix
+    # the kept checkpoints are mirrored to the object store, so that a run
+    # restarted on another host resumes from there
+    def __init__(self, directory, keep=2, upload_prefix=None, uploader=None):
+        self.directory = directory
+        self.keep = max(keep, 1)
+        self.upload_prefix = upload_prefix
+        self.uploader = uploader
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _uploader(self):
+        if self.uploader is None:
+            self.uploader = get_uploader()
+        return self.uploader
+
+    def _key(self, filename):
+        return '{}/{}'.format(self.upload_prefix, filename)
+
+    def _uploaded_keys(self, step=None):
+        prefix = self.upload_prefix + '/'
+        if step is not None:
+            prefix += 'ckpt-{}.'.format(step)
+        return self._uploader().object_store.list_keys(
+            CONFIG['tensorboard']['s3_bucket'], prefix)
+
+    def uploaded_steps(self):
+        ret = []
+        for key in self._uploaded_keys():
+            match = CHECKPOINT_PATTERN.match(key.rsplit('/', 1)[-1])
+            if match:
+                ret.append(int(match.group(1)))
+        return sorted(ret)
+
+    def download_latest(self):
+        steps = self.uploaded_steps()
+        if not steps:
+            return
+        # the metadata comes last, so that an interrupted download is not
+        # taken for a complete checkpoint
+        keys = sorted(self._uploaded_keys(steps[-1]), key=lambda key: key.endswith('.json'))
+        for key in keys:
+            path = os.path.join(self.directory, key.rsplit('/', 1)[-1])
+            self._uploader().object_store.get_file(
+                CONFIG['tensorboard']['s3_bucket'], key, path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+    def steps(self):
+        ret = []
+        for filename in os.listdir(self.directory):
+            match = CHECKPOINT_PATTERN.match(filename)
+            if match:
+                ret.append(int(match.group(1)))
+        return sorted(ret)
+
+    def path(self, step):
+        # the prefix of the files of the checkpoint of step
+        return os.path.join(self.directory, 'ckpt-{}'.format(step))
+
+    def files(self, step):
+        prefix = 'ckpt-{}.'.format(step)
+        return sorted(
+            filename for filename in os.listdir(self.directory)
+            if filename.startswith(prefix) and not filename.endswith('.tmp'))
+
+    def latest(self):
+        # returns (arrays, metadata) of the newest checkpoint or None; on a
+        # host without local checkpoints the newest uploaded one is fetched
+        steps = self.steps()
+        if not steps and self.upload_prefix is not None:
+            self.download_latest()
+            steps = self.steps()
+        if not steps:
+            return None
+        path = self.path(steps[-1])
+        with open(path + '.json') as f:
+            metadata = json.load(f, parse_float=Decimal)
+        reader = tf.train.NewCheckpointReader(path)
+        arrays = {
+            name: reader.get_tensor(name)
+            for name in reader.get_variable_to_shape_map()
+        }
+        return arrays, metadata
+
+    def save(self, step, variables, metadata):
+        # variables maps names to variables; at most one write is pending,
+        # so the snapshots held in memory stay bounded
+        arrays = {name: np.array(variable.numpy()) for name, variable in variables.items()}
+        self.wait()
+        self.pending = self.executor.submit(self._write, step, arrays, metadata)
+
+    def wait(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def _write(self, step, arrays, metadata):
+        path = self.path(step)
+        # the snapshot is saved from variables of its own on the cpu, so the
+        # variables of the model can change while it is written
+        with tf.device('/cpu:0'):
+            snapshot = {name: tfe.Variable(value) for name, value in arrays.items()}
+        tf.train.Saver(var_list=snapshot).save(
+            None, path, write_meta_graph=False, write_state=False)
+        with open(path + '.json.tmp', 'w') as f:
+            json.dump(metadata, f, default=_to_json)
+        os.replace(path + '.json.tmp', path + '.json')
+        if self.upload_prefix is not None:
+            # the upload has to finish before rotation can remove the files;
+            # the metadata is queued last, so that it marks a complete upload
+            for filename in sorted(self.files(step), key=lambda name: name.endswith('.json')):
+                self._uploader().put_file(
+                    os.path.join(self.directory, filename),
+                    CONFIG['tensorboard']['s3_bucket'],
+                    self._key(filename))
+            if not self._uploader().flush():
+                return
+        for old_step in self.steps()[:-self.keep]:
+            self._remove(old_step)
+
+    def _remove(self, step):
+        # the metadata goes first, so that a partly removed checkpoint is no
+        # longer taken for a complete one
+        for filename in sorted(self.files(step), key=lambda name: not name.endswith('.json')):
+            os.remove(os.path.join(self.directory, filename))
+        if self.upload_prefix is not None:
+            keys = sorted(self._uploaded_keys(step), key=lambda key: not key.endswith('.json'))
+            for key in keys:
+                self._uploader().delete(CONFIG['tensorboard']['s3_bucket'], key)
+
+    def clear(self):
+        self.wait()
+        steps = set(self.steps())
+        if self.upload_prefix is not None:
+            steps.update(self.uploaded_steps())
+        for step in sorted(steps):
+            self._remove(step)
+        if self.upload_prefix is not None:
+            self._uploader().flush()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown(wait=True)
+
+
+def get_checkpoint_manager(conf, experiment_name, job_id):
+    # returns None when resumable checkpoints are disabled or the run has no
+    # job id to tell it apart from concurrent runs of its configuration;
+    # they are copied to S3 as well when s3_upload is set
+    if not is_enabled() or job_id is None:
+        return None
+    directory = checkpoint_directory(conf, experiment_name, job_id)
+    upload_prefix = None
+    if CONFIG['tensorboard'].getboolean('s3_upload'):
+        upload_prefix = '{}/checkpoints/{}'.format(
+            CONFIG['tensorboard']['s3_key'], os.path.basename(directory))
+    return CheckpointManager(directory, int(_get('keep', 2)), upload_prefix)
+
+
+def restore_variables(variables, arrays):
+    # every saved value has to find its variable; variables that were not
+    # saved, such as optimizer slots of variables without gradients, keep
+    # their values
+    for name, value in arrays.items():
+        if name not in variables:
+            raise Exception('Checkpoint variable {} does not exist'.format(name))
+        variable = variables[name]
+        if tuple(variable.shape.as_list()) != value.shape:
+            raise Exception('Checkpoint variable {} has shape {} instead of {}'.format(
+                name, value.shape, variable.shape.as_list()))
+        variable.assign(value.astype(variable.dtype.as_numpy_dtype))
@@ -0,0 +1,179 @@
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def squared_distances(first, second):
+    return np.maximum(
+        np.sum(np.square(first), axis=1)[:, None] +
+        np.sum(np.square(second), axis=1)[None] -
+        2 * np.dot(first, second.T),
+        0.)
+
+
+def default_num_threads():
+    return os.cpu_count() or 1
+
+
+def assign(data, centroids, chunk_size=8192, num_threads=1):
+    # chunks are independent and numpy releases the GIL in the matrix
+    # products, so they can be assigned on several threads
+    assignments = np.empty(data.shape[0], dtype=np.int64)
+    centroid_norms = np.sum(np.square(centroids), axis=1)
+
+    def assign_chunk(start):
+        chunk = data[start:start + chunk_size]
+        # the squared norm of the data point does not change the argmin
+        assignments[start:start + chunk_size] = np.argmin(
+            centroid_norms[None] - 2 * np.dot(chunk, centroids.T), axis=1)
+
+    starts = range(0, data.shape[0], chunk_size)
+    if num_threads <= 1 or len(starts) <= 1:
+        for start in starts:
+            assign_chunk(start)
+    else:
+        with ThreadPoolExecutor(num_threads) as executor:
+            list(executor.map(assign_chunk, starts))
+    return assignments
+
+
+def kmeans_plus_plus(data, num_clusters, random_state):
+    # D^2 seeding; the distances to the closest chosen centroid are updated
+    # incrementally, so each new centroid costs one pass over the data
+    num_clusters = min(num_clusters, data.shape[0])
+    norms = np.sum(np.square(data), axis=1)
+
+    def distances_to(index):
+        return np.maximum(norms + norms[index] - 2 * np.dot(data, data[index]), 0.)
+
+    indices = np.empty(num_clusters, dtype=np.int64)
+    indices[0] = random_state.randint(data.shape[0])
+    closest = distances_to(indices[0])
+    for k in range(1, num_clusters):
+        total = closest.sum()
+        if total > 0:
+            index = np.searchsorted(np.cumsum(closest), random_state.random_sample() * total)
+            indices[k] = min(index, data.shape[0] - 1)
+        else:
+            indices[k] = random_state.randint(data.shape[0])
+        np.minimum(closest, distances_to(indices[k]), out=closest)
+    return data[indices]
+
+
+def initial_centroids(data, num_clusters, random_state, init='random', seed_sample_size=None):
+    num_clusters = min(num_clusters, data.shape[0])
+    if init == 'random':
+        return data[random_state.choice(data.shape[0], num_clusters, replace=False)]
+    if init == 'k-means++':
+        # seeding on a subsample keeps the quadratic cost in check for
+        # datasets with many classes
+        sample = data
+        if seed_sample_size is not None and seed_sample_size < data.shape[0]:
+            sample_size = max(seed_sample_size, num_clusters)
+            sample = data[random_state.choice(data.shape[0], sample_size, replace=False)]
+        return kmeans_plus_plus(sample, num_clusters, random_state)
+    raise Exception('Unknown k-means initialization: {}'.format(init))
+
+
+def reseed_empty(centroids, counts, data, random_state):
+    empty = counts == 0
+    if not np.any(empty):
+        return centroids
+    return np.where(
+        empty[:, None],
+        data[random_state.choice(data.shape[0], centroids.shape[0])],
+        centroids)
+
+
+def kmeans(data, num_clusters, num_iterations, random_state,
+           init='random', seed_sample_size=None, num_threads=1):
+    # Lloyd's algorithm over the full data
+    centroids = initial_centroids(data, num_clusters, random_state, init, seed_sample_size)
+    num_clusters = centroids.shape[0]
+    for _ in range(num_iterations):
+        assignments = assign(data, centroids, num_threads=num_threads)
+        counts = np.bincount(assignments, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        centroids = reseed_empty(
+            sums / np.maximum(counts, 1)[:, None], counts, data, random_state)
+    return centroids
+
+
+def minibatch_kmeans(data, num_clusters, num_iterations, batch_size, random_state,
+                     init='k-means++', seed_sample_size=None, num_threads=1):
+    # each centroid moves towards the mean of its batch members with a
+    # learning rate of 1 / (number of points it has seen so far)
+    centroids = initial_centroids(data, num_clusters, random_state, init, seed_sample_size)
+    num_clusters = centroids.shape[0]
+    seen = np.zeros(num_clusters, dtype=np.float64)
+    for _ in range(num_iterations):
+        batch = data[random_state.randint(data.shape[0], size=batch_size)]
+        assignments = assign(batch, centroids, num_threads=num_threads)
+        counts = np.bincount(assignments, minlength=num_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, batch)
+        seen += counts
+        updated = counts > 0
+        centroids[updated] += (
+            sums[updated] - counts[updated, None] * centroids[updated]
+        ) / seen[updated, None]
+    return centroids
+
+
+BACKENDS = ['kmeans', 'minibatch']
+
+
+def resolve_settings(num_points, num_clusters, settings):
+    # fills in the defaults; 'auto' uses full k-means while the data is small
+    # enough for it and mini-batch k-means otherwise
+    backend = settings.get('backend', 'auto')
+    if backend == 'auto':
+        backend = 'kmeans' if num_points * num_clusters <= settings.get(
+            'auto_threshold', 2 ** 26) else 'minibatch'
+    if backend not in BACKENDS:
+        raise Exception('Unknown clustering backend: {}'.format(backend))
+    seed_sample_size = settings.get('seed_sample_size', max(8 * num_clusters, 10000))
+    # k-means++ needs one pass over the seeding sample per centroid, which is
+    # too slow with thousands of classes unless it is asked for explicitly
+    init = settings.get('init', 'auto')
+    if init == 'auto':
+        init = 'k-means++' if min(seed_sample_size, num_points) * num_clusters <= settings.get(
+            'auto_threshold', 2 ** 26) else 'random'
+    resolved = {
+        'backend': backend,
+        'init': init,
+        'seed_sample_size': seed_sample_size,
+        'num_threads': settings.get('num_threads') or default_num_threads(),
+        'seed': settings.get('seed', 0),
+    }
+    if backend == 'kmeans':
+        resolved['num_iterations'] = settings.get('num_iterations', 30)
+    else:
+        resolved['batch_size'] = settings.get('batch_size', 2048)
+        resolved['num_iterations'] = settings.get('num_iterations', 100)
+    return resolved
+
+
+def cluster(data, num_clusters, settings=None):
+    # returns the cluster of every point together with the exact settings
+    # used and the time spent
+    settings = resolve_settings(data.shape[0], num_clusters, settings or {})
+    random_state = np.random.RandomState(settings['seed'])
+    data = np.asarray(data, dtype=np.float32)
+    start = time.time()
+    if settings['backend'] == 'kmeans':
+        centroids = kmeans(
+            data, num_clusters, settings['num_iterations'], random_state,
+            settings['init'], settings['seed_sample_size'], settings['num_threads'])
+    else:
+        centroids = minibatch_kmeans(
+            data, num_clusters, settings['num_iterations'], settings['batch_size'],
+            random_state, settings['init'], settings['seed_sample_size'],
+            settings['num_threads'])
+    assignments = assign(data, centroids, num_threads=settings['num_threads'])
+    settings['seconds'] = time.time() - start
+    return assignments, settings
@@ -1,5 +1,6 @@
 from tqdm import tqdm
 
+import json
 import math
 import random
 import requests
@@ -49,11 +50,45 @@ def extract_zip(filepath, directory):
         zip_ref.extractall(directory)
 
 
+FILE_INDEX_ENV = 'METRIC_LEARNING_FILE_INDEX'
+
+_file_index = {}
+
+
+def write_file_index(directories, path):
+    # directory listings that processes started with FILE_INDEX_ENV pointing
+    # at path read instead of walking the file system themselves
+    index = {
+        directory: [[subdir, files] for subdir, _, files in os.walk(directory)]
+        for directory in directories
+    }
+    with open(path, 'w') as f:
+        json.dump(index, f)
+    return path
+
+
+def get_file_index():
+    path = os.environ.get(FILE_INDEX_ENV)
+    if not path:
+        return None
+    if path not in _file_index:
+        with open(path) as f:
+            _file_index[path] = json.load(f)
+    return _file_index[path]
+
+
+def walk_directory(directory):
+    index = get_file_index()
+    if index is not None and directory in index:
+        return index[directory]
+    return [[subdir, files] for subdir, _, files in os.walk(directory)]
+
+
 def load_images_from_directory(directory, splits=None, distort=None, multiple=1):
     label_map = {}
     labels = []
     image_files = []
-    for subdir, dirs, files in os.walk(directory):
+    for subdir, files in walk_directory(directory):
         for file in files:
             if splits:
                 split = int(subdir.split('/')[-2])
@@ -139,7 +174,7 @@ def group_npairs(images, labels, n):
 
 def get_training_files_labels(conf):
     cv_splits = CONFIG['dataset'].getint('cross_validation_splits')
-    cv_split = CONFIG['dataset'].getint('cross_validation_split')
+    cv_split = conf['dataset'].get('cross_validation_split', -1)
     train_dir = os.path.join(
         CONFIG['dataset']['experiment_dir'],
         conf['dataset']['name'],
@@ -0,0 +1,59 @@
+import re
+
+import tensorflow as tf
+
+from util.config import CONFIG
+
+
+def get_devices(conf):
+    return conf.get('trainer', {}).get('devices') or []
+
+
+def num_cpu_devices(conf=None):
+    # the cpu devices a configuration refers to have to exist before eager
+    # execution is enabled, so their number is taken from the configuration
+    # when it is known and from default.conf otherwise
+    count = 1
+    if CONFIG.has_section('train'):
+        count = CONFIG['train'].getint('cpu_devices', 1)
+    if conf is not None:
+        for device in get_devices(conf):
+            match = re.search(r'cpu:(\d+)$', device, re.IGNORECASE)
+            if match:
+                count = max(count, int(match.group(1)) + 1)
+    return count
+
+
+def session_config(conf=None):
+    # processes that share a GPU need allow_growth, since tensorflow reserves
+    # all memory of the visible GPUs otherwise
+    allow_growth = CONFIG.has_section('train') and CONFIG['train'].getboolean('gpu_allow_growth', False)
+    return tf.ConfigProto(
+        device_count={'CPU': num_cpu_devices(conf)},
+        gpu_options=tf.GPUOptions(allow_growth=allow_growth))
+
+
+def replicate(function, inputs, devices):
+    # deals the batch out to the devices row by row, so that every shard of a
+    # grouped batch sees members of every group, runs function on each shard
+    # on its own device and stitches the results back into the original
+    # order, so that callers still see the outputs for the whole batch.
+    # function runs once per shard: batch normalization layers normalize
+    # with per-shard statistics and update their moving averages once per
+    # shard.
+    # This is not tf.distribute: the devices belong to this process, and
+    # there is no multi-worker mode. Eager execution dispatches the shards
+    # one after another, so they only run concurrently when the train step
+    # is compiled (trainer compile_step); otherwise replicate costs about as
+    # much as running the whole batch on a single device
+    if len(devices) <= 1:
+        return function(inputs)
+    batch_size = tf.shape(inputs)[0]
+    partitions = tf.range(batch_size) % len(devices)
+    shards = tf.dynamic_partition(inputs, partitions, len(devices))
+    indices = tf.dynamic_partition(tf.range(batch_size), partitions, len(devices))
+    outputs = []
+    for device, shard in zip(devices, shards):
+        with tf.device(device):
+            outputs.append(function(shard))
+    return tf.dynamic_stitch(indices, outputs)
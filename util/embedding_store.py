@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from util.config import CONFIG
+
+
+def model_fingerprint(model):
+    h = hashlib.sha1()
+    for variable in model.variables:
+        h.update(variable.name.encode('utf-8'))
+        h.update(np.ascontiguousarray(variable.numpy()).tobytes())
+    return h.hexdigest()
+
+
+class EmbeddingStore(object):
+    def __init__(self, directory, max_size, dtype='float32'):
+        self.directory = directory
+        self.max_size = max_size
+        self.dtype = np.dtype(dtype)
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key(**parts):
+        return hashlib.sha1(
+            json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        embeddings_file = os.path.join(path, 'embeddings.npy')
+        labels_file = os.path.join(path, 'labels.npy')
+        if not os.path.exists(embeddings_file) or not os.path.exists(labels_file):
+            return None
+        os.utime(path)
+        return (
+            np.load(embeddings_file, mmap_mode='r'),
+            np.load(labels_file, mmap_mode='r'),
+        )
+
+    def put(self, key, embeddings, labels):
+        path = self._path(key)
+        temp_path = '{}.tmp-{}'.format(path, os.getpid())
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        np.save(os.path.join(temp_path, 'embeddings.npy'),
+                np.asarray(embeddings).astype(self.dtype))
+        np.save(os.path.join(temp_path, 'labels.npy'),
+                np.asarray(labels).astype(np.int64))
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # another process stored the same key first
+            shutil.rmtree(temp_path, ignore_errors=True)
+        self.evict(keep=key)
+
+    def entries(self):
+        ret = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if '.tmp-' in key or not os.path.isdir(path):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(path, filename))
+                for filename in os.listdir(path))
+            ret.append((os.path.getmtime(path), size, key))
+        return sorted(ret)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total_size -= size
+
+
+def get_embedding_store():
+    if not CONFIG.has_section('embedding_cache') or \
+            not CONFIG['embedding_cache'].getboolean('enabled'):
+        return None
+    return EmbeddingStore(
+        CONFIG['embedding_cache']['dir'],
+        CONFIG['embedding_cache'].getint('max_size_mb') * 1024 * 1024,
+        CONFIG['embedding_cache'].get('dtype', 'float32'))
@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from util.config import CONFIG
+from util.registry.metric import Metric
+from util.registry.model import Model
+
+import tensorflow as tf
+
+
+def metric_threads():
+    if not CONFIG.has_section('evaluation'):
+        return 1
+    return max(CONFIG['evaluation'].getint('metric_threads', 1), 1)
+
+
+class EvaluationPlan(object):
+    # metrics are grouped by the embeddings they need; each group is embedded
+    # once on the calling thread and the metrics then run concurrently on
+    # read-only views of the shared arrays
+    def __init__(self, conf, model, data_files):
+        self.model = model
+        self.data_files = data_files
+        self.metrics = [
+            Metric.create(metric_conf['name'], conf)
+            for metric_conf in model.conf['metrics']
+        ]
+        self.groups = OrderedDict()
+        for metric in self.metrics:
+            self.groups.setdefault(metric.embedding_key(), []).append(metric)
+
+    def embed(self):
+        for key, metrics in self.groups.items():
+            if key in Metric.cache:
+                continue
+            dataset, num_testcases = metrics[0].create_test_dataset(
+                self.model, self.data_files)
+            embeddings, labels = metrics[0].compute_embeddings(
+                self.model, dataset, num_testcases)
+            embeddings.flags.writeable = False
+            labels.flags.writeable = False
+            Metric.cache[key] = (embeddings, labels)
+
+    def run(self, num_threads=None):
+        # returns (metric, score) in the configured order
+        num_threads = num_threads or metric_threads()
+        Metric.cache.clear()
+        try:
+            self.embed()
+            if num_threads <= 1 or len(self.metrics) <= 1:
+                return [
+                    (metric, metric.compute_metric(self.model, None, None))
+                    for metric in self.metrics
+                ]
+            with ThreadPoolExecutor(min(num_threads, len(self.metrics))) as executor:
+                futures = [
+                    executor.submit(metric.compute_metric, self.model, None, None)
+                    for metric in self.metrics
+                ]
+                return [
+                    (metric, future.result())
+                    for metric, future in zip(self.metrics, futures)
+                ]
+        finally:
+            Metric.cache.clear()
+
+
+def placeholder_inputs(conf):
+    # a single blank image of the size the model is trained on, for building
+    # the variables of a model before it sees data
+    if 'random_crop' in conf['image']:
+        width = conf['image']['random_crop']['width']
+        height = conf['image']['random_crop']['height']
+    else:
+        width = conf['image']['width']
+        height = conf['image']['height']
+    return tf.zeros([1, height, width, conf['image']['channel']])
+
+
+def copy_model(conf, model):
+    # a model with the given configuration and the weights of model; the
+    # weights are cast to the dtypes of the new model
+    copy = Model.create(conf['model']['name'], conf, model.extra_info)
+    copy(placeholder_inputs(conf), training=False)
+    copy.set_weights([
+        weight.astype(variable.dtype.as_numpy_dtype)
+        for weight, variable in zip(model.get_weights(), copy.weights)
+    ])
+    return copy
+
+
+class AsyncEvaluator(object):
+    # evaluates snapshots of the training weights on a background thread
+    # while training continues; evaluations run one at a time on a separate
+    # copy of the model and their results are handed back in submission order.
+    # reference is an optional second model, built by the caller on the main
+    # thread, that evaluate receives loaded with the reference weights given
+    # to submit
+    def __init__(self, conf, evaluate, max_pending=1, reference=None):
+        self.conf = conf
+        self.evaluate = evaluate
+        self.max_pending = max(max_pending, 1)
+        self.model = None
+        self.reference = reference
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = []
+
+    def submit(self, model, tag, reference_weights=None):
+        # the weights are copied on the calling thread, so training can
+        # change them as soon as this returns; models are only built here,
+        # since building them changes the global keras floatx
+        weights = model.get_weights()
+        if self.model is None:
+            self.model = copy_model(self.conf, model)
+
+        def evaluate():
+            self.model.set_weights(weights)
+            if self.reference is not None:
+                self.reference.set_weights(reference_weights)
+            return self.evaluate(self.model, self.reference)
+
+        self.pending.append((tag, self.executor.submit(evaluate)))
+
+    def completed(self, wait=False):
+        # returns the (tag, result) pairs that are done; blocks while more
+        # than max_pending evaluations are queued, or until all are done
+        # when wait is set
+        limit = 0 if wait else self.max_pending
+        ret = []
+        while self.pending and (self.pending[0][1].done() or len(self.pending) > limit):
+            tag, future = self.pending.pop(0)
+            ret.append((tag, future.result()))
+        return ret
+
+    def close(self):
+        self.executor.shutdown(wait=True)
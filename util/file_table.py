@@ -0,0 +1,53 @@
+import hashlib
+
+import numpy as np
+import tensorflow as tf
+
+
+MAX_FILE_TABLES = 8
+
+_file_tables = []
+
+
+class FileTable(object):
+    def __init__(self, image_files, labels):
+        self.image_files = image_files
+        self.label_list = labels
+        self.paths = np.array([x.encode('utf-8') for x in image_files])
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.rows_by_path = None
+        self.shard_rows = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def indices(self, image_files):
+        if self.rows_by_path is None:
+            self.rows_by_path = {x: i for i, x in enumerate(self.image_files)}
+        return np.array([self.rows_by_path[x] for x in image_files], dtype=np.int32)
+
+    def digest(self, indices):
+        h = hashlib.sha1()
+        h.update(self.paths[indices].tobytes())
+        return h.hexdigest()
+
+    def get_shard_rows(self, shards):
+        if shards.directory not in self.shard_rows:
+            self.shard_rows[shards.directory] = shards.rows(self.image_files)
+        return self.shard_rows[shards.directory]
+
+    def lookup_path(self, index):
+        # the table becomes a constant of the traced map function, so the
+        # lookups of parallel map calls run without going through python
+        return tf.gather(tf.constant(self.paths), index)
+
+
+def get_file_table(image_files, labels):
+    for table in _file_tables:
+        if table.image_files is image_files and table.label_list is labels:
+            return table
+    table = FileTable(image_files, labels)
+    _file_tables.append(table)
+    if len(_file_tables) > MAX_FILE_TABLES:
+        _file_tables.pop(0)
+    return table
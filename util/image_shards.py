@@ -0,0 +1,90 @@
+from tqdm import tqdm
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from util.config import CONFIG
+
+
+# augmentations are applied after parsing, so they do not affect the shards
+AUGMENTATION_KEYS = ['random_crop', 'random_flip']
+
+_loaded_shards = {}
+
+
+def shard_directory(conf):
+    image_conf = {
+        k: v for k, v in conf['image'].items() if k not in AUGMENTATION_KEYS
+    }
+    key = hashlib.sha1(json.dumps({
+        'dataset': conf['dataset']['name'],
+        'image': image_conf,
+    }, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(CONFIG['dataset']['shard_dir'], conf['dataset']['name'], key)
+
+
+def write_image_shards(conf, data_loader, image_files):
+    directory = shard_directory(conf)
+    temp_directory = '{}.tmp-{}'.format(directory, os.getpid())
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+
+    first_image = np.asarray(data_loader.image_parse_function(image_files[0]))
+    images = np.lib.format.open_memmap(
+        os.path.join(temp_directory, 'images.npy'),
+        mode='w+',
+        dtype=np.uint8,
+        shape=(len(image_files),) + first_image.shape)
+    for row, image_file in enumerate(tqdm(
+            image_files, desc='shards', dynamic_ncols=True)):
+        image = np.asarray(data_loader.image_parse_function(image_file))
+        # pixels are stored as uint8 to keep the shards a quarter of the size
+        # of float32 ones; resized images are rounded to the nearest value
+        images[row] = np.clip(np.round(image), 0, 255).astype(np.uint8)
+    images.flush()
+    del images
+    with open(os.path.join(temp_directory, 'index.json'), 'w') as f:
+        json.dump({'image': conf['image'], 'files': list(image_files)}, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(temp_directory, directory)
+    _loaded_shards.pop(directory, None)
+    return directory
+
+
+class ImageShards(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.images = np.load(os.path.join(directory, 'images.npy'), mmap_mode='r')
+        with open(os.path.join(directory, 'index.json')) as f:
+            self.files = json.load(f)['files']
+        self.rows_by_file = {image_file: row for row, image_file in enumerate(self.files)}
+
+    @property
+    def image_shape(self):
+        return self.images.shape[1:]
+
+    def rows(self, image_files):
+        try:
+            return np.array(
+                [self.rows_by_file[image_file] for image_file in image_files],
+                dtype=np.int64)
+        except KeyError:
+            return None
+
+    def read_rows(self, rows):
+        # copies the images of rows out of the memory map with one read
+        return self.images[np.asarray(rows, dtype=np.int64)]
+
+    @staticmethod
+    def load(conf):
+        directory = shard_directory(conf)
+        if directory not in _loaded_shards:
+            if not os.path.exists(os.path.join(directory, 'index.json')):
+                return None
+            _loaded_shards[directory] = ImageShards(directory)
+        return _loaded_shards[directory]
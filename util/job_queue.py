@@ -0,0 +1,202 @@
+import boto3
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from util.config import CONFIG
+
+
+def _get(option, fallback):
+    if not CONFIG.has_section('job_queue'):
+        return fallback
+    return CONFIG['job_queue'].get(option, fallback)
+
+
+class Message(object):
+    # the subset of boto3's sqs.Message that the experiment scripts use
+    def __init__(self, queue, message_id, body, message_attributes, receipt_handle):
+        self.queue = queue
+        self.message_id = message_id
+        self.body = body
+        self.message_attributes = message_attributes
+        self.receipt_handle = receipt_handle
+
+    def delete(self):
+        self.queue.delete_message(self.message_id, self.receipt_handle)
+
+    def change_visibility(self, VisibilityTimeout):
+        self.queue.change_message_visibility(
+            self.message_id, self.receipt_handle, VisibilityTimeout)
+
+
+class JobQueue(object):
+    # an SQLite backed queue with the enqueue/consume API of boto3's
+    # sqs.Queue. A received message is leased to its consumer until its
+    # visibility timeout runs out, after which another consumer receives it
+    # again, so jobs of crashed consumers are retried. Messages received
+    # max_receives times without being deleted are marked failed instead.
+    def __init__(self, path, name, visibility_timeout=600, max_receives=3):
+        self.path = path
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.max_receives = max_receives
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    queue TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    attributes TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    visible_at REAL NOT NULL,
+                    receive_count INTEGER NOT NULL DEFAULT 0,
+                    receipt_handle TEXT
+                )''')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS messages_visible '
+                'ON messages (queue, state, visible_at)')
+
+    def _connect(self):
+        # isolation_level None lets BEGIN IMMEDIATE take the write lock
+        # before the pending messages are read
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _Transaction(connection)
+
+    def send_message(self, MessageBody, MessageAttributes=None):
+        with self._connect() as connection:
+            cursor = connection.execute(
+                'INSERT INTO messages (queue, body, attributes, visible_at) VALUES (?, ?, ?, ?)',
+                (self.name, MessageBody, json.dumps(MessageAttributes or {}), time.time()))
+            return {'MessageId': str(cursor.lastrowid)}
+
+    def receive_messages(self, MaxNumberOfMessages=1, MessageAttributeNames=None,
+                         WaitTimeSeconds=0, VisibilityTimeout=None):
+        visibility_timeout = VisibilityTimeout or self.visibility_timeout
+        deadline = time.time() + WaitTimeSeconds
+        while True:
+            messages = self._lease(MaxNumberOfMessages, visibility_timeout)
+            if messages or time.time() >= deadline:
+                break
+            time.sleep(min(1., max(deadline - time.time(), 0.)))
+        names = MessageAttributeNames or []
+        return [
+            Message(self, message_id, body, {
+                k: v for k, v in attributes.items() if 'All' in names or k in names
+            }, receipt_handle)
+            for message_id, body, attributes, receipt_handle in messages
+        ]
+
+    def _lease(self, num_messages, visibility_timeout):
+        now = time.time()
+        ret = []
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT id, body, attributes, receive_count FROM messages '
+                'WHERE queue = ? AND state = ? AND visible_at <= ? ORDER BY id',
+                (self.name, 'pending', now)).fetchall()
+            for message_id, body, attributes, receive_count in rows:
+                if len(ret) == num_messages:
+                    break
+                if receive_count >= self.max_receives:
+                    connection.execute(
+                        'UPDATE messages SET state = ? WHERE id = ?', ('failed', message_id))
+                    continue
+                receipt_handle = uuid.uuid4().hex
+                connection.execute(
+                    'UPDATE messages SET visible_at = ?, receive_count = ?, receipt_handle = ? '
+                    'WHERE id = ?',
+                    (now + visibility_timeout, receive_count + 1, receipt_handle, message_id))
+                ret.append((message_id, body, json.loads(attributes), receipt_handle))
+            connection.execute('COMMIT')
+        return ret
+
+    def delete_message(self, message_id, receipt_handle):
+        # a consumer whose lease ran out cannot delete the message once
+        # another consumer received it
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM messages WHERE id = ? AND receipt_handle = ?',
+                (message_id, receipt_handle))
+
+    def change_message_visibility(self, message_id, receipt_handle, visibility_timeout):
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE messages SET visible_at = ? WHERE id = ? AND receipt_handle = ?',
+                (time.time() + visibility_timeout, message_id, receipt_handle))
+
+    def count(self, state='pending'):
+        with self._connect() as connection:
+            return connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE queue = ? AND state = ?',
+                (self.name, state)).fetchone()[0]
+
+
+class _Transaction(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and self.connection.in_transaction:
+            self.connection.execute('ROLLBACK')
+        self.connection.close()
+
+
+class Heartbeat(object):
+    # keeps extending the lease of a message while its job runs
+    def __init__(self, message, visibility_timeout, interval):
+        self.message = message
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.message.change_visibility(VisibilityTimeout=self.visibility_timeout)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+
+def visibility_timeout():
+    return int(_get('visibility_timeout', 600))
+
+
+def heartbeat_interval():
+    return int(_get('heartbeat_interval', 60))
+
+
+def num_unfinished(queue):
+    # messages that are waiting or leased to a consumer; a leased message is
+    # received again when its consumer dies before deleting it
+    if isinstance(queue, JobQueue):
+        return queue.count()
+    queue.reload()
+    return int(queue.attributes['ApproximateNumberOfMessages']) + \
+        int(queue.attributes['ApproximateNumberOfMessagesNotVisible'])
+
+
+def get_queue(name, local=False):
+    if local:
+        return JobQueue(
+            _get('path', '/tmp/research/job_queue.sqlite'),
+            name,
+            visibility_timeout(),
+            int(_get('max_receives', 3)))
+    return boto3.resource('sqs').get_queue_by_name(QueueName=name)
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def sample_without_replacement(populations, size, random_state=np.random):
+    # Draws `size` distinct integers from range(populations[i]) for every row
+    # i. The j-th draw picks a rank among the values not chosen so far and
+    # shifts it past the already chosen ones in ascending order.
+    populations = np.asarray(populations, dtype=np.int64)
+    if np.any(populations < size):
+        raise Exception('Cannot sample {} distinct values from a population of {}'.format(
+            size, int(populations.min())))
+    chosen = np.empty((len(populations), 0), dtype=np.int64)
+    for j in range(size):
+        draws = np.floor(
+            random_state.random_sample(len(populations)) * (populations - j)
+        ).astype(np.int64)
+        for column in np.sort(chosen, axis=1).T:
+            draws += draws >= column
+        chosen = np.concatenate([chosen, draws[:, None]], axis=1)
+    return chosen
+
+
+class LabelIndex(object):
+    def __init__(self, labels):
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.order = np.argsort(self.labels, kind='stable')
+        self.unique_labels, self.counts = np.unique(self.labels, return_counts=True)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def num_labels(self):
+        return len(self.unique_labels)
+
+    def positions(self, labels):
+        return np.searchsorted(self.unique_labels, labels)
+
+    def members(self, label_positions, ranks):
+        return self.order[self.offsets[label_positions] + ranks]
+
+    def sample_groups(self, num_batches, num_groups, group_size,
+                      random_state=np.random):
+        eligible = np.nonzero(self.counts >= group_size)[0]
+        label_positions = eligible[sample_without_replacement(
+            np.full(num_batches, len(eligible)), num_groups, random_state)]
+        ranks = sample_without_replacement(
+            self.counts[label_positions.reshape(-1)], group_size, random_state)
+        indices = self.members(label_positions.reshape(-1)[:, None], ranks)
+        return indices.reshape(num_batches, num_groups * group_size)
+
+    def sample_uniform(self, num_batches, batch_size, random_state=np.random):
+        return sample_without_replacement(
+            np.full(num_batches, len(self.labels)), batch_size, random_state)
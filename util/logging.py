@@ -1,15 +1,11 @@
 import tensorflow as tf
 import os
 
-import boto3
 import datetime
 import json
 
 from util.config import CONFIG
-
-
-s3 = boto3.client('s3')
-db = boto3.resource('dynamodb')
+from util.uploader import get_uploader
 
 
 def get_run_name(conf):
@@ -20,7 +16,9 @@ def get_run_name(conf):
     ])
 
 
-def set_tensorboard_writer(conf, experiment_name):
+def set_tensorboard_writer(conf, experiment_name, run_dir=None):
+    # a resumed run passes the run_dir of the run it continues, so that its
+    # summaries and uploads go to the same place
     if not experiment_name:
         run_name = get_run_name(conf)
     else:
@@ -29,15 +27,15 @@ def set_tensorboard_writer(conf, experiment_name):
     local_tensorboard_dir = os.path.join(CONFIG['tensorboard']['local_dir'], 'tensorboard')
     if not tf.gfile.Exists(local_tensorboard_dir):
         tf.gfile.MakeDirs(local_tensorboard_dir)
-    dt = datetime.datetime.utcnow() + datetime.timedelta(hours=9)
-    run_dir = '{}_{}'.format(run_name, dt.strftime('%Y%m%d%H%M%S-%f'))
+    if run_dir is None:
+        dt = datetime.datetime.utcnow() + datetime.timedelta(hours=9)
+        run_dir = '{}_{}'.format(run_name, dt.strftime('%Y%m%d%H%M%S-%f'))
 
     if CONFIG['tensorboard'].getboolean('s3_upload'):
-        s3.put_object(
-            Bucket=CONFIG['tensorboard']['s3_bucket'],
-            Body='',
-            Key='{}/tensorboard/{}/'.format(CONFIG['tensorboard']['s3_key'], run_dir)
-        )
+        get_uploader().put_bytes(
+            '',
+            CONFIG['tensorboard']['s3_bucket'],
+            '{}/tensorboard/{}/'.format(CONFIG['tensorboard']['s3_key'], run_dir))
 
     print('Starting {}'.format(run_dir))
     writer = tf.contrib.summary.create_file_writer(
@@ -47,12 +45,12 @@ def set_tensorboard_writer(conf, experiment_name):
 
 
 def upload_tensorboard_log_to_s3(run_name):
-    run_dir = os.path.join(CONFIG['tensorboard']['local_dir'], 'tensorboard', run_name)
-    for filename in os.listdir(run_dir):
-        s3.upload_file(
-            os.path.join(run_dir, filename),
-            CONFIG['tensorboard']['s3_bucket'],
-            '{}/tensorboard/{}/{}'.format(CONFIG['tensorboard']['s3_key'], run_name, filename))
+    # returns right away; the uploader sends the files that changed since
+    # the last upload
+    get_uploader().sync_directory(
+        os.path.join(CONFIG['tensorboard']['local_dir'], 'tensorboard', run_name),
+        CONFIG['tensorboard']['s3_bucket'],
+        '{}/tensorboard/{}'.format(CONFIG['tensorboard']['s3_key'], run_name))
 
 
 def save_config(conf, run_name, experiment_name):
@@ -82,16 +80,15 @@ def save_config(conf, run_name, experiment_name):
             for name, value in conf_dict.items():
                 data['{}:{}'.format(key, name)] = str(value)
 
-        table = db.Table('Experiment')
-        table.put_item(Item=data)
+        get_uploader().put_item('Experiment', data)
 
 
 def upload_file_to_s3(file_path, bucket, key):
-    s3.upload_file(file_path, bucket, key)
+    get_uploader().put_file(file_path, bucket, key)
 
 
 def upload_string_to_s3(body, bucket, key):
-    s3.put_object(Bucket=bucket, Body=body, Key=key)
+    get_uploader().put_bytes(body, bucket, key)
 
 
 def create_checkpoint(checkpoint, run_name, s3_upload):
@@ -114,13 +111,13 @@ def create_checkpoint(checkpoint, run_name, s3_upload):
                 dest_filename = filename
                 if filename == 'checkpoint_compat':
                     dest_filename = 'checkpoint'
-                s3.upload_file(
+                # the local file is removed once it is uploaded
+                get_uploader().put_file(
                     os.path.join(root, filename),
                     CONFIG['tensorboard']['s3_bucket'],
                     '{}/experiments/{}/checkpoints/{}'.format(
                         CONFIG['tensorboard']['s3_key'],
                         run_name,
                         dest_filename
-                    )
-                )
-                os.remove(os.path.join(root, filename))
+                    ),
+                    remove=True)
@@ -0,0 +1,41 @@
+import tensorflow as tf
+
+tfe = tf.contrib.eager
+
+
+class MemoryBank(object):
+    # a FIFO of the most recent training embeddings and their labels; the
+    # embeddings are stored without gradients, so pairs with them only train
+    # the current batch
+    def __init__(self, size, dimension):
+        self.size = size
+        self.embeddings = tfe.Variable(
+            tf.zeros([size, dimension]), trainable=False, name='memory_bank_embeddings')
+        self.labels = tfe.Variable(
+            tf.zeros([size], dtype=tf.int64), trainable=False, name='memory_bank_labels')
+        self.position = tfe.Variable(0, dtype=tf.int64, trainable=False, name='memory_bank_position')
+        self.count = tfe.Variable(0, dtype=tf.int64, trainable=False, name='memory_bank_count')
+
+    def read(self):
+        # slots that were never written are left out
+        count = tf.convert_to_tensor(self.count)
+        return (
+            tf.convert_to_tensor(self.embeddings)[:count],
+            tf.convert_to_tensor(self.labels)[:count],
+        )
+
+    def enqueue(self, embeddings, labels):
+        # overwrites the oldest entries; only the last size rows are kept
+        # when more than size rows are enqueued at once
+        embeddings = tf.stop_gradient(tf.cast(embeddings, tf.float32))[-self.size:]
+        labels = tf.cast(labels, tf.int64)[-self.size:]
+        num_rows = tf.shape(labels, out_type=tf.int64)[0]
+        indices = (self.position + tf.range(num_rows, dtype=tf.int64)) % self.size
+        updates = [
+            tf.scatter_update(self.embeddings, indices, embeddings),
+            tf.scatter_update(self.labels, indices, labels),
+        ]
+        with tf.control_dependencies(updates):
+            return tf.group(
+                self.position.assign((self.position + num_rows) % self.size),
+                self.count.assign(tf.minimum(self.count + num_rows, self.size)))
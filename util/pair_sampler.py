@@ -0,0 +1,53 @@
+import numpy as np
+
+from util.label_index import LabelIndex
+from util.label_index import sample_without_replacement
+
+
+class PairSampler(object):
+    def __init__(self, labels, seed=0):
+        self.label_index = LabelIndex(labels)
+        self.random_state = np.random.RandomState(seed)
+
+    def uniform_members(self, label_positions):
+        counts = self.label_index.counts[label_positions]
+        ranks = np.floor(
+            self.random_state.random_sample(counts.shape) * counts
+        ).astype(np.int64)
+        return self.label_index.members(label_positions, ranks)
+
+    def positive_pairs(self, num_samples):
+        # a label with at least two images, chosen proportionally to its
+        # size, and two distinct images of it
+        counts = self.label_index.counts
+        eligible = np.nonzero(counts >= 2)[0]
+        if len(eligible) == 0:
+            raise Exception('No label has two or more images')
+        label_positions = eligible[self.random_state.choice(
+            len(eligible), size=num_samples, p=counts[eligible] / counts[eligible].sum())]
+        ranks = sample_without_replacement(counts[label_positions], 2, self.random_state)
+        pairs = self.label_index.members(label_positions[:, None], ranks)
+        return pairs[:, 0], pairs[:, 1]
+
+    def negative_pairs(self, num_samples):
+        # two images drawn uniformly, conditioned on having different labels;
+        # both images of a rejected pair are drawn again, so that a pair of
+        # labels is chosen in proportion to the product of their sizes
+        if self.label_index.num_labels < 2:
+            raise Exception('Negative pairs need at least two labels')
+        labels = self.label_index.labels
+        first = self.random_state.randint(len(labels), size=num_samples)
+        second = self.random_state.randint(len(labels), size=num_samples)
+        rejected = np.nonzero(labels[first] == labels[second])[0]
+        while len(rejected) > 0:
+            first[rejected] = self.random_state.randint(len(labels), size=len(rejected))
+            second[rejected] = self.random_state.randint(len(labels), size=len(rejected))
+            rejected = rejected[labels[first[rejected]] == labels[second[rejected]]]
+        return first, second
+
+    def distinct_label_members(self, num_samples, num_labels):
+        # one uniformly chosen image from each of num_labels distinct labels,
+        # with the labels chosen uniformly
+        label_positions = sample_without_replacement(
+            np.full(num_samples, self.label_index.num_labels), num_labels, self.random_state)
+        return self.uniform_members(label_positions)
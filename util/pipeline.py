@@ -0,0 +1,155 @@
+import tensorflow as tf
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+from util.config import CONFIG
+
+
+MAX_MEMORY_DATASETS = 4
+
+_memory_datasets = {}
+
+
+def _get(option, fallback):
+    if not CONFIG.has_section('pipeline'):
+        return fallback
+    return CONFIG['pipeline'].get(option, fallback)
+
+
+def num_parallel_calls():
+    value = int(_get('num_parallel_calls', -1))
+    return tf.data.experimental.AUTOTUNE if value < 0 else value
+
+
+def prefetch(dataset):
+    value = int(_get('prefetch_buffer_size', -1))
+    if value == 0:
+        return dataset
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE if value < 0 else value)
+
+
+def sample_ahead():
+    return int(_get('sample_ahead', 0))
+
+
+def cache_mode():
+    return _get('cache', '').strip()
+
+
+def cached_dataset(build_dataset, elements_digest, conf):
+    mode = cache_mode()
+    key = hashlib.sha1(json.dumps(
+        [conf['dataset'], conf['image'], elements_digest], sort_keys=True, default=str
+    ).encode('utf-8')).hexdigest()
+    if mode == 'memory':
+        # the same dataset object has to be reused for the in-memory cache
+        # to survive between evaluations
+        if key not in _memory_datasets:
+            if len(_memory_datasets) >= MAX_MEMORY_DATASETS:
+                _memory_datasets.clear()
+            _memory_datasets[key] = build_dataset().cache()
+        return _memory_datasets[key]
+    if not tf.gfile.Exists(mode):
+        tf.gfile.MakeDirs(mode)
+    return build_dataset().cache(os.path.join(mode, key))
+
+
+class BackgroundSampler(object):
+    # runs a generator on a daemon thread, keeping at most buffer_size items
+    # ready for the consumer. It can be iterated once; the thread stops when
+    # the iteration ends, is abandoned, or close() is called
+    def __init__(self, generate, buffer_size):
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.stopped = threading.Event()
+        self.iterated = False
+        self.thread = threading.Thread(target=self._run, args=(generate,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self, generate):
+        try:
+            for item in generate():
+                if not self._put(item):
+                    return
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+
+    def __iter__(self):
+        if self.iterated:
+            raise Exception('a BackgroundSampler can only be iterated once')
+        self.iterated = True
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self.stopped.is_set():
+                        return
+                    continue
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self.stopped.set()
+
+
+class ThroughputMonitor(object):
+    def __init__(self, iterable, batch_size):
+        self.iterable = iterable
+        self.batch_size = batch_size
+        self.input_seconds = 0.
+        self.step_seconds = 0.
+        self.num_batches = 0
+
+    def __iter__(self):
+        end = time.time()
+        for batch in self.iterable:
+            start = time.time()
+            self.input_seconds += start - end
+            yield batch
+            end = time.time()
+            self.step_seconds += end - start
+            self.num_batches += 1
+
+    def input_throughput(self):
+        return self.num_batches * self.batch_size / max(self.input_seconds, 1e-9)
+
+    def step_throughput(self):
+        return self.num_batches * self.batch_size / max(self.step_seconds, 1e-9)
+
+    def input_fraction(self):
+        return self.input_seconds / max(self.input_seconds + self.step_seconds, 1e-9)
+
+    def report(self):
+        return {
+            'input_images_per_second': self.input_throughput(),
+            'step_images_per_second': self.step_throughput(),
+            'input_wait_fraction': self.input_fraction(),
+        }
@@ -0,0 +1,81 @@
+import contextlib
+
+import tensorflow as tf
+
+tfe = tf.contrib.eager
+
+# tf.keras only accepts float16, float32 and float64 as floatx, so bfloat16
+# backbones cannot be built in this TensorFlow version
+PRECISIONS = {
+    'float32': tf.float32,
+    'float16': tf.float16,
+}
+
+
+def get_precision(conf):
+    precision = conf['model'].get('precision', 'float32')
+    if precision not in PRECISIONS:
+        raise Exception('Unsupported precision: {}'.format(precision))
+    return precision
+
+
+def compute_dtype(conf):
+    return PRECISIONS[get_precision(conf)]
+
+
+def is_mixed(conf):
+    return compute_dtype(conf) != tf.float32
+
+
+@contextlib.contextmanager
+def backbone_scope(conf):
+    # variables of functional keras models take their dtype from floatx when
+    # they are built
+    floatx = tf.keras.backend.floatx()
+    tf.keras.backend.set_floatx(get_precision(conf))
+    try:
+        yield
+    finally:
+        tf.keras.backend.set_floatx(floatx)
+
+
+def all_finite(tensors):
+    return tf.reduce_all([
+        tf.reduce_all(tf.is_finite(tensor)) for tensor in tensors if tensor is not None
+    ])
+
+
+class DynamicLossScale(object):
+    def __init__(self, initial_scale=2. ** 15, growth_interval=2000, factor=2.):
+        self.growth_interval = growth_interval
+        self.factor = factor
+        self.scale = tfe.Variable(initial_scale, trainable=False, dtype=tf.float32)
+        self.num_good_steps = tfe.Variable(0, trainable=False, dtype=tf.int64)
+
+    def scale_loss(self, loss_value):
+        return loss_value * self.scale
+
+    def unscale(self, grads):
+        return [
+            tf.cast(tf.convert_to_tensor(grad), tf.float32) / self.scale
+            if grad is not None else None
+            for grad in grads
+        ]
+
+    def update(self, grads):
+        # halves the scale on overflow and doubles it after growth_interval
+        # finite steps in a row; returns whether the gradients can be applied
+        finite = all_finite(grads)
+        grow = self.num_good_steps + 1 >= self.growth_interval
+        new_scale = tf.where(
+            finite,
+            tf.where(grow, self.scale * self.factor, self.scale),
+            tf.maximum(self.scale / self.factor, 1.))
+        new_num_good_steps = tf.where(
+            finite & ~grow,
+            self.num_good_steps + 1,
+            tf.zeros_like(self.num_good_steps))
+        with tf.control_dependencies([new_scale, new_num_good_steps]):
+            self.scale.assign(new_scale)
+            self.num_good_steps.assign(new_num_good_steps)
+        return finite
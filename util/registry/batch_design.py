@@ -1,6 +1,24 @@
+import numpy as np
 import tensorflow as tf
 
 from util.registry.class_registry import ClassRegistry
+from util.file_table import get_file_table
+from util import pipeline
+
+SHARD_CHUNK_SIZE = 64
+
+
+def shard_images_dataset(shards, rows, chunk_size=SHARD_CHUNK_SIZE):
+    # the images of rows in order; the memory map is read a chunk of rows at
+    # a time instead of through one python call per image
+    def generate():
+        for start in range(0, len(rows), chunk_size):
+            yield shards.read_rows(rows[start:start + chunk_size])
+    return tf.data.Dataset.from_generator(
+        generate,
+        tf.uint8,
+        tf.TensorShape([None] + list(shards.image_shape)),
+    ).apply(tf.data.experimental.unbatch())
 
 
 class BatchDesign(object, metaclass=ClassRegistry):
@@ -11,39 +29,151 @@ class BatchDesign(object, metaclass=ClassRegistry):
         self.conf = conf
         self.extra_info = extra_info
         self.data_loader = extra_info.get('data_loader')
+        self.samplers = set()
 
-    def _create_datasets_from_elements(self, elements, testing=False):
-        image_files, labels = zip(*elements)
-        images_ds = tf.data.Dataset.from_tensor_slices(
-            tf.constant(image_files)
-        ).map(self.data_loader.image_parse_function)
+    def _parse_functions(self, use_shards, testing):
+        parse_function = self.data_loader.shard_parse_function if use_shards \
+            else self.data_loader.image_parse_function
+        augmentations = []
         if 'random_flip' in self.conf['image'] and self.conf['image']['random_flip']:
-            images_ds = images_ds.map(self.data_loader.random_flip)
+            augmentations.append(self.data_loader.random_flip)
         if 'random_crop' in self.conf['image']:
             if testing:
-                images_ds = images_ds.map(self.data_loader.center_crop)
+                augmentations.append(self.data_loader.center_crop)
             else:
-                images_ds = images_ds.map(self.data_loader.random_crop)
-        labels_ds = tf.data.Dataset.from_tensor_slices(tf.constant(labels, dtype=tf.int64))
+                augmentations.append(self.data_loader.random_crop)
+
+        def augment(image):
+            for augmentation in augmentations:
+                image = augmentation(image)
+            return image
+        return parse_function, augment
+
+    def _image_shards(self, table):
+        # the image shards and the rows of the table's images in them, or
+        # None when the images are read from their files
+        shards = self.data_loader.get_image_shards()
+        if shards is None:
+            return None, None
+        rows = table.get_shard_rows(shards)
+        if rows is None:
+            return None, None
+        return shards, rows
+
+    def _create_datasets_from_indices(self, image_files, labels, indices, testing=False):
+        table = get_file_table(image_files, labels)
+        indices = np.asarray(indices, dtype=np.int32).reshape(-1)
+        shards, rows = self._image_shards(table)
+        parse_function, augment = self._parse_functions(rows is not None, testing)
+        if rows is not None:
+            def build_images_dataset(map_function):
+                return shard_images_dataset(shards, rows[indices]).map(
+                    map_function,
+                    num_parallel_calls=pipeline.num_parallel_calls())
+        else:
+            def build_images_dataset(map_function):
+                return tf.data.Dataset.from_tensor_slices(indices).map(
+                    lambda index: map_function(table.lookup_path(index)),
+                    num_parallel_calls=pipeline.num_parallel_calls())
+        if testing and pipeline.cache_mode():
+            # decoded images are cached before augmentation so that random
+            # augmentations still differ between passes
+            images_ds = pipeline.cached_dataset(
+                lambda: build_images_dataset(parse_function),
+                table.digest(indices),
+                self.conf,
+            ).map(augment, num_parallel_calls=pipeline.num_parallel_calls())
+        else:
+            # without a cache in between, decoding and augmentation run in
+            # one map
+            images_ds = build_images_dataset(lambda image: augment(parse_function(image)))
+        labels_ds = tf.data.Dataset.from_tensor_slices(table.labels[indices])
         return images_ds, labels_ds
 
+    def _create_streaming_dataset(self, image_files, labels, batch_conf):
+        table = get_file_table(image_files, labels)
+        shards, rows = self._image_shards(table)
+        parse_function, augment = self._parse_functions(rows is not None, testing=False)
+
+        def sampled_batches():
+            # every pass over the dataset samples on a sampler of its own,
+            # which stops when the pass ends or its iterator is released
+            sampler = pipeline.BackgroundSampler(
+                lambda: (
+                    (indices, table.labels[indices])
+                    for indices in self.sample_indices(image_files, labels, batch_conf)
+                ),
+                pipeline.sample_ahead())
+            self.samplers.add(sampler)
+            try:
+                for batch in sampler:
+                    yield batch
+            finally:
+                sampler.close()
+                self.samplers.discard(sampler)
+
+        if rows is not None:
+            # the images of a sampled batch are read from the memory map
+            # together
+            dataset = tf.data.Dataset.from_generator(
+                lambda: (
+                    (shards.read_rows(rows[indices]), labels)
+                    for indices, labels in sampled_batches()
+                ),
+                (tf.uint8, tf.int64),
+                (tf.TensorShape([None] + list(shards.image_shape)), tf.TensorShape([None])),
+            ).apply(tf.data.experimental.unbatch())
+            return dataset.map(
+                lambda image, label: (augment(parse_function(image)), label),
+                num_parallel_calls=pipeline.num_parallel_calls())
+        dataset = tf.data.Dataset.from_generator(
+            sampled_batches,
+            (tf.int32, tf.int64),
+            (tf.TensorShape([None]), tf.TensorShape([None])),
+        ).apply(tf.data.experimental.unbatch())
+        return dataset.map(
+            lambda index, label: (augment(parse_function(table.lookup_path(index))), label),
+            num_parallel_calls=pipeline.num_parallel_calls())
+
+    def _create_epoch_dataset(self, image_files, labels, batch_conf, testing=False):
+        num_batches = batch_conf['num_batches'] * batch_conf.get('combine_batches', 1)
+        if not testing and pipeline.sample_ahead() > 0:
+            return self._create_streaming_dataset(image_files, labels, batch_conf), \
+                num_batches * batch_conf['batch_size']
+        indices = np.concatenate(list(self.sample_indices(image_files, labels, batch_conf)))
+        return tf.data.Dataset.zip(
+            self._create_datasets_from_indices(image_files, labels, indices, testing),
+        ), len(indices)
+
+    def close_samplers(self):
+        # stops the background samplers of passes that were not finished
+        for sampler in list(self.samplers):
+            sampler.close()
+
     def get_next_batch(self, image_files, labels, batch_conf):
         raise NotImplementedError
 
-    def create_dataset(self, model, image_files, labels, batch_conf,
-                       testing=False):
-        data = []
+    def sample_indices(self, image_files, labels, batch_conf):
+        table = get_file_table(image_files, labels)
         for _ in range(batch_conf['num_batches'] * batch_conf.get('combine_batches', 1)):
             elements = self.get_next_batch(image_files, labels, batch_conf)
-            data += elements
+            yield table.indices([element[0] for element in elements])
 
-        return tf.data.Dataset.zip(
-            self._create_datasets_from_elements(data, testing),
-        ), len(data)
+    def create_dataset(self, model, image_files, labels, batch_conf,
+                       testing=False):
+        return self._create_epoch_dataset(image_files, labels, batch_conf, testing)
 
     def get_pairwise_distances(self, batch, model, distance_function, training=True):
         raise NotImplementedError
 
+    def get_pair_segments(self, values, matching_labels_matrix):
+        # splits values returned along with matching_labels_matrix by
+        # get_pairwise_distances into positive and negative pairs
+        return (
+            tf.boolean_mask(values, matching_labels_matrix),
+            tf.boolean_mask(values, ~matching_labels_matrix),
+        )
+
     def get_npair_distances(self, batch, model, n, distance_function, training=True):
         raise NotImplementedError
 
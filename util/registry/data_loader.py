@@ -1,4 +1,6 @@
 from util.registry.class_registry import ClassRegistry
+from util.image_shards import ImageShards
+from util.config import CONFIG
 
 import tensorflow as tf
 
@@ -17,6 +19,14 @@ class DataLoader(object, metaclass=ClassRegistry):
     def image_parse_function(self, filename):
         raise NotImplementedError
 
+    def get_image_shards(self):
+        if not CONFIG['dataset'].getboolean('use_image_shards', False):
+            return None
+        return ImageShards.load(self.conf)
+
+    def shard_parse_function(self, image):
+        return tf.cast(image, tf.float32)
+
     def random_crop(self, image):
         width = self.conf['image']['random_crop']['width']
         height = self.conf['image']['random_crop']['height']
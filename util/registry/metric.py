@@ -1,8 +1,18 @@
 from util.registry.class_registry import ClassRegistry
+from util.registry.batch_design import BatchDesign
+from util.registry.data_loader import DataLoader
 
 from tqdm import tqdm
+from util.embedding_store import get_embedding_store
+from util.embedding_store import model_fingerprint
+from util.precision import compute_dtype
+from util import pipeline
 
+import json
 import math
+import numpy as np
+import tensorflow as tf
+
 
 class Metric(object, metaclass=ClassRegistry):
     module_path = 'metric_learning.metrics'
@@ -19,25 +29,99 @@ class Metric(object, metaclass=ClassRegistry):
                 break
         self.extra_info = extra_info
 
+    def get_split(self):
+        return self.metric_conf['dataset']
+
+    def embedding_key(self):
+        # metrics that embed the same split with the same preprocessing and
+        # batch size share one set of embeddings
+        return json.dumps({
+            'split': self.get_split(),
+            'batch_design': self.metric_conf['batch_design'],
+            'image': self.conf['image'],
+        }, sort_keys=True)
+
+    def create_test_dataset(self, model, data_files):
+        conf = dict(self.conf)
+        conf['batch_design'] = self.metric_conf['batch_design']
+        batch_design = BatchDesign.create(
+            self.metric_conf['batch_design']['name'],
+            conf,
+            {'data_loader': DataLoader.create(self.conf['dataset']['name'], conf)})
+        image_files, labels = data_files[self.get_split()]
+        return batch_design.create_dataset(
+            model, image_files, labels,
+            self.metric_conf['batch_design'], testing=True)
+
+    def get_embedding_arrays(self, model, dataset, num_testcases):
+        # returns the embeddings of the split as one contiguous float32 array
+        # and its labels; the arrays are shared between metrics and must not
+        # be modified
+        key = self.embedding_key()
+        if key not in Metric.cache:
+            if dataset is None:
+                dataset, num_testcases = self.create_test_dataset(model, None)
+            Metric.cache[key] = self.compute_embeddings(model, dataset, num_testcases)
+        embeddings, labels = Metric.cache[key]
+        return embeddings.astype(np.float32, copy=False), labels
+
     def get_embeddings(self, model, dataset, num_testcases):
-        dataset_name = self.metric_conf['dataset']
-        if dataset_name in Metric.cache:
-            return Metric.cache[dataset_name]
+        embeddings, labels = self.get_embedding_arrays(model, dataset, num_testcases)
         batch_size = self.metric_conf['batch_design']['batch_size']
-        dataset = dataset.batch(batch_size)
+        return (
+            [tf.constant(embeddings[i:i + batch_size]) for i in range(0, len(labels), batch_size)],
+            [tf.constant(labels[i:i + batch_size]) for i in range(0, len(labels), batch_size)],
+        )
+
+    def compute_embeddings(self, model, dataset, num_testcases):
+        # embeddings are kept in the compute precision of the model and
+        # converted to float32 when a metric asks for them
+        dtype = compute_dtype(self.conf).as_numpy_dtype
+        batch_size = self.metric_conf['batch_design']['batch_size']
+
+        store = get_embedding_store()
+        if store is not None:
+            key = store.key(
+                checkpoint=model_fingerprint(model),
+                dataset=self.conf['dataset'],
+                split=self.get_split(),
+                image=self.conf['image'],
+                model=self.conf['model'],
+                num_testcases=num_testcases,
+            )
+            cached = store.get(key)
+            if cached is not None:
+                embeddings, labels = cached
+                return embeddings.astype(dtype, copy=False), labels
+
+        dataset = pipeline.prefetch(dataset.batch(batch_size))
         batches = tqdm(
             dataset,
             total=math.ceil(num_testcases / batch_size),
             desc='embedding',
             dynamic_ncols=True)
-        embeddings_list = []
-        labels_list = []
-        for images, labels in batches:
-            embeddings = model(images, training=False)
-            embeddings_list.append(embeddings)
-            labels_list.append(labels)
-        Metric.cache[dataset_name] = (embeddings_list, labels_list)
-        return Metric.cache[dataset_name]
+        # every batch is written into one preallocated array instead of being
+        # concatenated afterwards
+        embeddings = None
+        labels = np.empty(num_testcases, dtype=np.int64)
+        offset = 0
+        for images, batch_labels in batches:
+            batch_embeddings = model(images, training=False).numpy().astype(dtype, copy=False)
+            if embeddings is None:
+                embeddings = np.empty(
+                    (num_testcases, batch_embeddings.shape[1]), dtype=dtype)
+            end = offset + batch_embeddings.shape[0]
+            if end > len(labels):
+                raise Exception('Dataset has more than {} test cases'.format(num_testcases))
+            embeddings[offset:end] = batch_embeddings
+            labels[offset:end] = batch_labels.numpy()
+            offset = end
+        if embeddings is None:
+            raise Exception('Dataset has no test cases')
+        embeddings, labels = embeddings[:offset], labels[:offset]
+        if store is not None:
+            store.put(key, embeddings, labels)
+        return embeddings, labels
 
     def compute_metric(self, model, test_ds, num_testcases):
         raise NotImplementedError
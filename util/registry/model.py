@@ -2,6 +2,9 @@ import tensorflow as tf
 
 from util.registry.class_registry import ClassRegistry
 from util.registry.loss_function import LossFunction
+from util.precision import compute_dtype
+from util.devices import get_devices
+from util.devices import replicate
 from tensorflow.keras.layers import Dense
 
 
@@ -17,6 +20,15 @@ class Model(tf.keras.models.Model, metaclass=ClassRegistry):
         super(Model, self).__init__()
         self.conf = conf
         self.extra_info = extra_info
+        self.compute_dtype = compute_dtype(conf)
+        self.devices = get_devices(conf)
+        if len(self.devices) > 1:
+            print('Warning: the backbone runs separately on each of {} devices; batch '
+                  'normalization uses per-device batch statistics and updates its '
+                  'moving averages once per device'.format(len(self.devices)))
+            if not conf.get('trainer', {}).get('compile_step'):
+                print('Warning: without trainer.compile_step the {} devices run their '
+                      'shards one after another'.format(len(self.devices)))
 
         self.loss_function = LossFunction.create(conf['loss']['name'], conf, extra_info)
         for k, v in self.loss_function.extra_variables.items():
@@ -56,12 +68,24 @@ class Model(tf.keras.models.Model, metaclass=ClassRegistry):
                 ret[variable_name] = (lr, [variable])
         return ret
 
-    def call(self, inputs, training=None, mask=None):
-        ret = self.model(self.preprocess_image(inputs),
+    def embed(self, inputs, training=None, mask=None):
+        # the backbone runs in the configured precision while the embedding
+        # head, the distances and the loss stay in float32
+        ret = self.model(tf.cast(self.preprocess_image(inputs), self.compute_dtype),
                          training=training,
                          mask=mask)
+        ret = tf.cast(ret, tf.float32)
         if 'dimension' in self.conf['model']:
             ret = self.embedding(ret)
+        return ret
+
+    def call(self, inputs, training=None, mask=None):
+        # with several devices every device embeds a shard of the batch and
+        # the loss sees the embeddings of the whole batch
+        ret = replicate(
+            lambda shard: self.embed(shard, training=training, mask=mask),
+            inputs,
+            self.devices)
         if self.conf['model']['l2_normalize']:
             ret = tf.nn.l2_normalize(ret)
         return ret
@@ -0,0 +1,23 @@
+from util.registry.class_registry import ClassRegistry
+
+
+class NeighborIndex(object, metaclass=ClassRegistry):
+    module_path = 'metric_learning.neighbor_indices'
+
+    def __init__(self, conf, extra_info):
+        super(NeighborIndex, self).__init__()
+        self.conf = conf
+        self.extra_info = extra_info
+        self.distance_function = extra_info['distance_function']
+
+    def add(self, embeddings):
+        raise NotImplementedError
+
+    def search(self, queries, k, query_ids=None):
+        raise NotImplementedError
+
+    def pair_distances(self, first, second):
+        raise NotImplementedError
+
+    def __str__(self):
+        return self.name
@@ -1,32 +1,65 @@
+import numpy as np
 import tensorflow as tf
 
 from metric_learning.constants.distance_function import DistanceFunction
 
 
+def to_float32(tensor):
+    # distances between half precision embeddings are computed in float32
+    if tensor.dtype.base_dtype in (tf.float16, tf.bfloat16):
+        return tf.cast(tensor, tf.float32)
+    return tensor
+
+
 def compute_pairwise_distances(first, second, distance_function):
+    # every variant is computed from the [N, M] Gram matrix instead of the
+    # [N, M, D] broadcast difference
+    first = to_float32(first)
+    second = to_float32(second)
     if distance_function == DistanceFunction.COSINE_SIMILARITY:
         first_norm = first / tf.norm(first, axis=1, keep_dims=True)
         second_norm = second / tf.norm(second, axis=1, keep_dims=True)
-        return -tf.reduce_sum(
-            tf.multiply(second_norm[None], first_norm[:, None]),
-            axis=2)
+        return -tf.matmul(first_norm, second_norm, transpose_b=True)
     if distance_function == DistanceFunction.EUCLIDEAN_DISTANCE_SQUARED:
-        return tf.reduce_sum(
-            tf.square(second[None] - first[:, None]),
-            axis=2)
+        return pairwise_euclidean_distance_squared(first, second)
     if distance_function == DistanceFunction.EUCLIDEAN_DISTANCE:
-        return stable_sqrt(tf.reduce_sum(
-            tf.square(second[None] - first[:, None]),
-            axis=2))
+        return stable_sqrt(pairwise_euclidean_distance_squared(first, second))
     if distance_function == DistanceFunction.DOT_PRODUCT:
-        return -tf.reduce_sum(
-            tf.multiply(second[None], first[:, None]),
-            axis=2)
+        return -tf.matmul(first, second, transpose_b=True)
     raise Exception(
         'Unknown distance function with name {}'.format(distance_function))
 
 
+def pairwise_euclidean_distance_squared(first, second):
+    squared_distances = (
+        tf.reduce_sum(tf.square(first), axis=1)[:, None] +
+        tf.reduce_sum(tf.square(second), axis=1)[None] -
+        2 * tf.matmul(first, second, transpose_b=True)
+    )
+    # cancellation can make the distance of (nearly) equal vectors negative
+    return tf.maximum(squared_distances, 0)
+
+
+def broadcast_pairwise_distances(first, second, distance_function):
+    # the [N, M, D] formulation compute_pairwise_distances used to have; kept
+    # as the reference it is tested and benchmarked against
+    first = to_float32(first)
+    second = to_float32(second)
+    if distance_function == DistanceFunction.COSINE_SIMILARITY:
+        first_norm = first / tf.norm(first, axis=1, keep_dims=True)
+        second_norm = second / tf.norm(second, axis=1, keep_dims=True)
+        return -tf.reduce_sum(second_norm[None] * first_norm[:, None], axis=2)
+    if distance_function == DistanceFunction.EUCLIDEAN_DISTANCE_SQUARED:
+        return tf.reduce_sum(tf.square(second[None] - first[:, None]), axis=2)
+    if distance_function == DistanceFunction.EUCLIDEAN_DISTANCE:
+        return tf.sqrt(tf.maximum(
+            tf.reduce_sum(tf.square(second[None] - first[:, None]), axis=2), 1e-12))
+    return -tf.reduce_sum(second[None] * first[:, None], axis=2)
+
+
 def compute_elementwise_distances(first, second, distance_function):
+    first = to_float32(first)
+    second = to_float32(second)
     if distance_function == DistanceFunction.COSINE_SIMILARITY:
         first_norm = tf.norm(first, axis=1)
         second_norm = tf.norm(second, axis=1)
@@ -36,7 +69,7 @@ def compute_elementwise_distances(first, second, distance_function):
     if distance_function == DistanceFunction.EUCLIDEAN_DISTANCE:
         return stable_sqrt(tf.reduce_sum(tf.square(first - second), axis=1))
     if distance_function == DistanceFunction.DOT_PRODUCT:
-        return -tf.reduce_sum(tf.square(first - second), axis=1)
+        return -tf.reduce_sum(tf.multiply(first, second), axis=1)
     raise Exception(
         'Unknown distance function with name {}'.format(distance_function))
 
@@ -50,24 +83,67 @@ def pairwise_matching_matrix(first, second):
 
 
 def repeat_columns(labels):
-    return tf.tile(labels[:, None], [1, labels.shape[0]])
+    return tf.tile(labels[:, None], [1, tf.shape(labels)[0]])
+
+
+_static_indices = {}
+
+
+def static_indices(name, *shape):
+    # index sets only depend on the shape, so they are uploaded once and
+    # outside of any function that is being traced
+    key = (name,) + shape
+    if key not in _static_indices:
+        with tf.init_scope():
+            _static_indices[key] = tf.constant(
+                INDEX_FUNCTIONS[name](*shape), dtype=tf.int64)
+    return _static_indices[key]
+
+
+def upper_triangular_indices(n):
+    return np.stack(np.triu_indices(n, 1), axis=1)
+
+
+def off_diagonal_indices(n):
+    return np.stack(np.nonzero(~np.eye(n, dtype=bool)), axis=1)
+
+
+def upper_triangular_group_segments(n, group_size):
+    # positions of the pairs within and across consecutive groups of
+    # group_size rows in the output of upper_triangular_part
+    first, second = np.triu_indices(n, 1)
+    same_group = first // group_size == second // group_size
+    return np.stack([np.nonzero(same_group)[0], np.nonzero(~same_group)[0]])
+
+
+INDEX_FUNCTIONS = {
+    'upper_triangular': upper_triangular_indices,
+    'off_diagonal': off_diagonal_indices,
+    'upper_triangular_group_segments': upper_triangular_group_segments,
+}
 
 
 def upper_triangular_part(matrix):
-    a = tf.linalg.band_part(tf.ones(matrix.shape), -1, 0)
-    return tf.boolean_mask(matrix, 1 - a)
+    n = matrix.shape[0].value
+    if n is None:
+        a = tf.linalg.band_part(tf.ones(tf.shape(matrix)), -1, 0)
+        return tf.boolean_mask(matrix, tf.cast(1 - a, tf.bool))
+    return tf.gather_nd(matrix, static_indices('upper_triangular', n))
 
 
 def off_diagonal_part(matrix):
-    return tf.boolean_mask(matrix, 1 - tf.eye(int(matrix.shape[0])))
+    n = matrix.shape[0].value
+    if n is None:
+        return tf.boolean_mask(matrix, tf.cast(1 - tf.eye(tf.shape(matrix)[0]), tf.bool))
+    return tf.gather_nd(matrix, static_indices('off_diagonal', n))
 
 
 def stable_sqrt(tensor):
-    return tf.sqrt(tf.maximum(tensor, 1e-12))
+    return tf.sqrt(tf.maximum(to_float32(tensor), 1e-12))
 
 
 def get_n_blocks(tensor, n, transpose=False):
-    r = tf.range(tensor.shape[0])
+    r = tf.range(tf.shape(tensor)[0])
     mask = tf.equal(r[None] // n, r[:, None] // n)
     if transpose:
         return tf.transpose(
@@ -0,0 +1,110 @@
+import json
+import numpy as np
+import os
+import random
+import tensorflow as tf
+
+from decimal import Decimal
+
+from util.checkpoint import CheckpointManager
+from util.checkpoint import checkpoint_directory
+from util.checkpoint import get_rng_state
+from util.checkpoint import restore_variables
+from util.checkpoint import set_rng_state
+from util.uploader import LocalObjectStore
+from util.uploader import LocalTables
+from util.uploader import Uploader
+
+tf.enable_eager_execution()
+tfe = tf.contrib.eager
+
+
+class CheckpointTest(tf.test.TestCase):
+    def create_manager(self, name, keep=2):
+        return CheckpointManager(os.path.join(self.get_temp_dir(), name), keep)
+
+    def testSaveAndRestore(self):
+        manager = self.create_manager('save_restore')
+        variable = tfe.Variable([1., 2.])
+        manager.save(3, {'v': variable}, {'epoch': 1, 'loss': Decimal('0.25')})
+        # the values are copied before save returns
+        variable.assign([5., 6.])
+        manager.wait()
+        arrays, metadata = manager.latest()
+        self.assertEqual(metadata, {'epoch': 1, 'loss': Decimal('0.25')})
+        restore_variables({'v': variable}, arrays)
+        self.assertAllEqual(variable, [1., 2.])
+        manager.close()
+
+    def testKeepsLatestCheckpoints(self):
+        manager = self.create_manager('keep', keep=2)
+        variable = tfe.Variable(0.)
+        for step in [1, 2, 3]:
+            variable.assign(float(step))
+            manager.save(step, {'v': variable}, {'epoch': step})
+        manager.wait()
+        self.assertEqual(manager.steps(), [2, 3])
+        self.assertEqual(manager.latest()[1], {'epoch': 3})
+        manager.clear()
+        self.assertIsNone(manager.latest())
+        manager.close()
+
+    def testResumesFromUploadsOnAnotherHost(self):
+        directory = os.path.join(self.get_temp_dir(), 'uploads')
+        uploader = Uploader(
+            LocalObjectStore(os.path.join(directory, 's3')),
+            LocalTables(os.path.join(directory, 'dynamodb')))
+        manager = CheckpointManager(
+            os.path.join(directory, 'first_host'), 1, 'checkpoints/run', uploader)
+        variable = tfe.Variable(0.)
+        for step in [1, 2]:
+            variable.assign(float(step))
+            manager.save(step, {'v': variable}, {'epoch': step})
+        manager.close()
+        uploader.flush()
+        # the superseded upload is removed along with the local file
+        self.assertEqual(manager.uploaded_steps(), [2])
+
+        other = CheckpointManager(
+            os.path.join(directory, 'second_host'), 1, 'checkpoints/run', uploader)
+        arrays, metadata = other.latest()
+        self.assertEqual(metadata, {'epoch': 2})
+        self.assertAllEqual(arrays['v'], 2.)
+        other.clear()
+        self.assertEqual(other.uploaded_steps(), [])
+        other.close()
+
+    def testUnknownVariable(self):
+        with self.assertRaises(Exception):
+            restore_variables({}, {'v': np.zeros([2], dtype=np.float32)})
+
+    def testShapeMismatch(self):
+        with self.assertRaises(Exception):
+            restore_variables({'v': tfe.Variable([1., 2.])}, {'v': np.zeros([3], dtype=np.float32)})
+
+    def testRngStateRepeatsDraws(self):
+        state = json.loads(json.dumps(get_rng_state()), parse_float=Decimal)
+        draws = (random.random(), np.random.random_sample(3))
+        set_rng_state(state)
+        self.assertEqual(random.random(), draws[0])
+        self.assertAllEqual(np.random.random_sample(3), draws[1])
+
+    def testDirectoryDependsOnConfigurationAndJob(self):
+        conf = {'model': {'name': 'simple_dense'}, 'trainer': {'num_epochs': 2}}
+        self.assertEqual(
+            checkpoint_directory(conf, 'experiment', 'job'),
+            checkpoint_directory(dict(conf), 'experiment', 'job'))
+        self.assertNotEqual(
+            checkpoint_directory(conf, 'experiment', 'job'),
+            checkpoint_directory(dict(conf, trainer={'num_epochs': 3}), 'experiment', 'job'))
+        self.assertNotEqual(
+            checkpoint_directory(conf, 'experiment', 'job'),
+            checkpoint_directory(conf, 'other', 'job'))
+        # concurrent runs of one configuration keep their checkpoints apart
+        self.assertNotEqual(
+            checkpoint_directory(conf, 'experiment', 'job'),
+            checkpoint_directory(conf, 'experiment', 'other job'))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,57 @@
+import numpy as np
+import tensorflow as tf
+
+from util.clustering import assign
+from util.clustering import cluster
+from util.clustering import resolve_settings
+from util.clustering import squared_distances
+
+tf.enable_eager_execution()
+
+
+def make_blobs(num_clusters, size, random_state):
+    centers = random_state.randn(num_clusters, 8) * 10
+    labels = np.repeat(np.arange(num_clusters), size)
+    return centers[labels] + random_state.randn(len(labels), 8) * 0.1, labels
+
+
+def same_partition(first, second):
+    pairs = set(zip(first.tolist(), second.tolist()))
+    return len(pairs) == len(set(first.tolist())) == len(set(second.tolist()))
+
+
+class ClusteringTest(tf.test.TestCase):
+    def testAssign(self):
+        random_state = np.random.RandomState(0)
+        data = random_state.randn(100, 4)
+        centroids = random_state.randn(7, 4)
+        expected = np.argmin(squared_distances(data, centroids), axis=1)
+        self.assertAllEqual(assign(data, centroids), expected)
+        self.assertAllEqual(assign(data, centroids, chunk_size=16, num_threads=4), expected)
+
+    def testKMeans(self):
+        data, labels = make_blobs(5, 40, np.random.RandomState(0))
+        clusters, settings = cluster(data, 5, {'backend': 'kmeans'})
+        self.assertEqual(settings['backend'], 'kmeans')
+        self.assertTrue(same_partition(clusters, labels))
+
+    def testMiniBatchKMeans(self):
+        data, labels = make_blobs(5, 40, np.random.RandomState(0))
+        clusters, settings = cluster(data, 5, {'backend': 'minibatch', 'batch_size': 64})
+        self.assertEqual(settings['backend'], 'minibatch')
+        self.assertEqual(settings['batch_size'], 64)
+        self.assertTrue(same_partition(clusters, labels))
+
+    def testSeed(self):
+        data, _ = make_blobs(5, 40, np.random.RandomState(0))
+        first, _ = cluster(data, 8, {'backend': 'minibatch', 'seed': 3})
+        second, _ = cluster(data, 8, {'backend': 'minibatch', 'seed': 3})
+        self.assertAllEqual(first, second)
+
+    def testAutoBackend(self):
+        self.assertEqual(resolve_settings(1000, 10, {})['backend'], 'kmeans')
+        self.assertEqual(resolve_settings(60000, 11000, {})['backend'], 'minibatch')
+
+
+if __name__ == '__main__':
+    tf.test.main()
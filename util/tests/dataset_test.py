@@ -0,0 +1,31 @@
+import os
+import tensorflow as tf
+
+from util.dataset import FILE_INDEX_ENV
+from util.dataset import load_images_from_directory
+from util.dataset import write_file_index
+
+tf.enable_eager_execution()
+
+
+class DatasetTest(tf.test.TestCase):
+    def testFileIndex(self):
+        directory = os.path.join(self.get_temp_dir(), 'file_index', 'train')
+        for split, label, name in [(0, 'a', '1.jpg'), (0, 'b', '2.jpg'), (1, 'a', '3.jpg')]:
+            os.makedirs(os.path.join(directory, str(split), label), exist_ok=True)
+            open(os.path.join(directory, str(split), label, name), 'w').close()
+        expected = load_images_from_directory(directory, splits={0})
+        path = write_file_index(
+            [directory], os.path.join(self.get_temp_dir(), 'file_index.json'))
+        # the index is used even after the files are gone
+        os.remove(os.path.join(directory, '0', 'a', '1.jpg'))
+        os.environ[FILE_INDEX_ENV] = path
+        try:
+            self.assertEqual(load_images_from_directory(directory, splits={0}), expected)
+        finally:
+            del os.environ[FILE_INDEX_ENV]
+        self.assertEqual(len(load_images_from_directory(directory, splits={0})[0]), 1)
+
+
+if __name__ == '__main__':
+    tf.test.main()
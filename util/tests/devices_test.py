@@ -0,0 +1,40 @@
+import tensorflow as tf
+
+from util.devices import num_cpu_devices
+from util.devices import replicate
+
+tf.enable_eager_execution()
+
+
+class DevicesTest(tf.test.TestCase):
+    def testReplicateKeepsOrder(self):
+        inputs = tf.reshape(tf.range(14, dtype=tf.float32), [7, 2])
+        outputs = replicate(lambda x: x * 2, inputs, ['/cpu:0'] * 3)
+        self.assertAllEqual(outputs, inputs * 2)
+
+    def testShardsInterleaveRows(self):
+        inputs = tf.constant([[0.], [0.], [1.], [1.], [2.], [2.]])
+        shard_labels = []
+
+        def function(shard):
+            shard_labels.append(set(shard[:, 0].numpy()))
+            return shard
+        replicate(function, inputs, ['/cpu:0', '/cpu:0'])
+        # each shard gets one member of every group of two
+        self.assertEqual(shard_labels, [{0., 1., 2.}, {0., 1., 2.}])
+
+    def testReplicateGradients(self):
+        inputs = tf.constant([[1.], [2.], [3.]])
+        with tf.GradientTape() as tape:
+            tape.watch(inputs)
+            loss = tf.reduce_sum(replicate(tf.square, inputs, ['/cpu:0', '/cpu:0']))
+        self.assertAllEqual(tape.gradient(loss, inputs), 2 * inputs)
+
+    def testNumCpuDevices(self):
+        conf = {'trainer': {'devices': ['/cpu:0', '/cpu:3']}}
+        self.assertEqual(num_cpu_devices(conf), 4)
+        self.assertEqual(num_cpu_devices({'trainer': {}}), 1)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,50 @@
+import numpy as np
+import os
+import tensorflow as tf
+
+from util.embedding_store import EmbeddingStore
+
+tf.enable_eager_execution()
+
+
+class EmbeddingStoreTest(tf.test.TestCase):
+    def testPutGet(self):
+        store = EmbeddingStore(
+            os.path.join(self.get_temp_dir(), 'put_get'), 1024 * 1024, 'float16')
+        key = store.key(checkpoint='abc', split='test')
+        self.assertIsNone(store.get(key))
+        store.put(key, np.array([[1., 2.], [3., 4.]]), np.array([0, 1]))
+        embeddings, labels = store.get(key)
+        self.assertEqual(embeddings.dtype, np.float16)
+        self.assertAllEqual(embeddings, [[1., 2.], [3., 4.]])
+        self.assertAllEqual(labels, [0, 1])
+
+    def testKeyDependsOnAllParts(self):
+        self.assertEqual(
+            EmbeddingStore.key(checkpoint='abc', split='test'),
+            EmbeddingStore.key(split='test', checkpoint='abc'))
+        self.assertNotEqual(
+            EmbeddingStore.key(checkpoint='abc', split='test'),
+            EmbeddingStore.key(checkpoint='abc', split='train'))
+
+    def testLeastRecentlyUsedEviction(self):
+        directory = os.path.join(self.get_temp_dir(), 'eviction')
+        store = EmbeddingStore(directory, 1024 * 1024, 'float32')
+        embeddings = np.zeros([100, 128])
+        labels = np.zeros([100])
+        store.put('a', embeddings, labels)
+        store.put('b', embeddings, labels)
+        os.utime(os.path.join(directory, 'a'), (0, 0))
+        os.utime(os.path.join(directory, 'b'), (1, 1))
+        store.get('a')
+        entry_size = store.entries()[0][1]
+
+        store.max_size = entry_size * 2
+        store.put('c', embeddings, labels)
+        self.assertIsNotNone(store.get('a'))
+        self.assertIsNone(store.get('b'))
+        self.assertIsNotNone(store.get('c'))
+
+
+if __name__ == '__main__':
+    tf.test.main()
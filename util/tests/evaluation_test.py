@@ -0,0 +1,105 @@
+import numpy as np
+import tensorflow as tf
+import threading
+
+from util.evaluation import AsyncEvaluator
+from util.evaluation import EvaluationPlan
+from util.registry.metric import Metric
+
+tf.enable_eager_execution()
+
+
+class CountingMetric(Metric):
+    name = 'counting_test_metric'
+    datasets_created = 0
+
+    def create_test_dataset(self, model, data_files):
+        CountingMetric.datasets_created += 1
+        images, labels = data_files[self.get_split()]
+        return tf.data.Dataset.from_tensor_slices((images, labels)), len(labels)
+
+    def compute_metric(self, model, ds, num_testcases):
+        embeddings, labels = self.get_embedding_arrays(model, ds, num_testcases)
+        return {'sum': float(embeddings.sum()), 'shared': id(embeddings)}
+
+
+class OtherCountingMetric(CountingMetric):
+    name = 'other_counting_test_metric'
+
+
+class Model(object):
+    def __init__(self, conf):
+        self.conf = conf
+
+    def __call__(self, images, training=False):
+        return 2 * images
+
+
+class WeightsModel(object):
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weights(self):
+        return list(self.weights)
+
+    def set_weights(self, weights):
+        self.weights = list(weights)
+
+
+class EvaluationPlanTest(tf.test.TestCase):
+    def testEachSplitIsEmbeddedOnce(self):
+        batch_design = {'name': 'vanilla', 'batch_size': 2}
+        conf = {
+            'image': {},
+            'model': {},
+            'metrics': [
+                {'name': 'counting_test_metric', 'dataset': 'test', 'batch_design': batch_design},
+                {'name': 'other_counting_test_metric', 'dataset': 'test', 'batch_design': batch_design},
+            ],
+        }
+        data_files = {'test': (np.arange(10, dtype=np.float32).reshape(5, 2), np.arange(5))}
+        CountingMetric.datasets_created = 0
+        results = EvaluationPlan(conf, Model(conf), data_files).run(num_threads=2)
+        self.assertEqual(CountingMetric.datasets_created, 1)
+        self.assertEqual([metric.name for metric, _ in results],
+                         ['counting_test_metric', 'other_counting_test_metric'])
+        self.assertEqual(results[0][1]['sum'], 90.)
+        self.assertEqual(results[0][1]['shared'], results[1][1]['shared'])
+        self.assertEqual(Metric.cache, {})
+
+
+class AsyncEvaluatorTest(tf.test.TestCase):
+    def testSnapshotsAreEvaluatedInOrder(self):
+        release = threading.Event()
+
+        def evaluate(model, reference):
+            release.wait()
+            return model.get_weights()[0]
+
+        evaluator = AsyncEvaluator({}, evaluate, max_pending=2)
+        evaluator.model = WeightsModel([None])
+        model = WeightsModel([0])
+        for epoch in range(2):
+            model.weights[0] = epoch
+            evaluator.submit(model, epoch)
+        self.assertEqual(evaluator.completed(), [])
+        release.set()
+        model.weights[0] = 2
+        evaluator.submit(model, 2)
+        self.assertEqual(evaluator.completed(wait=True), [(0, 0), (1, 1), (2, 2)])
+        evaluator.close()
+
+    def testReferenceGetsItsSnapshot(self):
+        def evaluate(model, reference):
+            return model.get_weights()[0], reference.get_weights()[0]
+
+        evaluator = AsyncEvaluator({}, evaluate, reference=WeightsModel([None]))
+        evaluator.model = WeightsModel([None])
+        evaluator.submit(WeightsModel([1]), 'a', reference_weights=[1.5])
+        evaluator.submit(WeightsModel([2]), 'b', reference_weights=[2.5])
+        self.assertEqual(evaluator.completed(wait=True), [('a', (1, 1.5)), ('b', (2, 2.5))])
+        evaluator.close()
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,35 @@
+import numpy as np
+import tensorflow as tf
+
+from util.file_table import FileTable
+from util.file_table import get_file_table
+
+tf.enable_eager_execution()
+
+
+class FileTableTest(tf.test.TestCase):
+    def testIndices(self):
+        table = FileTable(['a.jpg', 'b.jpg', 'c.jpg'], [0, 1, 1])
+        self.assertAllEqual(table.indices(['c.jpg', 'a.jpg', 'c.jpg']), [2, 0, 2])
+        self.assertAllEqual(table.labels[[2, 0]], [1, 0])
+        self.assertEqual(table.paths[1], b'b.jpg')
+
+    def testDigest(self):
+        table = FileTable(['a.jpg', 'b.jpg', 'c.jpg'], [0, 1, 1])
+        self.assertEqual(table.digest(np.array([0, 1])), table.digest(np.array([0, 1])))
+        self.assertNotEqual(table.digest(np.array([0, 1])), table.digest(np.array([1, 0])))
+
+    def testLookup(self):
+        table = FileTable(['a.jpg', 'b.jpg', 'c.jpg'], [0, 1, 1])
+        self.assertEqual(table.lookup_path(tf.constant(2, dtype=tf.int32)).numpy(), b'c.jpg')
+
+    def testGetFileTableReusesTable(self):
+        image_files = ['a.jpg', 'b.jpg']
+        labels = [0, 1]
+        table = get_file_table(image_files, labels)
+        self.assertIs(get_file_table(image_files, labels), table)
+        self.assertIsNot(get_file_table(list(image_files), labels), table)
+
+
+if __name__ == '__main__':
+    tf.test.main()
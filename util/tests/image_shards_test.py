@@ -0,0 +1,25 @@
+import json
+import numpy as np
+import os
+import tensorflow as tf
+
+from util.image_shards import ImageShards
+
+tf.enable_eager_execution()
+
+
+class ImageShardsTest(tf.test.TestCase):
+    def testReadRows(self):
+        directory = self.get_temp_dir()
+        images = np.arange(4 * 2 * 2 * 1, dtype=np.uint8).reshape(4, 2, 2, 1)
+        np.save(os.path.join(directory, 'images.npy'), images)
+        with open(os.path.join(directory, 'index.json'), 'w') as f:
+            json.dump({'image': {}, 'files': ['a', 'b', 'c', 'd']}, f)
+        shards = ImageShards(directory)
+        self.assertAllEqual(shards.rows(['d', 'a']), [3, 0])
+        self.assertIsNone(shards.rows(['e']))
+        self.assertAllEqual(shards.read_rows([2, 0, 2]), images[[2, 0, 2]])
+
+
+if __name__ == '__main__':
+    tf.test.main()
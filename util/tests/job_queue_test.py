@@ -0,0 +1,72 @@
+import os
+import tensorflow as tf
+import time
+
+from util.job_queue import Heartbeat
+from util.job_queue import JobQueue
+from util.job_queue import num_unfinished
+
+tf.enable_eager_execution()
+
+
+class JobQueueTest(tf.test.TestCase):
+    def create_queue(self, name, **kwargs):
+        return JobQueue(os.path.join(self.get_temp_dir(), name + '.sqlite'), name, **kwargs)
+
+    def testSendReceiveDelete(self):
+        queue = self.create_queue('send_receive')
+        queue.send_message(
+            MessageBody='{"a": 1}',
+            MessageAttributes={'experiment_name': {'StringValue': 'x', 'DataType': 'String'}})
+        messages = queue.receive_messages(MessageAttributeNames=['experiment_name'])
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].body, '{"a": 1}')
+        self.assertEqual(messages[0].message_attributes['experiment_name']['StringValue'], 'x')
+        # leased messages are not handed to another consumer
+        self.assertEqual(queue.receive_messages(), [])
+        messages[0].delete()
+        self.assertEqual(queue.count(), 0)
+
+    def testExpiredLeaseIsRetried(self):
+        queue = self.create_queue('retry', visibility_timeout=0.1, max_receives=2)
+        queue.send_message(MessageBody='job')
+        first = queue.receive_messages()[0]
+        time.sleep(0.2)
+        second = queue.receive_messages()[0]
+        self.assertEqual(second.body, 'job')
+        # the consumer whose lease ran out cannot delete the message
+        first.delete()
+        self.assertEqual(queue.count(), 1)
+        time.sleep(0.2)
+        self.assertEqual(queue.receive_messages(), [])
+        self.assertEqual(queue.count('failed'), 1)
+
+    def testLeasedMessagesAreUnfinished(self):
+        queue = self.create_queue('unfinished')
+        queue.send_message(MessageBody='{}')
+        messages = queue.receive_messages()
+        # nothing can be received, but the leased job may still come back
+        self.assertEqual(queue.receive_messages(), [])
+        self.assertEqual(num_unfinished(queue), 1)
+        messages[0].delete()
+        self.assertEqual(num_unfinished(queue), 0)
+
+    def testHeartbeatExtendsLease(self):
+        queue = self.create_queue('heartbeat', visibility_timeout=0.2)
+        queue.send_message(MessageBody='job')
+        message = queue.receive_messages()[0]
+        with Heartbeat(message, 0.2, 0.05):
+            time.sleep(0.5)
+            self.assertEqual(queue.receive_messages(), [])
+
+    def testMessagesAreReceivedOnce(self):
+        queue = self.create_queue('once')
+        for i in range(5):
+            queue.send_message(MessageBody=str(i))
+        bodies = [m.body for m in queue.receive_messages(MaxNumberOfMessages=3)]
+        bodies += [m.body for m in queue.receive_messages(MaxNumberOfMessages=3)]
+        self.assertEqual(bodies, ['0', '1', '2', '3', '4'])
+
+
+if __name__ == '__main__':
+    tf.test.main()
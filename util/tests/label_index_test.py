@@ -0,0 +1,53 @@
+import numpy as np
+import tensorflow as tf
+
+from util.label_index import LabelIndex
+from util.label_index import sample_without_replacement
+
+tf.enable_eager_execution()
+
+
+class LabelIndexTest(tf.test.TestCase):
+    def testSampleWithoutReplacement(self):
+        random_state = np.random.RandomState(0)
+        samples = sample_without_replacement([3, 5, 10] * 100, 3, random_state)
+        self.assertEqual(samples.shape, (300, 3))
+        for population, row in zip([3, 5, 10] * 100, samples):
+            self.assertEqual(len(set(row)), 3)
+            self.assertTrue(all(0 <= x < population for x in row))
+
+    def testSampleWithoutReplacementIsUniform(self):
+        random_state = np.random.RandomState(0)
+        samples = sample_without_replacement([4] * 20000, 2, random_state)
+        counts = np.bincount(samples.reshape(-1), minlength=4) / samples.size
+        self.assertAllClose(counts, [0.25] * 4, atol=0.01)
+
+    def testCSRIndex(self):
+        index = LabelIndex([3, 1, 2, 3, 1, 1])
+        self.assertAllEqual(index.unique_labels, [1, 2, 3])
+        self.assertAllEqual(index.counts, [3, 1, 2])
+        self.assertAllEqual(index.order, [1, 4, 5, 2, 0, 3])
+        self.assertAllEqual(index.offsets, [0, 3, 4, 6])
+
+    def testSampleGroups(self):
+        labels = [3, 1, 2, 3, 1, 1, 4, 4]
+        index = LabelIndex(labels)
+        batches = index.sample_groups(50, 2, 2, np.random.RandomState(0))
+        self.assertEqual(batches.shape, (50, 4))
+        for batch in batches:
+            self.assertEqual(len(set(batch)), 4)
+            batch_labels = [labels[i] for i in batch]
+            self.assertEqual(batch_labels[0], batch_labels[1])
+            self.assertEqual(batch_labels[2], batch_labels[3])
+            self.assertNotEqual(batch_labels[0], batch_labels[2])
+            self.assertNotIn(2, batch_labels)
+
+    def testSampleUniform(self):
+        index = LabelIndex([0, 0, 1, 1, 2])
+        batches = index.sample_uniform(10, 5, np.random.RandomState(0))
+        for batch in batches:
+            self.assertEqual(sorted(batch), [0, 1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    tf.test.main()
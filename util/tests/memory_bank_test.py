@@ -0,0 +1,36 @@
+import tensorflow as tf
+
+from util.memory_bank import MemoryBank
+
+tf.enable_eager_execution()
+
+
+class MemoryBankTest(tf.test.TestCase):
+    def testReadOnlyReturnsWrittenRows(self):
+        bank = MemoryBank(4, 2)
+        bank.enqueue(tf.constant([[1., 1.], [2., 2.]]), tf.constant([1, 2]))
+        embeddings, labels = bank.read()
+        self.assertAllEqual(embeddings, [[1., 1.], [2., 2.]])
+        self.assertAllEqual(labels, [1, 2])
+
+    def testOldestRowsAreReplaced(self):
+        bank = MemoryBank(3, 1)
+        bank.enqueue(tf.constant([[1.], [2.]]), tf.constant([1, 2]))
+        bank.enqueue(tf.constant([[3.], [4.]]), tf.constant([3, 4]))
+        embeddings, labels = bank.read()
+        self.assertAllEqual(embeddings, [[4.], [2.], [3.]])
+        self.assertAllEqual(labels, [4, 2, 3])
+
+    def testNoGradientThroughBank(self):
+        bank = MemoryBank(2, 1)
+        x = tf.constant([[1.], [2.]])
+        with tf.GradientTape() as tape:
+            tape.watch(x)
+            bank.enqueue(x * 2, tf.constant([0, 1]))
+            embeddings, _ = bank.read()
+            loss = tf.reduce_sum(embeddings) + tf.reduce_sum(x)
+        self.assertAllEqual(tape.gradient(loss, x), [[1.], [1.]])
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,48 @@
+import numpy as np
+import tensorflow as tf
+
+from util.pair_sampler import PairSampler
+
+tf.enable_eager_execution()
+
+
+class PairSamplerTest(tf.test.TestCase):
+    def testPositivePairs(self):
+        labels = np.array([0, 1, 1, 2, 2, 2, 3])
+        first, second = PairSampler(labels).positive_pairs(1000)
+        self.assertTrue(np.all(labels[first] == labels[second]))
+        self.assertTrue(np.all(first != second))
+        # labels with two and three images are chosen in proportion 2:3
+        self.assertAllClose(np.mean(labels[first] == 2), 0.6, atol=0.05)
+
+    def testNegativePairs(self):
+        labels = np.array([0, 0, 0, 0, 1, 2])
+        first, second = PairSampler(labels).negative_pairs(1000)
+        self.assertTrue(np.all(labels[first] != labels[second]))
+
+    def testNegativePairFrequencies(self):
+        # label pairs are chosen in proportion to n_a * n_b: of the 18
+        # ordered pairs of images with different labels, 8 start in label 0
+        labels = np.array([0, 0, 0, 0, 1, 2])
+        first, second = PairSampler(labels).negative_pairs(20000)
+        self.assertAllClose(np.mean(labels[first] == 0), 8 / 18, atol=0.02)
+        self.assertAllClose(np.mean(labels[second] == 0), 8 / 18, atol=0.02)
+        self.assertAllClose(
+            np.mean((labels[first] == 1) & (labels[second] == 2)), 1 / 18, atol=0.01)
+
+    def testDistinctLabelMembers(self):
+        labels = np.array([0, 1, 1, 2, 2, 2, 3])
+        members = PairSampler(labels).distinct_label_members(100, 3)
+        self.assertEqual(members.shape, (100, 3))
+        for row in labels[members]:
+            self.assertEqual(len(set(row)), 3)
+
+    def testSeed(self):
+        labels = np.arange(100) // 3
+        self.assertAllEqual(
+            PairSampler(labels, seed=3).negative_pairs(10),
+            PairSampler(labels, seed=3).negative_pairs(10))
+
+
+if __name__ == '__main__':
+    tf.test.main()
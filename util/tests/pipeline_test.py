@@ -0,0 +1,61 @@
+import tensorflow as tf
+
+from util.pipeline import BackgroundSampler
+
+tf.enable_eager_execution()
+
+
+class BackgroundSamplerTest(tf.test.TestCase):
+    def testYieldsAllItemsInOrder(self):
+        sampler = BackgroundSampler(lambda: iter(range(100)), 4)
+        self.assertEqual(list(sampler), list(range(100)))
+
+    def testRaisesGeneratorErrors(self):
+        def generate():
+            yield 1
+            raise ValueError('broken sampler')
+        sampler = BackgroundSampler(generate, 4)
+        with self.assertRaises(ValueError):
+            list(sampler)
+
+    def testClose(self):
+        def generate():
+            while True:
+                yield 0
+        sampler = BackgroundSampler(generate, 2)
+        sampler.close()
+        sampler.thread.join(1)
+        self.assertFalse(sampler.thread.is_alive())
+
+    def testIteratesOnce(self):
+        sampler = BackgroundSampler(lambda: iter(range(3)), 2)
+        self.assertEqual(list(sampler), [0, 1, 2])
+        with self.assertRaises(Exception):
+            list(sampler)
+
+    def testAbandonedIterationStopsThread(self):
+        def generate():
+            while True:
+                yield 0
+        with BackgroundSampler(generate, 2) as sampler:
+            items = iter(sampler)
+            next(items)
+            items.close()
+            sampler.thread.join(1)
+            self.assertFalse(sampler.thread.is_alive())
+
+    def testCloseEndsIteration(self):
+        def generate():
+            while True:
+                yield 0
+        sampler = BackgroundSampler(generate, 2)
+        items = iter(sampler)
+        next(items)
+        sampler.close()
+        self.assertLessEqual(len(list(items)), 2)
+        sampler.thread.join(1)
+        self.assertFalse(sampler.thread.is_alive())
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,46 @@
+import numpy as np
+import tensorflow as tf
+
+from util.precision import DynamicLossScale
+from util.precision import compute_dtype
+from util.tensor_operations import stable_sqrt
+
+tf.enable_eager_execution()
+
+
+class PrecisionTest(tf.test.TestCase):
+    def testComputeDtype(self):
+        self.assertEqual(compute_dtype({'model': {}}), tf.float32)
+        self.assertEqual(compute_dtype({'model': {'precision': 'float16'}}), tf.float16)
+        with self.assertRaises(Exception):
+            compute_dtype({'model': {'precision': 'int8'}})
+
+    def testLossScaleBacksOffOnOverflow(self):
+        loss_scale = DynamicLossScale(initial_scale=8., growth_interval=2)
+        finite = loss_scale.update([tf.constant([1., np.inf])])
+        self.assertFalse(bool(finite))
+        self.assertEqual(float(loss_scale.scale), 4.)
+
+    def testLossScaleGrows(self):
+        loss_scale = DynamicLossScale(initial_scale=8., growth_interval=2)
+        loss_scale.update([tf.constant([1., 2.])])
+        self.assertEqual(float(loss_scale.scale), 8.)
+        loss_scale.update([tf.constant([1., 2.])])
+        self.assertEqual(float(loss_scale.scale), 16.)
+        self.assertEqual(int(loss_scale.num_good_steps), 0)
+
+    def testUnscale(self):
+        loss_scale = DynamicLossScale(initial_scale=4.)
+        grads = loss_scale.unscale([tf.constant([4., 8.], dtype=tf.float16), None])
+        self.assertEqual(grads[0].dtype, tf.float32)
+        self.assertAllClose(grads[0], [1., 2.])
+        self.assertIsNone(grads[1])
+
+    def testStableSqrtHalfPrecision(self):
+        y = stable_sqrt(tf.zeros([3], dtype=tf.float16))
+        self.assertEqual(y.dtype, tf.float32)
+        self.assertAllClose(y, [1e-6] * 3)
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -1,13 +1,17 @@
+import numpy as np
 import tensorflow as tf
 
 from util.tensor_operations import pairwise_matching_matrix
 from util.tensor_operations import upper_triangular_part
 from util.tensor_operations import compute_pairwise_distances
+from util.tensor_operations import compute_elementwise_distances
+from util.tensor_operations import broadcast_pairwise_distances
 from util.tensor_operations import repeat_columns
 from util.tensor_operations import pairwise_difference
 from util.tensor_operations import off_diagonal_part
 from util.tensor_operations import get_n_blocks
 from util.tensor_operations import pairwise_product
+from util.tensor_operations import upper_triangular_group_segments
 from metric_learning.constants.distance_function import DistanceFunction
 
 tf.enable_eager_execution()
@@ -57,6 +61,17 @@ class TensorOperationsTest(tf.test.TestCase):
             [3, 6, 9],
         ])
 
+    def testElementwiseDotProductMatchesPairwise(self):
+        first = tf.constant([[1., 2.], [3., -1.]])
+        second = tf.constant([[0., 1.], [2., 2.]])
+        pairwise = compute_pairwise_distances(first, second, DistanceFunction.DOT_PRODUCT)
+        self.assertAllClose(
+            compute_elementwise_distances(first, second, DistanceFunction.DOT_PRODUCT),
+            [pairwise[0, 0], pairwise[1, 1]])
+        self.assertAllClose(
+            compute_elementwise_distances(first, second, DistanceFunction.DOT_PRODUCT),
+            [-2., -4.])
+
     def testPairwiseMatching(self):
         labels = tf.constant([1, 1, 2, 2, 2, 1])
         y = pairwise_matching_matrix(labels, labels)
@@ -198,6 +213,38 @@ class TensorOperationsTest(tf.test.TestCase):
             [6, 9, 12],
         ])
 
+    def testPairwiseDistancesMatchBroadcast(self):
+        random_state = np.random.RandomState(0)
+        first = tf.constant(random_state.randn(7, 5), dtype=tf.float32)
+        second = tf.constant(random_state.randn(4, 5), dtype=tf.float32)
+        upstream = tf.constant(random_state.randn(7, 4), dtype=tf.float32)
+        for distance_function in DistanceFunction:
+            with tf.GradientTape(persistent=True) as tape:
+                tape.watch(first)
+                tape.watch(second)
+                expected = broadcast_pairwise_distances(first, second, distance_function)
+                actual = compute_pairwise_distances(first, second, distance_function)
+                expected_loss = tf.reduce_sum(expected * upstream)
+                actual_loss = tf.reduce_sum(actual * upstream)
+            self.assertAllClose(actual, expected, rtol=1e-4, atol=1e-4)
+            self.assertAllClose(
+                tape.gradient(actual_loss, [first, second]),
+                tape.gradient(expected_loss, [first, second]),
+                rtol=1e-4, atol=1e-4)
+
+    def testSelfDistancesAreClamped(self):
+        embeddings = tf.constant([[1e3, 1e3 + 1e-2], [1e3 + 1e-2, 1e3]])
+        y = compute_pairwise_distances(
+            embeddings, embeddings, DistanceFunction.EUCLIDEAN_DISTANCE_SQUARED)
+        self.assertTrue(np.all(y.numpy() >= 0))
+
+    def testUpperTriangularGroupSegments(self):
+        labels = tf.constant([5, 5, 3, 3, 9, 9])
+        matching_labels_matrix = upper_triangular_part(pairwise_matching_matrix(labels, labels))
+        positive, negative = upper_triangular_group_segments(6, 2)
+        self.assertAllEqual(positive, tf.where(matching_labels_matrix)[:, 0])
+        self.assertAllEqual(negative, tf.where(~matching_labels_matrix)[:, 0])
+
 
 if __name__ == '__main__':
     tf.test.main()
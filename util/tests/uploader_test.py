@@ -0,0 +1,111 @@
+import json
+import os
+import tensorflow as tf
+import threading
+
+from util.uploader import LocalObjectStore
+from util.uploader import LocalTables
+from util.uploader import Uploader
+
+tf.enable_eager_execution()
+
+
+class CountingStore(LocalObjectStore):
+    def __init__(self, directory, failures=0):
+        super(CountingStore, self).__init__(directory)
+        self.failures = failures
+        self.keys = []
+
+    def put_file(self, path, bucket, key):
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError('network down')
+        self.keys.append(key)
+        super(CountingStore, self).put_file(path, bucket, key)
+
+
+class FailingSyncUploader(Uploader):
+    def _sync(self, directory, bucket, prefix):
+        raise OSError('{} vanished'.format(directory))
+
+
+class BlockingTables(LocalTables):
+    def __init__(self, directory):
+        super(BlockingTables, self).__init__(directory)
+        self.released = threading.Event()
+
+    def put_items(self, table_name, items):
+        self.released.wait()
+        super(BlockingTables, self).put_items(table_name, items)
+
+
+class UploaderTest(tf.test.TestCase):
+    def create_uploader(self, name, failures=0):
+        directory = os.path.join(self.get_temp_dir(), name)
+        store = CountingStore(os.path.join(directory, 's3'), failures)
+        tables = LocalTables(os.path.join(directory, 'dynamodb'))
+        return directory, store, Uploader(store, tables, backoff_seconds=0.01)
+
+    def testIncrementalSync(self):
+        directory, store, uploader = self.create_uploader('sync')
+        run_dir = os.path.join(directory, 'run')
+        os.makedirs(run_dir)
+        for filename in ['a', 'b']:
+            with open(os.path.join(run_dir, filename), 'w') as f:
+                f.write(filename)
+        uploader.sync_directory(run_dir, 'bucket', 'logs')
+        uploader.flush()
+        with open(os.path.join(run_dir, 'b'), 'a') as f:
+            f.write('more')
+        uploader.sync_directory(run_dir, 'bucket', 'logs')
+        uploader.flush()
+        self.assertEqual(store.keys, ['logs/a', 'logs/b', 'logs/b'])
+        with open(os.path.join(directory, 's3', 'bucket', 'logs', 'b')) as f:
+            self.assertEqual(f.read(), 'bmore')
+
+    def testRetry(self):
+        directory, store, uploader = self.create_uploader('retry', failures=2)
+        path = os.path.join(directory, 'checkpoint')
+        with open(path, 'w') as f:
+            f.write('weights')
+        uploader.put_file(path, 'bucket', 'checkpoint', remove=True)
+        uploader.flush()
+        self.assertEqual(store.keys, ['checkpoint'])
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(uploader.failures, [])
+
+    def testItems(self):
+        directory, _, uploader = self.create_uploader('items')
+        uploader.put_item('TrainHistory', {'epoch': 1})
+        uploader.put_item('TrainHistory', {'epoch': 2})
+        uploader.update_item('Experiment', Key={'id': 'run'})
+        uploader.flush()
+        with open(os.path.join(directory, 'dynamodb', 'TrainHistory.jsonl')) as f:
+            self.assertEqual([json.loads(line)['put_item']['epoch'] for line in f], [1, 2])
+        with open(os.path.join(directory, 'dynamodb', 'Experiment.jsonl')) as f:
+            self.assertEqual(json.loads(f.readline())['update_item']['Key'], {'id': 'run'})
+
+    def testFailedRequestKeepsThreadRunning(self):
+        directory = os.path.join(self.get_temp_dir(), 'failing')
+        uploader = FailingSyncUploader(
+            LocalObjectStore(os.path.join(directory, 's3')),
+            LocalTables(os.path.join(directory, 'dynamodb')))
+        uploader.sync_directory(directory, 'bucket', 'logs')
+        self.assertTrue(uploader.flush(timeout=10))
+        self.assertEqual(len(uploader.failures), 1)
+        uploader.put_item('TrainHistory', {'epoch': 1})
+        self.assertTrue(uploader.flush(timeout=10))
+        self.assertTrue(uploader.thread.is_alive())
+
+    def testFlushTimeout(self):
+        directory = os.path.join(self.get_temp_dir(), 'timeout')
+        tables = BlockingTables(os.path.join(directory, 'dynamodb'))
+        uploader = Uploader(LocalObjectStore(os.path.join(directory, 's3')), tables)
+        uploader.put_item('TrainHistory', {'epoch': 1})
+        self.assertFalse(uploader.flush(timeout=0.05))
+        tables.released.set()
+        self.assertTrue(uploader.flush(timeout=10))
+
+
+if __name__ == '__main__':
+    tf.test.main()
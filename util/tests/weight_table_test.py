@@ -0,0 +1,38 @@
+import tensorflow as tf
+
+from util.weight_table import WeightTable
+from util.weight_table import get_weight_table
+
+tf.enable_eager_execution()
+
+
+class WeightTableTest(tf.test.TestCase):
+    def testWeights(self):
+        table = WeightTable([4, 2, 3], [1., 2., 3.], [1., 0.5, 2.], 10.)
+        labels = tf.constant([0, 0, 2])
+        matching_labels_matrix = tf.equal(labels[None], labels[:, None])
+        self.assertAllClose(table.weights(labels, labels, matching_labels_matrix), [
+            [1., 1., 20.],
+            [1., 1., 20.],
+            [20., 20., 3.],
+        ])
+
+    def testGetWeightTableIsCached(self):
+        extra_info = {'label_counts': [2, 2], 'num_images': 4, 'num_labels': 2}
+        tables = []
+
+        def create_table():
+            tables.append(WeightTable([2, 2], 1., 1., 1.))
+            return tables[-1]
+        first = get_weight_table(extra_info, 'test', create_table)
+        second = get_weight_table(extra_info, 'test', create_table)
+        self.assertIs(first, second)
+        self.assertEqual(len(tables), 1)
+
+        extra_info['num_images'] = 5
+        get_weight_table(extra_info, 'test', create_table)
+        self.assertEqual(len(tables), 2)
+
+
+if __name__ == '__main__':
+    tf.test.main()
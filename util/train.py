@@ -13,56 +13,85 @@ from util.dataset import get_training_files_labels
 from util.registry.data_loader import DataLoader
 from util.registry.batch_design import BatchDesign
 from util.registry.model import Model
-from util.registry.metric import Metric
 from util.logging import set_tensorboard_writer
 from util.logging import upload_tensorboard_log_to_s3
 from util.logging import create_checkpoint
 from util.logging import save_config
-from util.logging import db
+from util.uploader import get_uploader
 from util.config import CONFIG
+from util.train_step import TrainStep
+from util.checkpoint import get_checkpoint_manager
+from util.checkpoint import get_rng_state
+from util.checkpoint import restore_variables
+from util.checkpoint import set_rng_state
+from util.evaluation import AsyncEvaluator
+from util.evaluation import EvaluationPlan
+from util.evaluation import copy_model
+from util.evaluation import placeholder_inputs
+from util import precision
+from util import pipeline
 
 
-def evaluate(conf, model, data_files, train_stat):
+def compute_metrics(conf, model, data_files, prefix=''):
+    # returns the scores and the summaries to write for them; nothing is
+    # written here so that the metrics can also be computed off the main
+    # thread
     data = {}
-    data_loader = DataLoader.create(conf['dataset']['name'], conf)
-    Metric.cache.clear()
+    summaries = []
+    for metric, score in EvaluationPlan(conf, model, data_files).run():
+        if type(score) is dict:
+            for name, s in score.items():
+                summaries.append(('test ' + prefix + name, s))
+                data[prefix + name] = Decimal(str(s))
+        else:
+            summaries.append(('{}{}'.format(prefix, metric.name), score))
+            data[prefix + metric.name] = Decimal(str(score))
+    return data, summaries
+
+
+def float32_reference_model(conf, model):
+    # built once per run; evaluations load the float32 master weights of the
+    # training step into it rather than the rounded float16 variables
+    reference_conf = dict(conf)
+    reference_conf['model'] = dict(conf['model'], precision='float32')
+    return copy_model(reference_conf, model)
+
+
+def run_evaluation(conf, model, data_files, reference=None):
+    data, summaries = compute_metrics(conf, model, data_files)
+    if reference is not None:
+        reference_data, reference_summaries = compute_metrics(
+            reference.conf, reference, data_files, prefix='fp32 ')
+        summaries.extend(reference_summaries)
+        for metric, score in reference_data.items():
+            name = metric[len('fp32 '):]
+            summaries.append(('precision/' + name, float(data[name] - score)))
+            data[metric] = score
+    return data, summaries
+
+
+def report_evaluation(data, summaries, train_stat, step=None):
+    # step tags the summaries with the step the weights were taken at when
+    # the evaluation finished later than that
     with tf.contrib.summary.always_record_summaries():
-        for metric_conf in model.conf['metrics']:
-            if metric_conf['name'] == 'nmi' and conf['dataset']['name'] == 'stanford_online_product':
-                continue
-            conf_copy = {}
-            conf_copy.update(conf)
-            conf_copy['batch_design'] = metric_conf['batch_design']
-            batch_design = BatchDesign.create(
-                metric_conf['batch_design']['name'],
-                conf_copy,
-                {'data_loader': data_loader})
-            metric = Metric.create(metric_conf['name'], conf)
-            image_files, labels = data_files[metric_conf.get('dataset', 'test')]
-            test_dataset, num_testcases = batch_design.create_dataset(
-                model, image_files, labels,
-                metric_conf['batch_design'], testing=True)
-            score = metric.compute_metric(model, test_dataset, num_testcases)
-            if type(score) is dict:
-                for metric, s in score.items():
-                    tf.contrib.summary.scalar('test ' + metric, s)
-                    print('{}: {}'.format(metric, s))
-                    data[metric] = Decimal(str(s))
-            else:
-                tf.contrib.summary.scalar('{}'.format(metric_conf['name']), score)
-                print('{}: {}'.format(metric_conf['name'], score))
-                data[metric_conf['name']] = Decimal(str(score))
-    Metric.cache.clear()
+        for name, value in summaries:
+            tf.contrib.summary.scalar(name, value, step=step)
+    for name, value in summaries:
+        print('{}: {}'.format(name, value))
     if CONFIG['tensorboard'].getboolean('dynamodb_upload'):
         dt = datetime.datetime.utcnow() + datetime.timedelta(hours=9)
-        table = db.Table('TrainHistory')
         item = {'timestamp': dt.strftime('%Y-%m-%d %H:%M:%S')}
         item.update(train_stat)
         item.update(data)
-        table.put_item(Item=item)
+        get_uploader().put_item('TrainHistory', item)
     return data
 
 
+def evaluate(conf, model, data_files, train_stat, reference=None):
+    data, summaries = run_evaluation(conf, model, data_files, reference)
+    return report_evaluation(data, summaries, train_stat)
+
+
 def stopping_criteria(metrics):
     if len(metrics) <= 3:
         return False
@@ -100,7 +129,19 @@ def get_metric_to_report(metrics):
     return ret
 
 
-def train(conf, experiment_name):
+def create_train_dataset(conf, dataset, model, train_images, train_labels):
+    if conf['dataset'].get('num_labels'):
+        train_images, train_labels = get_training_files_labels(conf)
+    return dataset.create_dataset(
+        model,
+        train_images,
+        train_labels,
+        conf['batch_design'])
+
+
+def train(conf, experiment_name, job_id=None):
+    # job_id identifies the job across restarts, for example the id of its
+    # queue message; only runs with a job id resume from checkpoints
     print(json.dumps(conf, indent=4))
     data_loader = DataLoader.create(conf['dataset']['name'], conf)
     if conf['dataset']['cross_validation_split'] != -1:
@@ -117,7 +158,15 @@ def train(conf, experiment_name):
         'train': get_training_files_labels(conf),
     }
 
-    writer, run_name = set_tensorboard_writer(conf, experiment_name)
+    checkpoints = get_checkpoint_manager(conf, experiment_name, job_id)
+    resume = None
+    if checkpoints is not None:
+        resume = checkpoints.latest()
+        if resume is not None:
+            print('Resuming from epoch #{}'.format(resume[1]['epoch']))
+
+    writer, run_name = set_tensorboard_writer(
+        conf, experiment_name, resume[1]['run_name'] if resume is not None else None)
     if not experiment_name:
         experiment_name = run_name.rsplit('_', 1)[0]
     writer.set_as_default()
@@ -148,80 +197,149 @@ def train(conf, experiment_name):
         'id': run_name,
         'epoch': 0,
     }
-    if CONFIG['train'].getboolean('initial_evaluation'):
-        evaluate(conf, model, data_files, train_stat)
     step_counter = tf.train.get_or_create_global_step()
     step_counter.assign(0)
+    train_step = TrainStep(conf, model, dataset, optimizers)
+    reference = None
+    if precision.is_mixed(conf) and conf['model'].get('compare_precision'):
+        # the variables of model have to exist before they can be copied
+        model(placeholder_inputs(conf), training=False)
+        reference = float32_reference_model(conf, model)
+
+    def reference_model():
+        if reference is not None:
+            reference.set_weights(train_step.master_weights())
+        return reference
+
+    if CONFIG['train'].getboolean('initial_evaluation') and resume is None:
+        evaluate(conf, model, data_files, train_stat, reference_model())
+    log_every = conf['trainer'].get('log_every', 1)
+    s3_upload_period = int(CONFIG['tensorboard']['s3_upload_period'])
+    num_uploads = 0
 
     metrics = []
-    for epoch in range(conf['trainer']['num_epochs']):
-        if conf['dataset'].get('num_labels'):
-            train_images, train_labels = get_training_files_labels(conf)
-        train_ds, num_examples = dataset.create_dataset(
-            model,
-            train_images,
-            train_labels,
-            batch_design_conf)
-        train_ds = train_ds.batch(batch_design_conf['batch_size'],
-                                  drop_remainder=True)
-        batches = tqdm(train_ds,
+    start_epoch = 0
+    if resume is not None:
+        arrays, state = resume
+        train_step.initialize(placeholder_inputs(conf))
+        restore_variables(train_step.state_variables(), arrays)
+        train_step.num_applied = state['num_applied']
+        num_uploads = train_step.num_applied // s3_upload_period
+        train_stat = state['train_stat']
+        metrics = state['metrics']
+        # a run that stopped early does not train any further
+        start_epoch = conf['trainer']['num_epochs'] if state['stopped'] else state['epoch']
+        set_rng_state(state['rng_state'])
+    evaluator = None
+    if conf['trainer'].get('async_evaluation'):
+        # at most async_evaluation snapshots wait for evaluation before
+        # training blocks on the oldest one
+        evaluator = AsyncEvaluator(
+            conf,
+            lambda evaluation_model, evaluation_reference: run_evaluation(
+                conf, evaluation_model, data_files, evaluation_reference),
+            conf['trainer']['async_evaluation'],
+            reference)
+
+    def report_completed_evaluations(wait=False):
+        # results are reported in epoch order and early stopping looks at
+        # each of them as it arrives
+        stop = False
+        for (stat, step), (data, summaries) in evaluator.completed(wait):
+            metrics.append(report_evaluation(data, summaries, stat, step=step))
+            if conf['trainer']['early_stopping'] and stopping_criteria(metrics):
+                stop = True
+        return stop
+
+    for epoch in range(start_epoch, conf['trainer']['num_epochs']):
+        # the epoch is only sampled once it is known that it will be trained,
+        # so that no background sampler is left behind after early stopping
+        train_ds, num_examples = create_train_dataset(
+            conf, dataset, model, train_images, train_labels)
+        train_ds = pipeline.prefetch(train_ds.batch(batch_design_conf['batch_size'],
+                                                    drop_remainder=True))
+        throughput = pipeline.ThroughputMonitor(
+            train_ds, batch_design_conf['batch_size'])
+        batches = tqdm(throughput,
                        total=math.ceil(num_examples / batch_design_conf['batch_size']),
                        desc='epoch #{}'.format(epoch + 1),
                        dynamic_ncols=True)
         losses = []
-        batches_combined = 0
-        grads = None
-        for batch in batches:
-            with tf.contrib.summary.record_summaries_every_n_global_steps(
-                    CONFIG['tensorboard'].getint('record_every_n_global_steps'),
-                    global_step=step_counter):
-                with tf.GradientTape() as tape:
-                    loss_value = model.loss(batch, model, dataset)
-                    losses.append(float(loss_value))
+        if conf['batch_design'].get('negative_class_mining') or conf['dataset'].get('num_labels'):
+            # class weights and label statistics can change between epochs
+            # and would otherwise stay frozen in the traced step functions
+            train_step.retrace()
+        try:
+            for index, batch in enumerate(batches):
+                loss_value = train_step(batch)
+                losses.append(loss_value)
+                if (index + 1) % log_every == 0:
                     batches.set_postfix({'loss': float(loss_value)})
-                    tf.contrib.summary.scalar('loss', loss_value)
-
-                if grads is None:
-                    grads = tape.gradient(loss_value, model.variables)
-                else:
-                    for idx, g in enumerate(tape.gradient(loss_value, model.variables)):
-                        if g is None:
-                            continue
-                        if grads[idx] is None:
-                            grads[idx] = g
-                        else:
-                            grads[idx] += g
-                batches_combined += 1
-                if batches_combined == conf['batch_design']['combine_batches']:
-                    for optimizer_key, (_, variables) in model.learning_rates().items():
-                        filtered_grads = filter(lambda x: x[1] in variables, zip(grads, model.variables))
-                        optimizers[optimizer_key].apply_gradients(filtered_grads)
-                    batches_combined = 0
-                    grads = None
-                    step_counter.assign_add(1)
-                if CONFIG['tensorboard'].getboolean('s3_upload') and \
-                        int(step_counter) % int(CONFIG['tensorboard']['s3_upload_period']) == 0:
-                    upload_tensorboard_log_to_s3(run_name)
+                    with tf.contrib.summary.record_summaries_every_n_global_steps(
+                            CONFIG['tensorboard'].getint('record_every_n_global_steps'),
+                            global_step=step_counter):
+                        tf.contrib.summary.scalar('loss', loss_value)
+                    if CONFIG['tensorboard'].getboolean('s3_upload') and \
+                            train_step.num_applied // s3_upload_period > num_uploads:
+                        num_uploads = train_step.num_applied // s3_upload_period
+                        upload_tensorboard_log_to_s3(run_name)
+        finally:
+            # an epoch that ends early leaves no background sampler behind
+            dataset.close_samplers()
+        losses = [float(x) for x in tf.stack(losses).numpy()]
+        pipeline_report = throughput.report()
+        print('input: {:.1f} images/s, model: {:.1f} images/s, waiting on input {:.1%} of the time'.format(
+            pipeline_report['input_images_per_second'],
+            pipeline_report['step_images_per_second'],
+            pipeline_report['input_wait_fraction']))
+        with tf.contrib.summary.always_record_summaries():
+            for key, value in pipeline_report.items():
+                tf.contrib.summary.scalar('pipeline/{}'.format(key), value)
         print('epoch #{} checkpoint: {}'.format(epoch + 1, run_name))
         if CONFIG['tensorboard'].getboolean('enable_checkpoint'):
             create_checkpoint(checkpoint, run_name, CONFIG['tensorboard'].getboolean('s3_upload'))
         train_stat['epoch'] = epoch + 1
         train_stat['loss'] = Decimal(str(sum(losses) / len(losses)))
         print('average loss: {:.4f}'.format(sum(losses) / len(losses)))
-        if not conf['trainer']['evaluate_once']:
-            metrics.append(evaluate(conf, model, data_files, train_stat))
-        if conf['trainer']['early_stopping'] and stopping_criteria(metrics):
+        if not conf['trainer']['evaluate_once'] and evaluator is not None:
+            evaluator.submit(
+                model,
+                (dict(train_stat), int(step_counter)),
+                train_step.master_weights() if reference is not None else None)
+            stop = report_completed_evaluations()
+        else:
+            if not conf['trainer']['evaluate_once']:
+                metrics.append(evaluate(conf, model, data_files, train_stat, reference_model()))
+            stop = conf['trainer']['early_stopping'] and stopping_criteria(metrics)
+        if checkpoints is not None:
+            # the sampling state is taken before the next epoch is sampled,
+            # so that a resumed run samples the same batches for it.
+            # Evaluations still running in the background are not part of
+            # the checkpoint and are missing from a resumed run
+            checkpoints.save(int(step_counter), train_step.state_variables(), {
+                'run_name': run_name,
+                'epoch': epoch + 1,
+                'stopped': stop,
+                'num_applied': train_step.num_applied,
+                'train_stat': dict(train_stat),
+                'metrics': list(metrics),
+                'rng_state': get_rng_state(),
+            })
+        if stop:
             break
+    if evaluator is not None:
+        report_completed_evaluations(wait=True)
+        evaluator.close()
     if conf['dataset']['name'] == 'stanford_online_product':
         create_checkpoint(checkpoint, run_name, s3_upload=True)
     if conf['trainer']['evaluate_once']:
-        final_metrics = evaluate(conf, model, data_files, train_stat)
+        final_metrics = evaluate(conf, model, data_files, train_stat, reference_model())
     else:
         final_metrics = get_metric_to_report(metrics)
     if CONFIG['tensorboard'].getboolean('dynamodb_upload'):
-        table = db.Table('Experiment')
         for metric, score in final_metrics.items():
-            table.update_item(
+            get_uploader().update_item(
+                'Experiment',
                 Key={
                     'id': run_name,
                 },
@@ -233,3 +351,13 @@ def train(conf, experiment_name):
                     ':u': score,
                 },
             )
+    # the run only ends once its logs, checkpoints and items are shipped
+    if CONFIG['tensorboard'].getboolean('s3_upload'):
+        upload_tensorboard_log_to_s3(run_name)
+    get_uploader().flush()
+    if checkpoints is not None:
+        # the checkpoints only serve to resume this run, so a finished run
+        # starts over when it is run again
+        checkpoints.clear()
+        checkpoints.close()
+    return final_metrics
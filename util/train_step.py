@@ -0,0 +1,206 @@
+import tensorflow as tf
+
+from collections import OrderedDict
+
+from util import precision
+
+tfe = tf.contrib.eager
+
+
+def compile_function(function, xla=False):
+    def traced(*args):
+        if xla:
+            with tf.contrib.compiler.jit.experimental_jit_scope():
+                return function(*args)
+        return function(*args)
+    return tfe.defun(traced)
+
+
+class TrainStep(object):
+    def __init__(self, conf, model, dataset, optimizers):
+        self.model = model
+        self.dataset = dataset
+        self.combine_batches = conf['batch_design'].get('combine_batches', 1)
+        self.step_counter = tf.train.get_or_create_global_step()
+        self.optimizers = optimizers
+        self.compile = conf['trainer'].get('compile_step', False)
+        self.xla = conf['trainer'].get('xla', False)
+        self.loss_scale = precision.DynamicLossScale() if precision.is_mixed(conf) else None
+
+        self.variables = None
+        self.master_variables = None
+        self.variable_groups = None
+        self.accumulators = None
+        self.num_accumulated = 0
+        self.num_applied = 0
+        self.retrace()
+
+    def retrace(self):
+        self.compiled_accumulate = compile_function(self.accumulate, self.xla)
+        self.compiled_apply = compile_function(self.apply, self.xla)
+
+    def build(self, grads):
+        # the variables are grouped per optimizer once instead of being
+        # filtered on every step
+        self.variables = self.model.variables
+        positions = {id(variable): i for i, variable in enumerate(self.variables)}
+        self.variable_groups = [
+            (self.optimizers[k], [positions[id(variable)] for variable in variables
+                                  if id(variable) in positions])
+            for k, (_, variables) in self.model.learning_rates().items()
+        ]
+        # half precision variables are updated through float32 master copies
+        self.master_variables = [
+            tfe.Variable(tf.cast(variable, tf.float32), trainable=False)
+            if variable.dtype.base_dtype != tf.float32 else variable
+            for variable in self.variables
+        ]
+        if self.combine_batches > 1:
+            self.accumulators = [
+                tfe.Variable(tf.zeros_like(variable), trainable=False)
+                if grad is not None else None
+                for variable, grad in zip(self.master_variables, grads)
+            ]
+        # the optimizers would create their slots in the first apply, which
+        # is skipped when the initial loss scale overflows; slots created
+        # later would be created inside a traced step function instead
+        for optimizer, positions in self.variable_groups:
+            variables = [self.master_variables[i] for i in positions if grads[i] is not None]
+            if variables:
+                optimizer._create_slots(variables)
+
+    def initialize(self, inputs):
+        # creates the model variables, their master copies, the optimizer
+        # slots and the memory bank of the batch design before the first
+        # step, so that a checkpoint can be restored into them
+        embeddings = self.model(inputs, training=False)
+        grads = [
+            tf.zeros_like(variable, dtype=tf.float32) if variable.trainable else None
+            for variable in self.model.variables
+        ]
+        self.build(grads)
+        if getattr(self.dataset, 'uses_memory_bank', lambda: False)():
+            self.dataset.get_memory_bank(embeddings.shape[1].value)
+
+    def state_variables(self):
+        # the variables a resumed run needs, named by their position so that
+        # the names are the same for every run of a configuration
+        ret = OrderedDict()
+        for i, variable in enumerate(self.variables):
+            ret['model/{}'.format(i)] = variable
+        for i, (variable, master_variable) in enumerate(zip(self.variables, self.master_variables)):
+            if variable is not master_variable:
+                ret['master/{}'.format(i)] = master_variable
+            if self.accumulators is not None and self.accumulators[i] is not None:
+                ret['accumulator/{}'.format(i)] = self.accumulators[i]
+        for k in sorted(self.optimizers):
+            optimizer = self.optimizers[k]
+            slots = set()
+            for i, master_variable in enumerate(self.master_variables):
+                for slot_name in sorted(optimizer.get_slot_names()):
+                    slot = optimizer.get_slot(master_variable, slot_name)
+                    if slot is not None:
+                        ret['optimizer/{}/{}/{}'.format(k, i, slot_name)] = slot
+                        slots.add(id(slot))
+            for variable in optimizer.variables():
+                if id(variable) not in slots:
+                    ret['optimizer/{}/{}'.format(k, variable.name)] = variable
+        memory_bank = getattr(self.dataset, 'memory_bank', None)
+        if memory_bank is not None:
+            ret['memory_bank/embeddings'] = memory_bank.embeddings
+            ret['memory_bank/labels'] = memory_bank.labels
+            ret['memory_bank/position'] = memory_bank.position
+            ret['memory_bank/count'] = memory_bank.count
+        if self.loss_scale is not None:
+            ret['loss_scale/scale'] = self.loss_scale.scale
+            ret['loss_scale/num_good_steps'] = self.loss_scale.num_good_steps
+        ret['global_step'] = self.step_counter
+        return ret
+
+    def master_weights(self):
+        # the float32 values of the trained weights in the order of
+        # model.weights; the model's own values before the first step
+        variables = self.master_variables if self.master_variables is not None else self.model.variables
+        return [tf.cast(variable, tf.float32).numpy() for variable in variables]
+
+    def gradients(self, images, labels):
+        with tf.GradientTape() as tape:
+            loss_value = self.model.loss((images, labels), self.model, self.dataset)
+            if self.loss_scale is not None:
+                scaled_loss_value = self.loss_scale.scale_loss(loss_value)
+        variables = self.variables if self.variables is not None else self.model.variables
+        if self.loss_scale is None:
+            return loss_value, tape.gradient(loss_value, variables)
+        return loss_value, self.loss_scale.unscale(tape.gradient(scaled_loss_value, variables))
+
+    def accumulate_gradients(self, grads):
+        for accumulator, grad in zip(self.accumulators, grads):
+            if accumulator is not None and grad is not None:
+                accumulator.assign_add(tf.convert_to_tensor(grad))
+
+    def apply_gradients(self, grads):
+        if self.accumulators is not None:
+            grads = [
+                grad if accumulator is None else
+                accumulator if grad is None else accumulator + tf.convert_to_tensor(grad)
+                for accumulator, grad in zip(self.accumulators, grads)
+            ]
+        if self.loss_scale is None:
+            self.update_variables(grads)
+        else:
+            finite = self.loss_scale.update(grads)
+            tf.cond(finite, lambda: self.update_variables(grads), lambda: tf.constant(False))
+        if self.accumulators is not None:
+            for accumulator in self.accumulators:
+                if accumulator is not None:
+                    accumulator.assign(tf.zeros_like(accumulator))
+        self.step_counter.assign_add(1)
+
+    def update_variables(self, grads):
+        updates = []
+        for optimizer, positions in self.variable_groups:
+            grads_and_vars = [(grads[i], self.master_variables[i]) for i in positions
+                              if grads[i] is not None]
+            if grads_and_vars:
+                updates.append(optimizer.apply_gradients(grads_and_vars))
+        with tf.control_dependencies([x for x in updates if x is not None]):
+            for variable, master_variable in zip(self.variables, self.master_variables):
+                if variable is not master_variable:
+                    updates.append(variable.assign(tf.cast(master_variable, variable.dtype)))
+        with tf.control_dependencies([x for x in updates if x is not None]):
+            return tf.constant(True)
+
+    def accumulate(self, images, labels):
+        loss_value, grads = self.gradients(images, labels)
+        self.accumulate_gradients(grads)
+        return loss_value
+
+    def apply(self, images, labels):
+        loss_value, grads = self.gradients(images, labels)
+        self.apply_gradients(grads)
+        return loss_value
+
+    def __call__(self, batch):
+        self.num_accumulated += 1
+        apply = self.num_accumulated == self.combine_batches
+        if apply:
+            self.num_accumulated = 0
+        if self.variables is None:
+            # the first step runs eagerly to create the model variables
+            loss_value, grads = self.gradients(*batch)
+            self.build(grads)
+            if apply:
+                self.apply_gradients(grads)
+                self.num_applied += 1
+            else:
+                self.accumulate_gradients(grads)
+            return loss_value
+        # the optimizer slots were created by build, so the step functions
+        # can be traced from the second step on
+        compiled = self.compile
+        if apply:
+            self.num_applied += 1
+            function = self.compiled_apply if compiled else self.apply
+        else:
+            function = self.compiled_accumulate if compiled else self.accumulate
+        return function(*batch)
@@ -0,0 +1,282 @@
+import boto3
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+from util.config import CONFIG
+
+
+def _get(option, fallback):
+    if not CONFIG.has_section('uploader'):
+        return fallback
+    return CONFIG['uploader'].get(option, fallback)
+
+
+class S3Store(object):
+    def __init__(self):
+        self.client = boto3.client('s3')
+
+    def put_file(self, path, bucket, key):
+        self.client.upload_file(path, bucket, key)
+
+    def put_bytes(self, body, bucket, key):
+        self.client.put_object(Bucket=bucket, Body=body, Key=key)
+
+    def list_keys(self, bucket, prefix):
+        ret = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            ret.extend(item['Key'] for item in page.get('Contents', []))
+        return ret
+
+    def get_file(self, bucket, key, path):
+        self.client.download_file(bucket, key, path)
+
+    def delete(self, bucket, key):
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+
+class LocalObjectStore(object):
+    # stands in for S3 by copying objects to directory/bucket/key
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, bucket, key):
+        path = os.path.join(self.directory, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def put_file(self, path, bucket, key):
+        shutil.copyfile(path, self._path(bucket, key))
+
+    def put_bytes(self, body, bucket, key):
+        if key.endswith('/'):
+            os.makedirs(os.path.join(self.directory, bucket, key), exist_ok=True)
+            return
+        with open(self._path(bucket, key), 'wb') as f:
+            f.write(body.encode('utf-8') if isinstance(body, str) else body)
+
+    def list_keys(self, bucket, prefix):
+        root = os.path.join(self.directory, bucket)
+        ret = []
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(directory, filename), root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    ret.append(key)
+        return sorted(ret)
+
+    def get_file(self, bucket, key, path):
+        shutil.copyfile(os.path.join(self.directory, bucket, key), path)
+
+    def delete(self, bucket, key):
+        path = os.path.join(self.directory, bucket, key)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class DynamoDBTables(object):
+    def __init__(self):
+        self.db = boto3.resource('dynamodb')
+
+    def put_items(self, table_name, items):
+        # batch_writer groups the items into BatchWriteItem requests and
+        # resends unprocessed ones
+        with self.db.Table(table_name).batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+    def update_item(self, table_name, kwargs):
+        self.db.Table(table_name).update_item(**kwargs)
+
+
+class LocalTables(object):
+    # stands in for DynamoDB by appending every request to
+    # directory/<table>.jsonl
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _append(self, table_name, records):
+        with open(os.path.join(self.directory, table_name + '.jsonl'), 'a') as f:
+            for record in records:
+                f.write(json.dumps(record, default=str, sort_keys=True) + '\n')
+
+    def put_items(self, table_name, items):
+        self._append(table_name, [{'put_item': item} for item in items])
+
+    def update_item(self, table_name, kwargs):
+        self._append(table_name, [{'update_item': kwargs}])
+
+
+class Uploader(object):
+    # ships logs, checkpoints and table items on a background thread.
+    # Requests go through a bounded queue; directory syncs are dropped when
+    # it is full, since the next sync of the same directory catches up,
+    # while everything else waits for room. Each request is retried with
+    # exponential backoff before it is given up on; a request that fails in
+    # any other way is logged and dropped, so the thread keeps running.
+    def __init__(self, object_store, tables, queue_size=1000, max_retries=5,
+                 backoff_seconds=1., max_backoff_seconds=60., flush_timeout=600.):
+        self.object_store = object_store
+        self.tables = tables
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.flush_timeout = flush_timeout
+        self.requests = queue.Queue(maxsize=queue_size)
+        self.uploaded = {}
+        self.failures = []
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def sync_directory(self, directory, bucket, prefix):
+        try:
+            self.requests.put_nowait(('sync', (directory, bucket, prefix)))
+        except queue.Full:
+            pass
+
+    def put_file(self, path, bucket, key, remove=False):
+        self.requests.put(('file', (path, bucket, key, remove)))
+
+    def put_bytes(self, body, bucket, key):
+        self.requests.put(('bytes', (body, bucket, key)))
+
+    def put_item(self, table_name, item):
+        self.requests.put(('item', (table_name, item)))
+
+    def update_item(self, table_name, **kwargs):
+        self.requests.put(('update', (table_name, kwargs)))
+
+    def delete(self, bucket, key):
+        self.requests.put(('delete', (bucket, key)))
+
+    def flush(self, timeout=None):
+        # waits until every queued request is handled; returns False when
+        # requests are still pending after timeout seconds
+        if timeout is None:
+            timeout = self.flush_timeout
+        with self.requests.all_tasks_done:
+            done = self.requests.all_tasks_done.wait_for(
+                lambda: not self.requests.unfinished_tasks, timeout)
+        if not done:
+            print('uploader flush timed out with {} requests pending'.format(
+                self.requests.unfinished_tasks))
+        return done
+
+    def _run(self):
+        while True:
+            # everything that is already queued is handled together, so that
+            # items for the same table go out in one batch and repeated
+            # syncs of a directory collapse into one
+            requests = [self.requests.get()]
+            while True:
+                try:
+                    requests.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._handle(requests)
+            finally:
+                for _ in requests:
+                    self.requests.task_done()
+
+    def _handle(self, requests):
+        items = {}
+        syncs = []
+        for kind, args in requests:
+            if kind == 'item':
+                items.setdefault(args[0], []).append(args[1])
+            elif kind == 'sync':
+                if args not in syncs:
+                    syncs.append(args)
+            elif kind == 'file':
+                self._guard(self._retry, self._put_file, *args)
+            elif kind == 'bytes':
+                self._guard(self._retry, self.object_store.put_bytes, *args)
+            elif kind == 'update':
+                self._guard(self._retry, self.tables.update_item, *args)
+            elif kind == 'delete':
+                self._guard(self._retry, self.object_store.delete, *args)
+        for table_name, table_items in items.items():
+            self._guard(self._retry, self.tables.put_items, table_name, table_items)
+        for args in syncs:
+            self._guard(self._sync, *args)
+
+    def _guard(self, function, *args):
+        try:
+            function(*args)
+        except Exception as e:
+            print('upload request failed: {}'.format(e))
+            self.failures.append((function, args, e))
+
+    def _put_file(self, path, bucket, key, remove):
+        if remove and not os.path.exists(path):
+            # an earlier request uploaded and removed it already
+            return
+        self.object_store.put_file(path, bucket, key)
+        if remove:
+            os.remove(path)
+
+    def _sync(self, directory, bucket, prefix):
+        # only files that are new or changed since their last upload are
+        # sent; object stores cannot append, so a grown file is sent whole
+        if not os.path.isdir(directory):
+            return
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if not os.path.isfile(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed while the directory was being synced
+                continue
+            version = (stat.st_size, stat.st_mtime)
+            if self.uploaded.get(path) == version:
+                continue
+            if self._retry(self.object_store.put_file, path, bucket, '{}/{}'.format(prefix, filename)):
+                self.uploaded[path] = version
+
+    def _retry(self, function, *args):
+        for attempt in range(self.max_retries + 1):
+            try:
+                function(*args)
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print('upload failed after {} attempts: {}'.format(attempt + 1, e))
+                    self.failures.append((function, args, e))
+                    return False
+                time.sleep(min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds))
+
+
+_uploader = None
+
+_uploader_lock = threading.Lock()
+
+
+def get_uploader():
+    # uploads go to local stand-ins under [uploader] local_dir when it is
+    # set, and to S3 and DynamoDB otherwise
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None:
+            local_dir = _get('local_dir', '')
+            if local_dir:
+                object_store = LocalObjectStore(os.path.join(local_dir, 's3'))
+                tables = LocalTables(os.path.join(local_dir, 'dynamodb'))
+            else:
+                object_store = S3Store()
+                tables = DynamoDBTables()
+            _uploader = Uploader(
+                object_store,
+                tables,
+                queue_size=int(_get('queue_size', 1000)),
+                max_retries=int(_get('max_retries', 5)),
+                backoff_seconds=float(_get('backoff_seconds', 1)),
+                flush_timeout=float(_get('flush_timeout', 600)))
+        return _uploader
@@ -0,0 +1,49 @@
+import numpy as np
+import tensorflow as tf
+
+
+class WeightTable(object):
+    # the weight of a pair (i, j) is positive[label_i] when the labels match
+    # and negative_scale * negative_factor[label_i] * negative_factor[label_j]
+    # otherwise
+    def __init__(self, label_counts, positive, negative_factor, negative_scale):
+        num_labels = len(label_counts)
+        self.label_counts = tf.constant(label_counts, dtype=tf.float32)
+        self.positive = tf.constant(
+            np.broadcast_to(positive, [num_labels]), dtype=tf.float32)
+        self.negative_factor = tf.constant(
+            np.broadcast_to(negative_factor, [num_labels]), dtype=tf.float32)
+        self.negative_scale = float(negative_scale)
+
+    def positive_weights(self, labels):
+        return tf.gather(self.positive, labels)
+
+    def negative_weights(self, first_labels, second_labels):
+        return self.negative_scale * (
+            tf.gather(self.negative_factor, first_labels)[:, None] *
+            tf.gather(self.negative_factor, second_labels)[None])
+
+    def weights(self, first_labels, second_labels, matching_labels_matrix):
+        negative_weights = self.negative_weights(first_labels, second_labels)
+        positive_weights = self.positive_weights(first_labels)[:, None] * tf.ones_like(negative_weights)
+        return tf.where(matching_labels_matrix, positive_weights, negative_weights)
+
+
+MAX_WEIGHT_TABLES = 16
+
+_weight_tables = {}
+
+
+def get_weight_table(extra_info, key, create_table):
+    # tables only change with the label statistics, which are refreshed at
+    # most once per epoch
+    label_counts = extra_info['label_counts']
+    key = (key, id(label_counts), extra_info['num_images'], extra_info['num_labels'])
+    entry = _weight_tables.get(key)
+    if entry is None or entry[0] is not label_counts:
+        if len(_weight_tables) >= MAX_WEIGHT_TABLES:
+            _weight_tables.clear()
+        with tf.init_scope():
+            entry = (label_counts, create_table())
+        _weight_tables[key] = entry
+    return entry[1]